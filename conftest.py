@@ -0,0 +1 @@
+# makes the utils and str_derived_annotations directories importable when running pytest from the repository root
@@ -1,3 +1,5 @@
+import os
+
 import numpy as np
 
 """
@@ -6,8 +8,11 @@ that it cannot keep up with more efficient Needleman-Wunsch implementations.
 However, we have dependency free code! yeah!
 """
 
+BLOSUM62_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "blosum62.txt")
+
+
 class SubstitutionMatrix:
-    def __init__(self, data_file="blosum62.txt"):
+    def __init__(self, data_file=BLOSUM62_FILE):
 
         data = open(data_file, "r").readlines()
 
@@ -52,6 +57,18 @@ class SubstitutionMatrix:
 
         return self.matrix[(idx_one, idx_two)]
 
+    def GetIndices(self, seq):
+        """
+    Matrix indices of all one letter codes in a sequence. Letters that are
+    not in the matrix (e.g. X for unknown residues) get index 20.
+
+    :param seq:         String of one letter codes
+    """
+        lookup = np.full(128, 20, dtype=np.int64)
+        lookup[np.frombuffer(self.one_letter_codes.encode("ascii"), dtype=np.uint8)] = np.arange(20)
+        codes = np.frombuffer(seq.encode("ascii", errors="replace"), dtype=np.uint8)
+        return lookup[np.minimum(codes, 127)]
+
 
 def Align(s1, s2, gap_penalty=-8, subst_matrix=None):
     """
@@ -162,3 +179,134 @@ def Align(s1, s2, gap_penalty=-8, subst_matrix=None):
     aln_s2 = "".join(aln_s2)
 
     return (aln_s1, aln_s2)
+
+
+def AlignVectorized(s1, s2, gap_penalty=-8, subst_matrix=None, mode="global"):
+    """
+    Aligns two raw strings like Align, but fills the scoring matrix one row at
+    a time with numpy operations and supports three alignment modes:
+
+    - global: Needleman-Wunsch, same scoring as Align
+    - semiglobal: end gaps are free in both sequences, e.g. to place a
+                  structure's observed sequence (possibly with tags) on a
+                  full length UniProt sequence
+    - local: Smith-Waterman
+
+    In semiglobal and local mode, unaligned ends are returned gapped against
+    each other, so removing the gaps still gives the input sequences.
+    Letters not in the substitution matrix score 0 against everything.
+
+    :param s1:       String representing the first sequence
+    :param s2:       String representing the second sequence
+    :param gap_penalty: Penalty value for opening/extending a gap
+    :param subst_matrix: SubstitutionMatrix object for scoring,
+                         defaults to BLOSUM62 parametrization.
+    :param mode:     One of "global", "semiglobal" or "local"
+    """
+    if mode not in ("global", "semiglobal", "local"):
+        raise RuntimeError("mode must be one of global, semiglobal or local")
+
+    if subst_matrix is None:
+        subst_matrix = SubstitutionMatrix()
+
+    scores = np.zeros((21, 21))
+    scores[:20, :20] = subst_matrix.matrix
+    s1_indices = subst_matrix.GetIndices(s1)
+    s2_indices = subst_matrix.GetIndices(s2)
+
+    n_rows = len(s1) + 1
+    n_cols = len(s2) + 1
+    col_gaps = np.arange(n_cols) * float(gap_penalty)
+
+    # same backtrack encoding as in Align, 0 => stop
+    backtrack_matrix = np.zeros((n_rows, n_cols), dtype=np.int8)
+    if mode == "global":
+        backtrack_matrix[0, 1:] = 2
+        backtrack_matrix[1:, 0] = 3
+        prev_row = col_gaps.copy()
+    else:
+        prev_row = np.zeros(n_cols)
+
+    # best end point as (score, r_idx, c_idx)
+    if mode == "semiglobal":
+        best = (prev_row[-1], 0, n_cols - 1)
+    else:
+        best = (0.0, 0, 0)
+
+    # With a linear gap penalty, the horizontal dependency within a row
+    # H[j] = max(T[j], H[j - 1] + gap) resolves to a running maximum:
+    # H[j] = j * gap + max_{k <= j}(T[k] - k * gap)
+    # with T the best of the aligned and vertical gap options.
+    row = np.empty(n_cols)
+    for r_idx in range(1, n_rows):
+        aligned_score = prev_row[:-1] + scores[s1_indices[r_idx - 1], s2_indices]
+        s2_deletion_score = prev_row[1:] + gap_penalty
+        row[0] = r_idx * gap_penalty if mode == "global" else 0.0
+        row[1:] = np.maximum(aligned_score, s2_deletion_score)
+        if mode == "local":
+            np.maximum(row, 0.0, out=row)
+        best_vertical = row[1:].copy()
+        row = col_gaps + np.maximum.accumulate(row - col_gaps)
+
+        backtrack = np.where(aligned_score >= s2_deletion_score, 1, 3).astype(np.int8)
+        backtrack[row[1:] > best_vertical] = 2
+        if mode == "local":
+            backtrack[row[1:] <= 0] = 0
+            c_idx = int(np.argmax(row))
+            if row[c_idx] > best[0]:
+                best = (row[c_idx], r_idx, c_idx)
+        elif mode == "semiglobal" and row[-1] > best[0]:
+            best = (row[-1], r_idx, n_cols - 1)
+        backtrack_matrix[r_idx, 1:] = backtrack
+        prev_row, row = row, prev_row
+
+    if mode == "global":
+        r_idx, c_idx = n_rows - 1, n_cols - 1
+    elif mode == "semiglobal":
+        c_idx = int(np.argmax(prev_row))
+        if prev_row[c_idx] >= best[0]:
+            r_idx = n_rows - 1
+        else:
+            r_idx, c_idx = best[1], best[2]
+    else:
+        r_idx, c_idx = best[1], best[2]
+    end_r_idx, end_c_idx = r_idx, c_idx
+
+    path = list()
+    while backtrack_matrix[(r_idx, c_idx)] != 0:
+        path.append(backtrack_matrix[(r_idx, c_idx)])
+        if backtrack_matrix[(r_idx, c_idx)] == 1:
+            r_idx -= 1
+            c_idx -= 1
+        elif backtrack_matrix[(r_idx, c_idx)] == 2:
+            c_idx -= 1
+        else:
+            r_idx -= 1
+    path.reverse()
+
+    # unaligned leading ends
+    aln_s1 = [s1[:r_idx], "-" * c_idx]
+    aln_s2 = ["-" * r_idx, s2[:c_idx]]
+    s1_idx = r_idx
+    s2_idx = c_idx
+
+    for p in path:
+        if p == 1:
+            aln_s1.append(s1[s1_idx])
+            aln_s2.append(s2[s2_idx])
+            s1_idx += 1
+            s2_idx += 1
+        elif p == 2:
+            aln_s1.append("-")
+            aln_s2.append(s2[s2_idx])
+            s2_idx += 1
+        else:
+            aln_s1.append(s1[s1_idx])
+            aln_s2.append("-")
+            s1_idx += 1
+
+    # unaligned trailing ends
+    aln_s1.extend([s1[end_r_idx:], "-" * (n_cols - 1 - end_c_idx)])
+    aln_s2.extend(["-" * (n_rows - 1 - end_r_idx), s2[end_c_idx:]])
+
+    return ("".join(aln_s1), "".join(aln_s2))
@@ -13,34 +13,197 @@
 # 2. sensitivity to perturbation
 # 3. mechanical stiffness
 # 4. pca fluctuations obtained from different confirmations
+import functools
+import multiprocessing
 import os
 import tempfile
+import threading
 import typing
-from dataclasses import dataclass
+import warnings
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
 
 import numpy as np
-import prody as pd
-from matplotlib import cm
-from matplotlib import colors as mpl_colors
 
-from utils.sm_annotations import Annotation
+from str_derived_annotations.calpha_reader import CalphaAtoms, CalphaCache, file_checksum, read_calphas
+from str_derived_annotations.ensemble import (UniProtEnsemble, build_uniprot_ensemble, iterpose_pdb_ensemble,
+                                              member_mappers_from_reverse_index)
+from str_derived_annotations.sasa import ResidueSASA, residue_sasa
+from utils import lazy
+from utils.residue_map import ResidueMap, as_residue_map
+from utils.sm_annotations import Annotation, UploadError, post_many
 
+# Heavy dependencies are imported on first use, annotations referring to them are strings
+pd = lazy.lazy_import("prody")
+cm = lazy.lazy_import("matplotlib.cm")
+fetch = lazy.lazy_import("utils.fetch")
 
-def get_structures(structure_chain_id_pairs: typing.List[typing.Tuple[str, str]]):
+
+def get_calpha_cache() -> typing.Union[CalphaCache, None]:
+    """
+    C-alpha cache in the "calphas" folder of the fetch cache directory, None if the fetcher does not cache
+    """
+    cache_dir = fetch.get_fetcher().cache_dir
+    return CalphaCache(cache_dir / "calphas") if cache_dir is not None else None
+
+
+def _read_calphas(path: str, chain: str, cache: CalphaCache = None, checksum: str = None) -> CalphaAtoms:
+    """
+    Reads the C-alpha atoms of one chain of a structure file and adds them to the cache if given,
+    run in the worker processes of get_structures
+    """
+    calphas = read_calphas(path, chain=chain)
+    if not len(calphas):
+        raise ValueError(f"No C-alpha atoms found for chain {chain} in {path}")
+    if cache is not None:
+        cache.put(path, calphas, chain, checksum)
+    return calphas
+
+
+def _get_cached_calphas(pdb_id: str, chain: str, cache: CalphaCache = None):
+    """
+    Downloads a structure file, run in the download threads of get_structures
+
+    Returns
+    -------
+    (path, checksum, cached CalphaAtoms or None)
+    """
+    path = str(fetch.get_structure_file(pdb_id))
+    if cache is None:
+        return path, None, None
+    checksum = file_checksum(path)
+    return path, checksum, cache.get(path, chain, checksum)
+
+
+def load_calphas(pdb_id: str, chain: str = None, cache: CalphaCache = None) -> CalphaAtoms:
+    """
+    C-alpha atoms of one chain (all chains if None) of a PDB entry,
+    from the C-alpha cache (defaults to get_calpha_cache()) if possible
+    """
+    if cache is None:
+        cache = get_calpha_cache()
+    path, checksum, calphas = _get_cached_calphas(pdb_id, chain, cache)
+    if calphas is None:
+        calphas = _read_calphas(path, chain, cache, checksum)
+    return calphas
+
+
+def _parse_context():
+    """
+    Multiprocessing context of the parse workers of get_structures
     """
-    Gets ProDy AtomGroup objects for each (pdb_id, chain) pair
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+def get_structures(structure_chain_id_pairs: typing.List[typing.Tuple[str, str]], download_workers: int = 8,
+                   parse_workers: int = 1, errors: dict = None, cache: CalphaCache = None):
+    """
+    Gets ProDy AtomGroup objects of the C-alpha atoms for each (pdb_id, chain) pair
+    Files are downloaded into the fetch mirror directory by a thread pool. Chains found in the
+    C-alpha cache are loaded from there, all others are parsed (see calpha_reader) as soon as
+    they are downloaded and added to the cache.
+
+    Parsing runs in one background thread by default. With parse_workers > 1 it runs in a process
+    pool started with the "forkserver" method ("spawn" where that is not available), so the worker
+    processes import the __main__ module of the caller again: scripts using it have to keep their
+    top level code under an ``if __name__ == "__main__":`` guard.
+
+    Parameters
+    ----------
+    structure_chain_id_pairs
+        list of (pdb_id, chain) pairs, only one chain (the last given) is loaded per PDB ID
+    download_workers
+        number of concurrent downloads
+    parse_workers
+        number of parsing processes, 1 parses in a thread of this process
+    errors
+        if given, entries that fail to download or parse are skipped and reported
+        in this dictionary as {pdb_id: exception}, otherwise the first failure is raised
+    cache
+        CalphaCache, defaults to get_calpha_cache()
+
+    Returns
+    -------
+    list of AtomGroup objects in input order
     """
     pdb_to_chain = {p: c for p, c in structure_chain_id_pairs}
-    return [pd.parseCIF(x, chain=pdb_to_chain[x]) for x in pdb_to_chain.keys()]
+    pdb_ids = list(pdb_to_chain)
+    if not pdb_ids:
+        return []
+    if cache is None:
+        cache = get_calpha_cache()
+    parse_workers = min(parse_workers, len(pdb_ids))
+    parser = None
+    try:
+        with ThreadPoolExecutor(max_workers=min(download_workers, len(pdb_ids))) as downloader:
+            downloads = {downloader.submit(_get_cached_calphas, pdb_id, pdb_to_chain[pdb_id], cache): pdb_id
+                         for pdb_id in pdb_ids}
+            results = dict()
+            for future in as_completed(downloads):
+                pdb_id = downloads[future]
+                try:
+                    path, checksum, calphas = future.result()
+                except Exception as e:
+                    results[pdb_id] = e
+                    continue
+                if calphas is not None:
+                    results[pdb_id] = calphas
+                    continue
+                if parser is None:
+                    # only started when something needs to be parsed. Workers are not forked:
+                    # forking while the download threads run could copy locks they hold (logging,
+                    # the requests connection pool) into the children and deadlock them
+                    parser = ProcessPoolExecutor(max_workers=parse_workers, mp_context=_parse_context()) \
+                        if parse_workers > 1 else ThreadPoolExecutor(1)
+                results[pdb_id] = parser.submit(_read_calphas, path, pdb_to_chain[pdb_id], cache, checksum)
+        structures = []
+        for pdb_id in pdb_ids:
+            try:
+                result = results[pdb_id]
+                if isinstance(result, Exception):
+                    raise result
+                if isinstance(result, Future):
+                    result = result.result()
+                structures.append(result.to_atomgroup())
+            except Exception as e:
+                if errors is None:
+                    raise
+                errors[pdb_id] = e
+    finally:
+        if parser is not None:
+            parser.shutdown()
+    return structures
+
+
+def make_ensemble(structures: typing.List["pd.AtomGroup"], labels: typing.List[str] = None):
+    """
+    Builds an Ensemble object that superposes all member structures onto each other,
+    members are labelled with their titles unless labels are given
+    """
+    ensemble = pd.buildPDBEnsemble(structures, labels=labels, subset="calpha", superpose=False)
+    return iterpose_pdb_ensemble(ensemble)
 
 
-def make_ensemble(structures: typing.List[pd.AtomGroup]):
+def make_uniprot_ensemble(uniprot_id: str, structures: typing.List["pd.AtomGroup"],
+                          residue_mappers: typing.List[ResidueMap], labels: typing.List[str] = None):
     """
-    Builds an Ensemble object that superposes all member structures onto each other
+    Builds an Ensemble object in UniProt numbering from the PDB to UniProt mapping of each structure
+    (no sequence alignment, see ensemble.py) and superposes all members onto each other.
+    As with make_ensemble, the ensemble is restricted to the positions covered by the reference (first) structure.
+
+    Returns
+    -------
+    (ProDy PDBEnsemble, UniProtEnsemble)
     """
-    ensemble = pd.buildPDBEnsemble(structures, subset="calpha")
-    ensemble.iterpose()
-    return ensemble
+    reference = structures[0].select("calpha")
+    positions = as_residue_map(residue_mappers[0]).pdb_to_uniprot(reference.getResnums(), reference.getIcodes())
+    uniprot_ensemble = build_uniprot_ensemble(uniprot_id, structures, residue_mappers, labels=labels,
+                                              positions=np.unique(positions[positions >= 0]))
+    uniprot_ensemble.superpose()
+    ensemble = uniprot_ensemble.to_pdb_ensemble()
+    return ensemble, uniprot_ensemble
 
 
 def get_rmsds_to_reference(ensemble):
@@ -148,75 +311,255 @@ AA_SA_VOL = dict(zip(['ALA', 'ARG', 'ASP', 'ASN', 'CYS', 'GLU', 'GLN', 'GLY', 'H
                        170.,  200.,  185.,  210.,  145.,  115.,  140.,  255.,  230.,  155.]))
 
                                
-def get_relative_solvent_accessibility(pdb_id, residue_mapper, chain, full_pdb_solvent_accessibility=True, aa_surface_area=AA_SA_VOL):
+class StructureContext:
     """
-    Run DSSP on a PDB file and return the resulting AtomGroup
+    Everything loaded for one PDB entry during a run, shared by all annotation stages
+    The mmCIF file is downloaded once into the fetch mirror, C-alpha atoms come from the
+    C-alpha cache and the all-atom structure, SASA and DSSP results are computed at most once.
+
+    usage example:
+
+    context = StructureContext("6m71")
+    calphas = context.calphas("A").to_atomgroup()
+    dssp_atoms = context.dssp()
+    """
+
+    def __init__(self, pdb_id: str):
+        self.pdb_id = pdb_id
+        self._path = None
+        self._calphas = dict()
+        self._atoms = None
+        self._dssp = dict()
+        self._sasa = dict()
+        self._dssp_residues = dict()
+
+    @property
+    def path(self) -> str:
+        """
+        Local path of the mmCIF file
+        """
+        if self._path is None:
+            self._path = str(fetch.get_structure_file(self.pdb_id))
+        return self._path
+
+    def calphas(self, chain: str = None) -> CalphaAtoms:
+        """
+        C-alpha atoms of one chain (all chains if None), see load_calphas
+        """
+        if chain not in self._calphas:
+            self._calphas[chain] = load_calphas(self.pdb_id, chain)
+        return self._calphas[chain]
+
+    def atoms(self) -> "pd.AtomGroup":
+        """
+        All atoms of the entry, parsed once
+        """
+        if self._atoms is None:
+            self._atoms = pd.parseCIF(self.path)
+        return self._atoms
+
+    def sasa(self, chain: str = None) -> ResidueSASA:
+        """
+        Per-residue solvent accessible surface area of the protein heavy atoms (see sasa.py),
+        computed for the whole entry or for one chain on its own if chain is given
+        """
+        if chain not in self._sasa:
+            selection = "protein and not hydrogen"
+            if chain is not None:
+                selection += f" and chain {chain}"
+            self._sasa[chain] = residue_sasa(self.atoms().select(selection))
+        return self._sasa[chain]
+
+    def dssp_residues(self, chain: str = None) -> ResidueSASA:
+        """
+        Per-residue DSSP accessibilities (see dssp), from the DSSP cache in the "dssp" folder
+        of the fetch cache directory if possible. Results are cached by PDB ID, chain selection,
+        whether the whole entry was used and the checksum of the structure file.
+        """
+        if chain not in self._dssp_residues:
+            cache_path = None
+            cache_dir = fetch.get_fetcher().cache_dir
+            if cache_dir is not None:
+                full = "full" if chain is None else "chain"
+                cache_path = cache_dir / "dssp" / f"{self.pdb_id}_{chain or ''}_{full}_{file_checksum(self.path)}.npz"
+            if cache_path is not None and cache_path.exists():
+                residues = ResidueSASA.load(cache_path)
+            else:
+                structure = self.dssp(chain)
+                residues = ResidueSASA.from_atoms(structure, structure.getData("dssp_acc"), per_residue=True)
+                if cache_path is not None:
+                    cache_path.parent.mkdir(parents=True, exist_ok=True)
+                    tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+                    residues.save(tmp_path)
+                    os.replace(tmp_path, cache_path)
+            self._dssp_residues[chain] = residues
+        return self._dssp_residues[chain]
+
+    def dssp(self, chain: str = None) -> "pd.AtomGroup":
+        """
+        Atoms with DSSP data (see prody.parseDSSP) computed for the whole entry,
+        or for one chain on its own if chain is given
+        """
+        if chain not in self._dssp:
+            with tempfile.TemporaryDirectory() as tdir:
+                structure = self.atoms()
+                if chain is not None:
+                    # DSSP has to see the chain on its own
+                    structure = structure.select(f"chain {chain}")
+                structure = structure.copy()
+                # DSSP before version 4 only reads PDB files, and mkdssp 4 writes mmCIF output
+                # for mmCIF input, which parseDSSP can't read
+                input_file = os.path.join(tdir, f"{self.pdb_id}{chain or ''}.pdb")
+                pd.writePDB(input_file, structure)
+                # residues are looked up as (chain, resnum), which needs the mmCIF segment names removed
+                structure.setSegnames(np.full(structure.numAtoms(), ""))
+                # TODO how to silence output from the DSSP functions
+                dssp_file = pd.execDSSP(input_file, outputname=f"{self.pdb_id}{chain or ''}", outputdir=tdir)
+                pd.parseDSSP(dssp_file, structure)
+            self._dssp[chain] = structure
+        return self._dssp[chain]
+
+
+def _mapped_residue_accessibility(pdb_id, residue_mapper, chain, full_pdb_solvent_accessibility=True,
+                                  aa_surface_area=AA_SA_VOL, context: StructureContext = None,
+                                  backend="sasa") -> typing.Tuple[ResidueSASA, np.ndarray]:
+    """
+    Mapped residues of the chain (all chains if None) in structure order and their relative
+    solvent accessibility, see get_relative_solvent_accessibility
+    """
+    if context is None:
+        context = StructureContext(pdb_id)
+    if full_pdb_solvent_accessibility:
+        dssp_chain = None
+    else:
+        dssp_chain = chain
+    residue_mapper = as_residue_map(residue_mapper)
+    if backend == "sasa":
+        residues = context.sasa(dssp_chain)
+    elif backend == "dssp":
+        residues = context.dssp_residues(dssp_chain)
+    else:
+        raise ValueError(f"Unknown solvent accessibility backend {backend}, use sasa or dssp")
+    # mapped residues by residue number and insertion code, of all chains if chain is None
+    selected = residue_mapper.mask(residues.resnums, residues.icodes)
+    if chain is not None:
+        selected &= residues.chids == chain
+    selected = np.nonzero(selected)[0]
+    residues = ResidueSASA(residues.chids[selected], residues.resnums[selected], residues.icodes[selected],
+                           residues.resnames[selected], residues.sasa[selected])
+    return residues, residues.relative(aa_surface_area)
+
+
+def get_relative_solvent_accessibility(pdb_id, residue_mapper, chain, full_pdb_solvent_accessibility=True,
+                                       aa_surface_area=AA_SA_VOL, context: StructureContext = None,
+                                       backend="sasa"):
+    """
+    Compute the relative solvent accessibility of the mapped residues
     
     Parameters
     ----------
     pdb_id
         String containing PDB ID
     residue_mapper
-        Dictionary of residue - unitprot mappings
+        ResidueMap (or dictionary) of residue - uniprot mappings
     chain
-        String containing the selected chain ID(s) from the residue mapper
+        String containing the selected chain ID(s) from the residue mapper, None for all chains
     full_pdb_solvent_accessibility
         Boolean to use the full PDB for solvent accessibility calculations -- otherwise
         only the chain residues will be selected. Default is True.
     aa_surface_area
         Dictionary with amino acid abbreviations as keys and surface area 
-        calculations as values
+        calculations as values, residues of other types get NaN
+    context
+        StructureContext of the entry, to share loaded files and DSSP results with other stages
+    backend
+        "sasa" for the built-in Shrake-Rupley calculation (see sasa.py) or
+        "dssp" to run the external DSSP program, e.g. for validation
 
     Returns
     -------
-    a numpy array containing relative solvent accessibility measurement for residues
+    a numpy array containing relative solvent accessibility measurement for the mapped residues
+    (matched by residue number and insertion code), in structure order
     """
-    
-    if full_pdb_solvent_accessibility:
-        dssp_chain = None
-    else:
-        dssp_chain = chain
-        
-    with tempfile.TemporaryDirectory() as tdir:
-        pdb_file = os.path.join(tdir, '.'.join([pdb_id, 'pdb']))
-        dssp_file = os.path.join(tdir, '.'.join([pdb_id, 'dssp']))
-            
-        # DSSP doesn't work with CIF-based atom groups, so must re-run here
-        pd.pathPDBFolder(tdir)
-        structure = pd.parsePDB(pdb_id, chain=dssp_chain)
-        
-        # Must write PDB file for DSSP with only chain selections
-        # TODO how to silence output from the DSSP functions
-        pd.writePDB(pdb_file, structure) 
-        pd.execDSSP(pdb_file, outputdir=tdir) 
-        pd.parseDSSP(dssp_file, structure)
-
-    # Gather results
-    # There should not be missing residues 
-    mapped_residue_list = list(residue_mapper.keys())
-    mapped_residue_list = ' '.join([str(x) for x in mapped_residue_list])
-
-    selection_string = f"resnum {mapped_residue_list}"
-    if dssp_chain is not None:
-        selection_string += f" AND chain {chain}"
-        
-    iter_resi_list = sorted(set(structure.select(selection_string).getResnums()))
-    rel_acc_list = list()
-
-    for resi in iter_resi_list:
-        dssp_resi = structure[(chain, resi)]
-        surface_accessibilty = dssp_resi.getData('dssp_acc')[0]
-        resn = dssp_resi.getResname()
-        rel_surface_accessibilty = surface_accessibilty / aa_surface_area[resn]
-        rel_acc_list.append(rel_surface_accessibilty)
-
-    return np.array(rel_acc_list)
+    return _mapped_residue_accessibility(pdb_id, residue_mapper, chain,
+                                         full_pdb_solvent_accessibility=full_pdb_solvent_accessibility,
+                                         aa_surface_area=aa_surface_area, context=context, backend=backend)[1]
+
+
+def residue_values_per_atom(atoms, residues: ResidueSASA, values: np.ndarray) -> np.ndarray:
+    """
+    Aligns per-residue values to atoms by (chain, residue number, insertion code)
+
+    Parameters
+    ----------
+    atoms
+        ProDy atoms, e.g. C-alpha atoms
+    residues
+        residue table with the chain, residue number and insertion code of each value
+    values
+
+    Returns
+    -------
+    array with the value of the residue of each atom, NaN for atoms of residues without a value
+    """
+    lookup = {(str(c), int(r), str(i)): v for c, r, i, v in zip(residues.chids, residues.resnums, residues.icodes,
+                                                                values)}
+    return np.array([lookup.get((str(c), int(r), str(i)), np.nan)
+                     for c, r, i in zip(atoms.getChids(), atoms.getResnums(), atoms.getIcodes())], dtype=float)
+
+
+
+
+def get_relative_solvent_accessibilities(entries: typing.List[tuple], full_pdb_solvent_accessibility=True,
+                                         aa_surface_area=AA_SA_VOL, backend="sasa", max_workers=4):
+    """
+    get_relative_solvent_accessibility for many structures, running up to max_workers
+    calculations (e.g. DSSP processes) at once
+
+    Parameters
+    ----------
+    entries
+        list of (pdb_id, residue_mapper, chain) or (pdb_id, residue_mapper, chain, StructureContext)
+    full_pdb_solvent_accessibility, aa_surface_area, backend
+        see get_relative_solvent_accessibility
+    max_workers
+        number of concurrent calculations
+
+    Returns
+    -------
+    list of numpy arrays in the order of entries
+    """
+    if not entries:
+        return []
+
+    def run(entry):
+        pdb_id, residue_mapper, chain = entry[:3]
+        context = entry[3] if len(entry) > 3 else None
+        return get_relative_solvent_accessibility(pdb_id, residue_mapper, chain,
+                                                  full_pdb_solvent_accessibility=full_pdb_solvent_accessibility,
+                                                  aa_surface_area=aa_surface_area, context=context, backend=backend)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(entries))) as executor:
+        return list(executor.map(run, entries))
+
+
+@functools.lru_cache(maxsize=None)
+def _colormap_lut(cmap: str) -> np.ndarray:
+    """
+    Hex colors of a matplotlib colormap sampled at the centers of 256 equal bins of [0, 1],
+    followed by the colormap's color for invalid (NaN) values
+    """
+    colormap = cm.get_cmap(cmap)
+    rgb = np.vstack((colormap((np.arange(256) + 0.5) / 256), colormap.get_bad()))[:, :3]
+    return np.array(["#%02x%02x%02x" % tuple(c) for c in np.round(rgb * 255).astype(int)])
 
 
 def numbers_to_colors(numbers, cmap="jet", log=False):
     """
     Converts a list of real-valued numbers to colors according to a colormap
     used for plotting on a structure in SWISS-MODEL
+    Numbers are scaled to [0, 1] and looked up in a 256 color table of the colormap,
+    NaNs get the colormap's color for invalid values and are left out of the scaling.
     Parameters
     ----------
     numbers
@@ -228,50 +571,130 @@ def numbers_to_colors(numbers, cmap="jet", log=False):
 
     Returns
     -------
-
+    list of hex color strings
     """
+    numbers = np.asarray(numbers, dtype=float)
+    if not numbers.size:
+        return []
     if log:
         numbers = np.log1p(numbers)
-    norm = mpl_colors.Normalize(vmin=np.min(numbers), vmax=np.max(numbers))
-    colormap = cm.get_cmap(cmap)
-    return [colormap(norm(n))[:3] for n in numbers]
+    valid = ~np.isnan(numbers)
+    vmin, vmax = (np.min(numbers[valid]), np.max(numbers[valid])) if valid.any() else (0., 0.)
+    scaled = (numbers - vmin) / (vmax - vmin) if vmax > vmin else np.zeros_like(numbers)
+    indices = np.where(valid, np.clip(np.nan_to_num(scaled * 256), 0, 255).astype(int), 256)
+    return _colormap_lut(cmap)[indices].tolist()
+
+
+@dataclass
+class ResidueIndex:
+    """
+    Maps the C-alpha atoms of an annotated structure to PDB residue numbers, UniProt residue numbers
+    and (for ensembles) alignment columns, so that tracks are extracted by fancy-indexing
+    """
+    pdb_resnums: np.ndarray  # per C-alpha
+    pdb_icodes: np.ndarray  # per C-alpha
+    uniprot_resnums: np.ndarray  # per C-alpha, -1 if not mapped
+    columns: np.ndarray  # per C-alpha, ensemble alignment column, -1 if not aligned or no ensemble
+    mapped: np.ndarray  # indices of the C-alpha atoms with a UniProt residue (and column)
+
+    @classmethod
+    def build(cls, calphas, residue_mapper: ResidueMap, msa_row: np.ndarray = None,
+              column_positions: np.ndarray = None):
+        """
+        Parameters
+        ----------
+        calphas
+            ProDy C-alpha atoms
+        residue_mapper
+            ResidueMap of {pdb_resnum: uniprot_resnum}
+        msa_row
+            row of the reference in the ensemble MSA, its non-gap columns belong to the C-alpha atoms in order
+        column_positions
+            sorted UniProt residue numbers of the columns of an ensemble in UniProt numbering
+        """
+        pdb_resnums, pdb_icodes = calphas.getResnums(), calphas.getIcodes()
+        uniprot_resnums = residue_mapper.pdb_to_uniprot(pdb_resnums, pdb_icodes)
+        mapped = uniprot_resnums >= 0
+        columns = np.full(len(pdb_resnums), -1, dtype=np.int64)
+        if msa_row is not None:
+            aligned_columns = np.nonzero(np.asarray(msa_row) != b"-")[0]
+            n = min(len(aligned_columns), len(columns))
+            columns[:n] = aligned_columns[:n]
+            mapped &= columns >= 0
+        elif column_positions is not None and len(column_positions):
+            columns = np.minimum(np.searchsorted(column_positions, uniprot_resnums), len(column_positions) - 1)
+            columns = np.where(mapped & (column_positions[columns] == uniprot_resnums), columns, -1)
+            mapped &= columns >= 0
+        return cls(pdb_resnums, pdb_icodes, uniprot_resnums, columns, np.nonzero(mapped)[0])
+
+    @property
+    def uniprot_residues(self) -> list:
+        """
+        UniProt residue numbers of the mapped C-alpha atoms
+        """
+        return self.uniprot_resnums[self.mapped].tolist()
+
+    def take(self, values: np.ndarray, per_column: bool = False) -> np.ndarray:
+        """
+        Values of the mapped C-alpha atoms, from per-atom values or per alignment column values
+        """
+        indices = self.columns[self.mapped] if per_column else self.mapped
+        return np.asarray(values)[indices]
+
+    def track(self, values: np.ndarray, per_column: bool = False):
+        """
+        (UniProt residue, rounded value, color) rows of a numeric track
+        """
+        values = self.take(values, per_column)
+        return zip(self.uniprot_residues, np.round(values, 2), numbers_to_colors(values))
+
+    def uniprot_numbers_of(self, calpha_indices) -> list:
+        """
+        UniProt residue numbers of the given C-alpha atoms, unmapped ones are left out
+        """
+        uniprot_numbers = self.uniprot_resnums[np.asarray(calpha_indices, dtype=int)]
+        return uniprot_numbers[uniprot_numbers >= 0].tolist()
 
 
 @dataclass
 class EnsembleAnnotation:
     pdb_id: str
     chain: str
-    protein: pd.AtomGroup
+    protein: "pd.AtomGroup"
 
     uniprot_id: str
-    residue_mapper: dict
+    residue_mapper: ResidueMap
 
     rmsds_to_reference: typing.List[float]
     rmsds_per_residue: np.ndarray
     pca_fluctuations: np.ndarray
-    ensemble: pd.PDBEnsemble
+    ensemble: "pd.PDBEnsemble"
+    uniprot_ensemble: UniProtEnsemble = None
+    _residue_index: ResidueIndex = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def residue_index(self) -> ResidueIndex:
+        """
+        ResidueIndex of the reference, built on first use
+        """
+        if self._residue_index is None:
+            calphas = self.protein.select("calpha")
+            if self.uniprot_ensemble is not None:
+                self._residue_index = ResidueIndex.build(calphas, self.residue_mapper,
+                                                         column_positions=self.uniprot_ensemble.positions)
+            else:
+                self._residue_index = ResidueIndex.build(calphas, self.residue_mapper,
+                                                         msa_row=self.ensemble.getMSA().getArray()[0])
+        return self._residue_index
 
     def get_output_mapping(self):
         mapping = dict()
-        msa = self.ensemble.getMSA().getArray()[0]
-        calphas = self.protein.select("calpha")
-        reference_aln_indices = [i for i, r in enumerate(msa) if r != "-"]
-        indices = []
-        resnums = []
-        for i, a in enumerate(calphas):
-            if a.getResnum() in self.residue_mapper:
-                indices.append(i)
-                resnums.append(a.getResnum())
-        uniprot_residues = [self.residue_mapper[r] for r in resnums]
-        mapping["Ensemble IDs"] = [(f"{uniprot_residues[0]}-{uniprot_residues[-1]}",
+        index = self.residue_index
+        uniprot_residues = index.uniprot_residues
+        mapping["Ensemble IDs"] = [((uniprot_residues[0], uniprot_residues[-1]),
                                     self.ensemble.getLabels(), (0, 0, 0))]
-        mapping["Average RMSD"] = zip(uniprot_residues,
-                                      np.round(self.rmsds_per_residue[reference_aln_indices], 2),
-                                      numbers_to_colors(self.rmsds_per_residue[reference_aln_indices]))
-        mapping["PCA fluctuations"] = zip(uniprot_residues,
-                                          np.round(self.pca_fluctuations[reference_aln_indices], 2),
-                                          numbers_to_colors(self.pca_fluctuations[reference_aln_indices]))
-
+        mapping["Average RMSD"] = index.track(self.rmsds_per_residue, per_column=True)
+        mapping["PCA fluctuations"] = index.track(self.pca_fluctuations, per_column=True)
         return mapping
 
     def write_rmsds_to_reference(self, filename):
@@ -285,87 +708,258 @@ class EnsembleAnnotation:
 class StructureAnnotation:
     pdb_id: str
     chain: str
-    protein: pd.AtomGroup
-    calphas: pd.AtomGroup
+    protein: "pd.AtomGroup"
+    calphas: "pd.AtomGroup"
 
     uniprot_id: str
-    residue_mapper: dict
+    residue_mapper: ResidueMap
 
     enm_fluctuations: np.ndarray
     perturbation_effectiveness: np.ndarray
     perturbation_sensitivity: np.ndarray
     mechanical_stiffness: np.ndarray
-    relative_solvent_accessibility: np.ndarray
+    relative_solvent_accessibility: np.ndarray  # per C-alpha, NaN for residues without a value
     hinge_sites: list
-    anm: pd.dynamics.anm.ANM
-    gnm: pd.dynamics.gnm.GNM
+    anm: "pd.dynamics.anm.ANM"
+    gnm: "pd.dynamics.gnm.GNM"
+    _residue_index: ResidueIndex = field(default=None, init=False, repr=False, compare=False)
+
+    @property
+    def residue_index(self) -> ResidueIndex:
+        """
+        ResidueIndex of the C-alpha atoms the ENMs were built on, built on first use
+        """
+        if self._residue_index is None:
+            self._residue_index = ResidueIndex.build(self.calphas, self.residue_mapper)
+        return self._residue_index
 
     def get_output_mapping(self):
         mapping = dict()
-        indices = []
-        resnums = []
-        for i, a in enumerate(self.calphas):
-            if a.getResnum() in self.residue_mapper:
-                indices.append(i)
-                resnums.append(a.getResnum())
-        uniprot_residues = [self.residue_mapper[i] for i in resnums]
-        mapping["ENM fluctuations"] = zip(uniprot_residues, np.round(self.enm_fluctuations[indices], 2),
-                                          numbers_to_colors(self.enm_fluctuations[indices]))
-        mapping["Perturbation Effectiveness"] = zip(uniprot_residues, np.round(self.perturbation_effectiveness[indices], 2),
-                                                    numbers_to_colors(self.perturbation_effectiveness[indices]))
-        mapping["Perturbation Sensitivity"] = zip(uniprot_residues, np.round(self.perturbation_sensitivity[indices], 2),
-                                                  numbers_to_colors(self.perturbation_sensitivity[indices]))
-        mapping["Mechanical Stiffness"] = zip(uniprot_residues, np.round(self.mechanical_stiffness[indices], 2),
-                                              numbers_to_colors(self.mechanical_stiffness[indices]))
-        mapping["Relative Solvent Accessibility"] = zip(uniprot_residues, np.round(self.relative_solvent_accessibility[indices], 2),
-                                                        numbers_to_colors(self.relative_solvent_accessibility[indices]))
+        index = self.residue_index
+        mapping["ENM fluctuations"] = index.track(self.enm_fluctuations)
+        mapping["Perturbation Effectiveness"] = index.track(self.perturbation_effectiveness)
+        mapping["Perturbation Sensitivity"] = index.track(self.perturbation_sensitivity)
+        mapping["Mechanical Stiffness"] = index.track(self.mechanical_stiffness)
+        mapping["Relative Solvent Accessibility"] = index.track(self.relative_solvent_accessibility)
         for i in range(len(self.hinge_sites)):
-            mapping[f"Hinge sites for mode {i}"] = [(self.residue_mapper[self.calphas[r].getResnum()],
-                                                     f"mode {i}",
-                                                     (0, 0, 0)) for r in self.hinge_sites[i] if self.calphas[r].getResnum() in self.residue_mapper]
+            mapping[f"Hinge sites for mode {i}"] = [(r, f"mode {i}", (0, 0, 0))
+                                                    for r in index.uniprot_numbers_of(self.hinge_sites[i])]
         return mapping
 
 
-def get_annotations_ensemble(reference_uniprot_id, structure_chain_id_pairs, residue_mapper: dict):
-    structures = get_structures(structure_chain_id_pairs)
-    ensemble = make_ensemble(structures)
+def _member_label(pdb_id: str, chain: str = None) -> str:
+    """
+    Label of an ensemble member, "<pdb_id>_<chain>" as in earlier versions (e.g. 6m0k_A)
+    """
+    return f"{pdb_id}_{chain}" if chain else pdb_id
+
+
+def get_annotations_ensemble(reference_uniprot_id, structure_chain_id_pairs,
+                             residue_mapper: typing.Union[ResidueMap, dict], member_residue_mappers: dict = None,
+                             reverse_index=None, ensemble_file: str = None, refine: bool = False):
+    """
+    Ensemble annotations of the reference (first) structure
+
+    Parameters
+    ----------
+    reference_uniprot_id
+    structure_chain_id_pairs
+        list of (pdb_id, chain), the first one is the reference
+    residue_mapper
+        ResidueMap of the reference
+    member_residue_mappers
+        dictionary of {pdb_id: ResidueMap} for the other members
+    reverse_index
+        utils.residue_index.ReverseResidueIndex to take member mappings from, for members without one
+        in member_residue_mappers
+    ensemble_file
+        .npz file the fitted ensemble is saved to (see UniProtEnsemble.save). If it exists, the saved
+        ensemble is loaded and only structures not in it yet are loaded and superposed onto its mean
+        (see UniProtEnsemble.extend). Requires member mappings.
+    refine
+        superpose all members onto the updated mean once more after adding structures to a saved ensemble
+
+    If member mappings are available (from either source) the ensemble is built in UniProt numbering
+    (see make_uniprot_ensemble), otherwise by sequence alignment (see make_ensemble).
+    """
+    residue_mapper = as_residue_map(residue_mapper)
+    use_mappings = member_residue_mappers is not None or reverse_index is not None
+    if ensemble_file is not None and not use_mappings:
+        raise ValueError("Saved ensembles need member mappings, give member_residue_mappers or reverse_index")
+    pairs = list(dict(structure_chain_id_pairs).items())
+    previous = None
+    if ensemble_file is not None and os.path.exists(ensemble_file):
+        previous = UniProtEnsemble.load(ensemble_file)
+        if previous.uniprot_id != reference_uniprot_id or previous.labels[0] != _member_label(*pairs[0]):
+            raise ValueError(f"{ensemble_file} is not an ensemble of {reference_uniprot_id} "
+                             f"with reference {pairs[0][0]} {pairs[0][1]}")
+        known = set(previous.labels)
+        pairs = pairs[:1] + [(p, c) for p, c in pairs[1:] if _member_label(p, c) not in known]
+    errors = dict()
+    structures = get_structures(pairs, errors=errors)
+    if errors:
+        if pairs[0][0] in errors:
+            raise errors[pairs[0][0]]
+        warnings.warn("Skipped structures that could not be loaded: " +
+                      ", ".join(f"{pdb_id} ({e})" for pdb_id, e in errors.items()))
+    uniprot_ensemble = None
+    loaded_pairs = [(p, c) for p, c in pairs if p not in errors]
+    labels = [_member_label(p, c) for p, c in loaded_pairs]
+    if use_mappings:
+        member_residue_mappers = dict(member_residue_mappers or dict())
+        member_residue_mappers[loaded_pairs[0][0]] = residue_mapper
+        missing = [(p, c) for p, c in loaded_pairs if p not in member_residue_mappers]
+        if missing and reverse_index is None:
+            raise ValueError("No residue mapping for " + ", ".join(p for p, _ in missing))
+        if missing:
+            member_residue_mappers.update(zip((p for p, _ in missing),
+                                              member_mappers_from_reverse_index(reverse_index, reference_uniprot_id,
+                                                                                missing)))
+        residue_mappers = [member_residue_mappers[p] for p, _ in loaded_pairs]
+        if previous is None:
+            ensemble, uniprot_ensemble = make_uniprot_ensemble(reference_uniprot_id, structures, residue_mappers,
+                                                               labels=labels)
+            changed = True
+        else:
+            uniprot_ensemble = previous
+            changed = bool(uniprot_ensemble.extend(structures[1:], residue_mappers[1:], labels=labels[1:],
+                                                   refine=refine))
+            ensemble = uniprot_ensemble.to_pdb_ensemble()
+        if ensemble_file is not None and changed:
+            # written next to the target and moved into place, so readers never see a partial file.
+            # The name ends in .npz, np.savez would append it otherwise
+            tmp_file = f"{ensemble_file}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+            try:
+                uniprot_ensemble.save(tmp_file)
+                os.replace(tmp_file, ensemble_file)
+            finally:
+                if os.path.exists(tmp_file):
+                    os.remove(tmp_file)
+    else:
+        ensemble = make_ensemble(structures, labels=labels)
     rmsds_to_reference = get_rmsds_to_reference(ensemble)
     rmsds_per_residue = get_rmsd_per_residue(ensemble)
     pca_fluctuations = get_pca_fluctuations(ensemble)
-    return EnsembleAnnotation(structure_chain_id_pairs[0][0], structure_chain_id_pairs[0][1], structures[0],
+    return EnsembleAnnotation(pairs[0][0], pairs[0][1], structures[0],
                               reference_uniprot_id, residue_mapper,
-                              rmsds_to_reference, rmsds_per_residue, pca_fluctuations, ensemble)
+                              rmsds_to_reference, rmsds_per_residue, pca_fluctuations, ensemble,
+                              uniprot_ensemble=uniprot_ensemble)
 
 
-def get_annotations_single(uniprot_id, pdb_id, residue_mapper: dict, chain=None, n_modes=6, full_pdb_solvent_accessibility=True):
-    structure = pd.parseCIF(pdb_id, chain=chain)
+def get_annotations_single(uniprot_id, pdb_id, residue_mapper: typing.Union[ResidueMap, dict], chain=None, n_modes=6,
+                           full_pdb_solvent_accessibility=True, context: StructureContext = None,
+                           solvent_accessibility_backend="sasa"):
+    residue_mapper = as_residue_map(residue_mapper)
+    if context is None:
+        context = StructureContext(pdb_id)
+    structure = context.calphas(chain).to_atomgroup()
     gnm, calphas = pd.calcGNM(structure, n_modes=n_modes)
     anm, _ = pd.calcANM(structure, n_modes=n_modes)
     effectiveness, sensitivity = get_perturbations(anm, n_modes)
     hinge_sites = [get_hinge_indices(gnm, mode=n) for n in range(n_modes)]
+    residues, relative_accessibility = _mapped_residue_accessibility(
+        pdb_id, residue_mapper, chain, full_pdb_solvent_accessibility=full_pdb_solvent_accessibility,
+        context=context, backend=solvent_accessibility_backend)
     return StructureAnnotation(pdb_id, chain, structure, calphas,
                                uniprot_id, residue_mapper,
                                get_enm_fluctuations(anm, n_modes), 
                                effectiveness, 
                                sensitivity, 
                                get_stiffness(anm, calphas, n_modes),
-                               get_relative_solvent_accessibility(pdb_id, residue_mapper, chain=chain, 
-                                                                  full_pdb_solvent_accessibility=full_pdb_solvent_accessibility),
+                               residue_values_per_atom(calphas, residues, relative_accessibility),
                                hinge_sites, anm, gnm)
 
 
 def make_swiss_model_annotators(annotation: typing.Union[StructureAnnotation, EnsembleAnnotation],
-                                post=False, email=None):
+                                post=False, email=None, compact=False, quantize=None, compress=False):
+    """
+    Turns the output mapping of an annotation into one SWISS-MODEL Annotation per track
+    Parameters
+    ----------
+    annotation
+    post
+        if True, uploads each track to SWISS-MODEL
+    email
+        email address used for the uploads
+    compact
+        if True, merges adjacent residues with the same value and color into ranges
+    quantize
+        step size values are rounded to before compacting (see Annotation.compact)
+    compress
+        gzip compression of the uploads, see post_annotators
+
+    Returns
+    -------
+    list of Annotation objects, list of track titles, list of upload URLs (empty if post is False)
+    """
     output_mapping = annotation.get_output_mapping()
     titles = []
     annotators = []
     urls = []
     for title in output_mapping:
         annotator = Annotation()
-        for residue, value, color in output_mapping[title]:
-            annotator.add(annotation.uniprot_id, residue, tuple(color), str(value))
+        rows = list(output_mapping[title])
+        # residues are single residue numbers or (start, end) ranges
+        ranges = [r if isinstance(r, tuple) else (r, r) for r, _, _ in rows]
+        annotator.add_many(annotation.uniprot_id, [r[0] for r in ranges], [r[1] for r in ranges],
+                           [color for _, _, color in rows], [str(value) for _, value, _ in rows])
+        if compact or quantize:
+            annotator = annotator.compact(quantize=quantize)
         titles.append(title)
         annotators.append(annotator)
-        if post:
-            urls.append(annotator.post(title=f"{title} PDB ID {annotation.pdb_id} Chain {annotation.chain}", email=email))
+    if post:
+        urls = post_annotators(annotation, annotators, titles, email=email, compress=compress)
     return annotators, titles, urls
+
+
+def post_annotators(annotation: typing.Union[StructureAnnotation, EnsembleAnnotation],
+                    annotators: typing.List[Annotation], titles: typing.List[str], email=None, previous=None,
+                    compress=False):
+    """
+    Uploads the tracks to SWISS-MODEL, concurrently over one pooled session (see sm_annotations.post_many)
+    Parameters
+    ----------
+    annotation
+        the StructureAnnotation or EnsembleAnnotation the tracks were made from
+    annotators
+        list of Annotation objects
+    titles
+        list of track titles
+    email
+        email address used for the uploads
+    previous
+        dictionary of {title: (Annotation, url)} from an earlier upload,
+        tracks with unchanged content keep their URL and are not uploaded again
+    compress
+        True to upload gzip compressed files, "auto" to try gzip first and fall back to uncompressed
+        files if the upload form rejects them (see sm_annotations.post_many)
+
+    Returns
+    -------
+    list of URLs, one per track
+
+    Raises
+    ------
+    UploadError
+        if some uploads failed, its urls attribute holds the URL of each track (None for the failed ones)
+        and its errors attribute the exceptions by track index
+    """
+    urls = [None] * len(annotators)
+    to_post = []
+    for i, (title, annotator) in enumerate(zip(titles, annotators)):
+        if previous and title in previous:
+            previous_annotator, previous_url = previous[title]
+            if previous_url and previous_annotator.digest() == annotator.digest():
+                urls[i] = previous_url
+                continue
+        to_post.append(i)
+    try:
+        posted = post_many([(f"{titles[i]} PDB ID {annotation.pdb_id} Chain {annotation.chain}", annotators[i])
+                            for i in to_post], email=email, compress=compress)
+    except UploadError as e:
+        for i, url in zip(to_post, e.urls):
+            urls[i] = url
+        raise UploadError(urls, {to_post[j]: error for j, error in e.errors.items()}) from e
+    for i, url in zip(to_post, posted):
+        urls[i] = url
+    return urls
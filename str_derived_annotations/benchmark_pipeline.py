@@ -0,0 +1,65 @@
+"""
+Times the example pipelines against recorded remote responses.
+
+Record once with network access, then replay as often as needed offline:
+
+python -m str_derived_annotations.benchmark_pipeline record fixtures/example
+python -m str_derived_annotations.benchmark_pipeline replay fixtures/example --repeat 3
+
+Run from the root directory of the repository.
+"""
+import argparse
+import tempfile
+import time
+
+from str_derived_annotations import example_usage
+from utils import fixtures
+
+
+def run_examples(pdb_id, uniprot_id, pdb_search_str, single=True, ensemble=True):
+    """
+    Runs the single structure and/or ensemble example into a temporary directory
+
+    Returns
+    -------
+    dict of {example name: seconds}
+    """
+    timings = dict()
+    with tempfile.TemporaryDirectory() as output_path:
+        if single:
+            start = time.perf_counter()
+            example_usage.example_single(pdb_id, uniprot_id, output_path)
+            timings["example_single"] = time.perf_counter() - start
+        if ensemble:
+            start = time.perf_counter()
+            example_usage.example_ensemble(uniprot_id, pdb_search_str, output_path)
+            timings["example_ensemble"] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["record", "replay"])
+    parser.add_argument("bundle", help="fixture bundle directory")
+    parser.add_argument("--pdb-id", default="6m71")
+    parser.add_argument("--uniprot-id", default="P0DTD1")
+    parser.add_argument("--pdb-search-str", default="3C-like proteinase")
+    parser.add_argument("--skip-single", action="store_true")
+    parser.add_argument("--skip-ensemble", action="store_true")
+    parser.add_argument("--repeat", type=int, default=1, help="number of replayed runs")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        context, repeat = fixtures.record, 1
+    else:
+        context, repeat = fixtures.replay, args.repeat
+    for i in range(repeat):
+        with context(args.bundle):
+            timings = run_examples(args.pdb_id, args.uniprot_id, args.pdb_search_str,
+                                   single=not args.skip_single, ensemble=not args.skip_ensemble)
+        for name, seconds in timings.items():
+            print(f"{args.mode} run {i + 1}\t{name}\t{seconds:.2f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Streaming reader for the C-alpha atoms of mmCIF files.
+
+All analyses in annotate.py work on C-alpha atoms only, so instead of parsing
+every atom into a ProDy AtomGroup, the rows of the _atom_site loop are scanned
+line by line and only C-alpha atoms of the requested chain and model are kept.
+Time and memory scale with the number of residues rather than atoms, and
+reading stops at the end of the requested model.
+
+Author numbering (auth_asym_id, auth_seq_id, auth_comp_id) is used, as in ProDy.
+
+usage example:
+
+from str_derived_annotations import calpha_reader
+
+calphas = calpha_reader.read_calphas("6m71.cif.gz", chain="A")
+print(calphas.coords.shape, calphas.resnums[:5])
+atoms = calphas.to_atomgroup()  # ProDy AtomGroup, e.g. for pd.calcGNM
+
+# parse once, later calls with the same file content are read from the cache
+cache = calpha_reader.CalphaCache("~/.cache/sm_annotations/calphas")
+calphas = cache.load("6m71.cif.gz", chain="A")
+"""
+import gzip
+import hashlib
+import os
+import re
+import threading
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from utils import lazy
+
+pd = lazy.lazy_import("prody")
+
+# quoted values may contain whitespace, e.g. atom names like "O5'" in nucleic acids
+TOKEN_PATTERN = re.compile(r"""'(?:[^']|'(?=\S))*'(?=\s|$)|"(?:[^"]|"(?=\S))*"(?=\s|$)|\S+""")
+MISSING = (".", "?")
+# residue names ProDy's "calpha" selection accepts: standard amino acids and ProDy's nonstandard ones
+AMINO_ACIDS = frozenset([
+    "ALA", "ARG", "ASN", "ASP", "CYS", "GLN", "GLU", "GLY", "HIS", "ILE", "LEU", "LYS", "MET", "PHE", "PRO", "SER",
+    "THR", "TRP", "TYR", "VAL",
+    "ASX", "GLX", "ASH", "GLH", "CSO", "CYX", "HIP", "HID", "HIE", "HSD", "HSE", "HSP", "HISD", "HISE", "HISP", "LYN",
+    "TYM", "ARN", "MSE", "CME", "SEC", "SEP", "TPO", "PTR", "PHD", "XLE", "XAA", "MEN", "CSB"])
+# bumped when read_calphas selects different atoms, so that stale cache files are not used
+CACHE_VERSION = 2
+
+
+@dataclass
+class CalphaAtoms:
+    """
+    C-alpha atoms of one model of a structure, one entry per residue
+    """
+    title: str
+    coords: np.ndarray  # (n, 3) float32
+    chids: np.ndarray  # (n,) chain IDs
+    resnums: np.ndarray  # (n,) int32 author residue numbers
+    icodes: np.ndarray  # (n,) insertion codes, "" if none
+    resnames: np.ndarray  # (n,) residue names
+
+    def __len__(self):
+        return len(self.resnums)
+
+    def to_atomgroup(self) -> "pd.AtomGroup":
+        """
+        Builds a ProDy AtomGroup with one CA atom per residue
+        """
+        n = len(self)
+        atoms = pd.AtomGroup(self.title)
+        atoms.setCoords(self.coords.astype(float))
+        atoms.setNames(np.full(n, "CA"))
+        atoms.setElements(np.full(n, "C"))
+        atoms.setResnames(self.resnames)
+        atoms.setResnums(self.resnums)
+        atoms.setIcodes(self.icodes)
+        atoms.setChids(self.chids)
+        atoms.setSegnames(self.chids)
+        atoms.setAltlocs(np.full(n, " "))
+        atoms.setSerials(np.arange(1, n + 1))
+        return atoms
+
+    def save(self, path: typing.Union[str, Path]):
+        """
+        Writes the arrays as uncompressed .npz file
+        """
+        with open(path, "wb") as f:
+            np.savez(f, title=np.array(self.title), coords=self.coords, chids=self.chids, resnums=self.resnums,
+                     icodes=self.icodes, resnames=self.resnames)
+
+    @classmethod
+    def load(cls, path: typing.Union[str, Path]):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(str(data["title"]), data["coords"], data["chids"], data["resnums"], data["icodes"],
+                       data["resnames"])
+
+
+def file_checksum(path: typing.Union[str, Path]) -> str:
+    """
+    SHA-256 hex digest of a file's content
+    """
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class CalphaCache:
+    """
+    Directory of C-alpha sets read by read_calphas, one .npz file per (structure, chain, file checksum)
+    A changed structure file gets a new checksum and is parsed again, files written by
+    another CACHE_VERSION are ignored.
+
+    :param directory: Cache directory, created on first write
+    """
+
+    def __init__(self, directory: typing.Union[str, Path]):
+        self.directory = Path(directory).expanduser()
+
+    def path_for(self, path: typing.Union[str, Path], chain: str = None, checksum: str = None) -> Path:
+        """
+        Cache file of a chain (all chains if None) of a structure file, named after the file
+        name without extension (i.e. the PDB ID for mirrored files), the chain and the checksum
+        """
+        if checksum is None:
+            checksum = file_checksum(path)
+        return self.directory / f"{Path(path).name.split('.')[0]}_{chain or ''}_{checksum}_v{CACHE_VERSION}.npz"
+
+    def get(self, path: typing.Union[str, Path], chain: str = None,
+            checksum: str = None) -> typing.Union[CalphaAtoms, None]:
+        """
+        Cached C-alpha atoms of a structure file, None if not cached
+        """
+        cache_path = self.path_for(path, chain, checksum)
+        try:
+            return CalphaAtoms.load(cache_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def put(self, path: typing.Union[str, Path], calphas: CalphaAtoms, chain: str = None, checksum: str = None):
+        cache_path = self.path_for(path, chain, checksum)
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f".{cache_path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        calphas.save(tmp_path)
+        os.replace(tmp_path, cache_path)
+
+    def load(self, path: typing.Union[str, Path], chain: str = None) -> CalphaAtoms:
+        """
+        C-alpha atoms (first model, default altloc) of a structure file from the cache,
+        read with read_calphas and cached if needed
+        """
+        checksum = file_checksum(path)
+        calphas = self.get(path, chain, checksum)
+        if calphas is None:
+            calphas = read_calphas(path, chain=chain)
+            self.put(path, calphas, chain, checksum)
+        return calphas
+
+
+def _tokenize(line: str) -> typing.List[str]:
+    if "'" not in line and '"' not in line:
+        return line.split()
+    return [t[1:-1] if t[0] in "'\"" else t for t in TOKEN_PATTERN.findall(line)]
+
+
+def _open(path: typing.Union[str, Path]):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt")
+    return open(path)
+
+
+def read_calphas(path: typing.Union[str, Path], chain: str = None, model: int = None,
+                 altloc: str = "A", title: str = None) -> CalphaAtoms:
+    """
+    Reads the C-alpha atoms of amino acids (ATOM records or residue names in AMINO_ACIDS) of an mmCIF file
+
+    Parameters
+    ----------
+    path
+        mmCIF file, optionally gzip compressed
+    chain
+        author chain ID, all chains if None
+    model
+        model number, defaults to the first model in the file
+    altloc
+        alternate location kept for atoms with several, the first one found is kept
+        for residues without it
+    title
+        title of the result, defaults to the file name without extension plus the chain ID (as ProDy)
+
+    Returns
+    -------
+    CalphaAtoms, in file order
+    """
+    if title is None:
+        title = Path(path).name.split(".")[0] + (chain or "")
+    columns = dict()
+    coords, chids, resnums, icodes, resnames = [], [], [], [], []
+    # residue -> row of the result, residues whose coordinates are from the requested altloc
+    index, preferred = dict(), set()
+    with _open(path) as f:
+        lines = iter(f)
+        # find the _atom_site loop header
+        for line in lines:
+            if line.startswith("_atom_site."):
+                columns[line.split()[0][len("_atom_site."):]] = len(columns)
+                break
+        for line in lines:
+            if not line.startswith("_atom_site."):
+                break
+            columns[line.split()[0][len("_atom_site."):]] = len(columns)
+        if not columns:
+            raise ValueError(f"No _atom_site loop in {path}")
+
+        def column(*names):
+            for name in names:
+                if name in columns:
+                    return columns[name]
+            return None
+
+        atom_col = column("auth_atom_id", "label_atom_id")
+        element_col = column("type_symbol")
+        group_col = column("group_PDB")
+        chain_col = column("auth_asym_id", "label_asym_id")
+        resnum_col = column("auth_seq_id", "label_seq_id")
+        resname_col = column("auth_comp_id", "label_comp_id")
+        icode_col = column("pdbx_PDB_ins_code")
+        altloc_col = column("label_alt_id")
+        model_col = column("pdbx_PDB_model_num")
+        x_col, y_col, z_col = column("Cartn_x"), column("Cartn_y"), column("Cartn_z")
+        if None in (atom_col, chain_col, resnum_col, resname_col, x_col, y_col, z_col):
+            raise ValueError(f"Missing coordinate or residue columns in the _atom_site loop of {path}")
+
+        while line and not line.startswith(("#", "loop_", "_")):
+            # cheap filter before splitting, every C-alpha row contains the atom name as a separate token
+            if "CA" in line:
+                row = _tokenize(line)
+                # protein C-alphas only, as ProDy's "calpha", ligands and calcium ions also have atoms named CA
+                if (row[atom_col] == "CA" and (element_col is None or row[element_col] == "C")
+                        and (row[resname_col] in AMINO_ACIDS or (group_col is not None and row[group_col] == "ATOM"))):
+                    if model_col is not None:
+                        row_model = int(row[model_col])
+                        if model is None:
+                            model = row_model
+                        if row_model > model:
+                            break
+                    if (model_col is None or row_model == model) and (chain is None or row[chain_col] == chain):
+                        icode = row[icode_col] if icode_col is not None else "?"
+                        icode = "" if icode in MISSING else icode
+                        key = (row[chain_col], row[resnum_col], icode)
+                        row_altloc = row[altloc_col] if altloc_col is not None else "."
+                        is_preferred = row_altloc in MISSING or row_altloc == altloc
+                        xyz = (float(row[x_col]), float(row[y_col]), float(row[z_col]))
+                        i = index.get(key)
+                        if i is None:
+                            index[key] = len(coords)
+                            coords.append(xyz)
+                            chids.append(row[chain_col])
+                            resnums.append(int(row[resnum_col]))
+                            icodes.append(icode)
+                            resnames.append(row[resname_col])
+                        elif is_preferred and key not in preferred:
+                            coords[i] = xyz
+                        if is_preferred:
+                            preferred.add(key)
+            line = next(lines, "")
+    return CalphaAtoms(title, np.array(coords, dtype=np.float32).reshape(-1, 3), np.array(chids, dtype=str),
+                       np.array(resnums, dtype=np.int32), np.array(icodes, dtype="U1"), np.array(resnames, dtype=str))
@@ -0,0 +1,369 @@
+"""
+Structure ensembles in UniProt numbering.
+
+Instead of aligning the sequence of every member to a reference (as
+prody.buildPDBEnsemble does), the C-alpha atoms of each chain are placed into
+UniProt position columns using its PDB to UniProt residue mapping (SIFTS, the
+reverse residue index or alignment_mapping). All members are filled into one
+(n_structures x n_positions x 3) coordinate array in a single scatter, with a
+mask marking the positions each member covers.
+
+usage example:
+
+from str_derived_annotations import ensemble
+
+uniprot_ensemble = ensemble.build_uniprot_ensemble("P0DTD1", calphas_list, residue_mappers)
+uniprot_ensemble.superpose()  # batched iterative superposition onto the mean structure
+pdb_ensemble = uniprot_ensemble.to_pdb_ensemble()  # ProDy PDBEnsemble weighted by the mask
+
+# keep the fitted ensemble, later only superpose new structures onto its mean
+uniprot_ensemble.save("P0DTD1_6m71A.npz")
+uniprot_ensemble = ensemble.UniProtEnsemble.load("P0DTD1_6m71A.npz")
+uniprot_ensemble.extend(new_calphas_list, new_residue_mappers)
+"""
+import typing
+from dataclasses import dataclass
+from pathlib import Path
+
+import numpy as np
+
+from utils import lazy
+from utils.residue_map import ResidueMap, as_residue_map
+
+pd = lazy.lazy_import("prody")
+
+
+@dataclass
+class UniProtEnsemble:
+    """
+    C-alpha coordinates of several structures in UniProt position columns
+    """
+    uniprot_id: str
+    positions: np.ndarray  # (L,) UniProt residue numbers of the columns, sorted
+    coords: np.ndarray  # (n, L, 3) float32, zero where not covered
+    mask: np.ndarray  # (n, L) True where a member has a C-alpha atom at the position
+    labels: typing.List[str]  # (n,) member names
+    resnames: np.ndarray  # (L,) residue name of each column, from the first member covering it
+    mean: np.ndarray = None  # (L, 3) mean structure the members are superposed onto, None if not superposed
+
+    def __len__(self):
+        return len(self.labels)
+
+    def save(self, path: typing.Union[str, Path]):
+        """
+        Writes the arrays as uncompressed .npz file, np.savez appends .npz to paths without it
+        """
+        arrays = dict(uniprot_id=np.array(self.uniprot_id), positions=self.positions, coords=self.coords,
+                      mask=self.mask, labels=np.array(self.labels, dtype=str), resnames=self.resnames)
+        if self.mean is not None:
+            arrays["mean"] = self.mean
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: typing.Union[str, Path]):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(str(data["uniprot_id"]), data["positions"], data["coords"], data["mask"],
+                       data["labels"].tolist(), data["resnames"], data["mean"] if "mean" in data.files else None)
+
+    def superpose(self, rmsd: float = 1e-4, max_iterations: int = 100) -> int:
+        """
+        Iteratively superposes all members onto their mean structure (see iterpose), in place
+
+        Returns
+        -------
+        number of iterations
+        """
+        self.coords, self.mean, n_iterations = iterpose(self.coords, self.mask, rmsd=rmsd,
+                                                        max_iterations=max_iterations)
+        return n_iterations
+
+    def extend(self, members: typing.List, residue_mappers: typing.List, labels: typing.List[str] = None,
+               refine: bool = False) -> typing.List[str]:
+        """
+        Adds members to a superposed ensemble, in place. Only the new members are superposed, onto the
+        current mean structure, and the mean is updated with their coordinates. Positions outside the
+        columns of the ensemble are dropped and members with a label already in the ensemble are skipped.
+
+        Parameters
+        ----------
+        members
+            C-alpha atoms of each new member, see build_uniprot_ensemble
+        residue_mappers
+            ResidueMap (or dict) of {pdb_resnum: uniprot_resnum} of each new member
+        labels
+            name of each new member, defaults to the titles of the members
+        refine
+            if True, all members are superposed onto the updated mean once more (see refine)
+
+        Returns
+        -------
+        labels of the added members
+        """
+        if self.mean is None:
+            raise ValueError("The ensemble has to be superposed before adding members")
+        newcomers = build_uniprot_ensemble(self.uniprot_id, members, residue_mappers, labels=labels,
+                                           positions=self.positions)
+        known = set(self.labels)
+        keep = []
+        for i, label in enumerate(newcomers.labels):
+            if label not in known:
+                known.add(label)
+                keep.append(i)
+        if not keep:
+            return []
+        coords, mask = newcomers.coords[keep], newcomers.mask[keep]
+        rotations, translations = kabsch(coords, self.mean, mask)
+        fitted = (np.matmul(coords, rotations.transpose(0, 2, 1)) + translations[:, None]) * mask[..., None]
+        # running mean: old sums plus the new members, columns nobody covers keep their old value
+        counts = self.mask.sum(axis=0)
+        new_counts = counts + mask.sum(axis=0)
+        sums = self.mean * counts[:, None] + fitted.sum(axis=0)
+        self.mean = np.where(new_counts[:, None] > 0, sums / np.maximum(new_counts, 1)[:, None],
+                             self.mean).astype(np.float32)
+        unnamed = (self.resnames == "UNK") & mask.any(axis=0)
+        self.resnames[unnamed] = newcomers.resnames[unnamed]
+        self.coords = np.concatenate([self.coords, fitted.astype(np.float32)])
+        self.mask = np.concatenate([self.mask, mask])
+        self.labels = self.labels + [newcomers.labels[i] for i in keep]
+        if refine:
+            self.refine()
+        return [newcomers.labels[i] for i in keep]
+
+    def refine(self, rmsd: float = 1e-4, max_iterations: int = 1) -> int:
+        """
+        Superposes all members onto the current mean structure and updates the mean, repeated
+        up to max_iterations times (see iterpose). One iteration is a cheap correction of the
+        mean after extend, more iterations converge to the result of superpose.
+
+        Returns
+        -------
+        number of iterations
+        """
+        self.coords, self.mean, n_iterations = iterpose(self.coords, self.mask, reference=self.mean, rmsd=rmsd,
+                                                        max_iterations=max_iterations)
+        return n_iterations
+
+    def columns_of(self, uniprot_resnums: np.ndarray) -> np.ndarray:
+        """
+        Column of each UniProt residue number, -1 for positions not in the ensemble
+        """
+        uniprot_resnums = np.asarray(uniprot_resnums)
+        columns = np.searchsorted(self.positions, uniprot_resnums)
+        columns = np.minimum(columns, len(self.positions) - 1)
+        found = (self.positions[columns] == uniprot_resnums) if len(self.positions) else \
+            np.zeros(len(uniprot_resnums), dtype=bool)
+        return np.where(found, columns, -1)
+
+    def to_pdb_ensemble(self, title: str = None) -> "pd.PDBEnsemble":
+        """
+        ProDy PDBEnsemble with one atom per column, weighted by the mask so that
+        superposition, RMSDs and PCA only use the positions each member covers.
+        The atoms get the UniProt residue numbers and the coordinates of the first
+        member covering each column.
+        """
+        first = np.argmax(self.mask, axis=0)
+        n_columns = len(self.positions)
+        atoms = pd.AtomGroup(title or self.uniprot_id)
+        atoms.setCoords(self.coords[first, np.arange(n_columns)].astype(float))
+        atoms.setNames(np.full(n_columns, "CA"))
+        atoms.setElements(np.full(n_columns, "C"))
+        atoms.setResnames(self.resnames)
+        atoms.setResnums(self.positions)
+        atoms.setChids(np.full(n_columns, "A"))
+        ensemble = pd.PDBEnsemble(title or self.uniprot_id)
+        ensemble.setAtoms(atoms)
+        ensemble.setCoords(atoms.getCoords() if self.mean is None else self.mean.astype(float))
+        ensemble.addCoordset(self.coords.astype(float), weights=self.mask[:, :, None].astype(float),
+                             label=list(self.labels))
+        return ensemble
+
+
+def kabsch(mobile: np.ndarray, target: np.ndarray, weights: np.ndarray) -> typing.Tuple[np.ndarray, np.ndarray]:
+    """
+    Weighted least squares superposition of many coordinate sets at once (Kabsch algorithm):
+    masked centroids, all 3x3 covariance matrices in one batched product and one batched SVD
+
+    Parameters
+    ----------
+    mobile
+        (n, L, 3) coordinate sets to superpose
+    target
+        (L, 3) or (n, L, 3) coordinates to superpose onto
+    weights
+        (n, L) weight of each position in each set, 0 (or False) for positions to ignore
+
+    Returns
+    -------
+    rotations (n, 3, 3) and translations (n, 3), the superposed coordinates are
+    mobile @ rotations.transpose(0, 2, 1) + translations[:, None]
+    Sets with fewer than three positions of non-zero weight get the identity transformation.
+    """
+    mobile, target = np.asarray(mobile, dtype=float), np.asarray(target, dtype=float)
+    weights = np.asarray(weights, dtype=float)
+    weight_sums = weights.sum(axis=1)
+    safe_sums = np.where(weight_sums > 0, weight_sums, 1.)[:, None]
+    weighted_mobile = mobile * weights[..., None]
+    mobile_centers = weighted_mobile.sum(axis=1) / safe_sums
+    if target.ndim == 2:
+        target_centers = weights @ target / safe_sums
+    else:
+        target_centers = np.einsum("nl,nlk->nk", weights, target) / safe_sums
+    # sum_l w (x - x0)(y - y0)^T = sum_l w x y^T - W x0 y0^T, without centered copies of the coordinates
+    covariances = (np.matmul(weighted_mobile.transpose(0, 2, 1), target)
+                   - weight_sums[:, None, None] * mobile_centers[:, :, None] * target_centers[:, None, :])
+    u, _, vt = np.linalg.svd(covariances)
+    # reflection correction: flip the axis of the smallest singular value where det(V U^T) < 0
+    signs = np.sign(np.linalg.det(np.matmul(vt.transpose(0, 2, 1), u.transpose(0, 2, 1))))
+    vt[:, 2] *= np.where(signs == 0, 1., signs)[:, None]
+    rotations = np.matmul(vt.transpose(0, 2, 1), u.transpose(0, 2, 1))
+    too_few = np.count_nonzero(weights, axis=1) < 3
+    rotations[too_few] = np.eye(3)
+    translations = target_centers - np.einsum("nab,nb->na", rotations, mobile_centers)
+    translations[too_few] = 0.
+    return rotations, translations
+
+
+def iterpose(coords: np.ndarray, mask: np.ndarray, reference: np.ndarray = None, rmsd: float = 1e-4,
+             max_iterations: int = 100) -> typing.Tuple[np.ndarray, np.ndarray, int]:
+    """
+    Iterative superposition of all coordinate sets onto their mean, as ProDy's Ensemble.iterpose
+    but with each iteration a single batched superposition (see kabsch) instead of a loop over members.
+    All sets are superposed onto the reference, the masked mean is taken as the new reference and this
+    is repeated until the mean moves less than rmsd. Every iteration superposes the original coordinates,
+    so errors do not accumulate.
+
+    Parameters
+    ----------
+    coords
+        (n, L, 3) coordinate sets
+    mask
+        (n, L) True where a set has coordinates at a position
+    reference
+        (L, 3) initial reference, defaults to the first set (filled with the masked mean where it has no coordinates)
+    rmsd
+        convergence criterion, RMSD between the references of consecutive iterations
+    max_iterations
+
+    Returns
+    -------
+    superposed coordinates (n, L, 3) (zero where masked out), mean structure (L, 3), number of iterations
+    """
+    coords = np.asarray(coords, dtype=float)
+    mask = np.asarray(mask, dtype=bool)
+    weights = mask.astype(float)
+    counts = weights.sum(axis=0)
+    covered = counts > 0
+    counts[~covered] = 1.
+
+    def masked_mean(sets):
+        return np.einsum("nl,nlk->lk", weights, sets) / counts[:, None]
+
+    if reference is None:
+        reference = np.where(mask[0, :, None], coords[0], masked_mean(coords))
+    reference = np.asarray(reference, dtype=float)
+    n_iterations = 0
+    for n_iterations in range(1, max_iterations + 1):
+        rotations, translations = kabsch(coords, reference, weights)
+        mean = masked_mean(np.matmul(coords, rotations.transpose(0, 2, 1)) + translations[:, None])
+        change = np.sqrt(np.mean(np.sum((mean[covered] - reference[covered]) ** 2, axis=1))) if covered.any() else 0.
+        reference = mean
+        if change <= rmsd:
+            break
+    # final superposition onto the converged mean
+    rotations, translations = kabsch(coords, reference, weights)
+    fitted = (np.matmul(coords, rotations.transpose(0, 2, 1)) + translations[:, None]) * weights[..., None]
+    return fitted.astype(np.float32), reference.astype(np.float32), n_iterations
+
+
+def iterpose_pdb_ensemble(ensemble: "pd.PDBEnsemble", rmsd: float = 1e-4,
+                          max_iterations: int = 100) -> "pd.PDBEnsemble":
+    """
+    Replacement for PDBEnsemble.iterpose using the batched iterpose
+
+    Returns
+    -------
+    new PDBEnsemble with the atoms, atom selection, labels, weights and MSA of ensemble, whose conformations
+    are superposed onto their mean, which is the reference coordinate set. ensemble itself is not changed.
+    """
+    weights = ensemble.getWeights(selected=False)
+    fitted, mean, _ = iterpose(ensemble.getCoordsets(selected=False), weights[..., 0] > 0,
+                               reference=ensemble.getCoords(selected=False),
+                               rmsd=rmsd, max_iterations=max_iterations)
+    superposed = pd.PDBEnsemble(ensemble.getTitle())
+    superposed.setCoords(mean.astype(float))
+    if ensemble.getAtoms() is not None:
+        superposed.setAtoms(ensemble.getAtoms())
+    superposed.addCoordset(fitted.astype(float), weights=weights, label=ensemble.getLabels(),
+                           sequence=ensemble.getMSA(selected=False))
+    return superposed
+
+
+def build_uniprot_ensemble(uniprot_id: str, members: typing.List, residue_mappers: typing.List,
+                           labels: typing.List[str] = None, positions: np.ndarray = None) -> UniProtEnsemble:
+    """
+    Places the C-alpha atoms of each member into UniProt position columns
+
+    Parameters
+    ----------
+    uniprot_id
+    members
+        C-alpha atoms of each member, as ProDy atoms (only C-alpha atoms are used) or calpha_reader.CalphaAtoms
+    residue_mappers
+        ResidueMap (or dict) of {pdb_resnum: uniprot_resnum} of each member
+    labels
+        name of each member, defaults to the titles of the members
+    positions
+        UniProt positions to use as columns, defaults to all positions covered by any member
+
+    Returns
+    -------
+    UniProtEnsemble
+    """
+    if len(members) != len(residue_mappers):
+        raise ValueError("Need one residue mapper per member")
+    if labels is None:
+        labels = [m.title if hasattr(m, "title") else m.getTitle() for m in members]
+    member_indices, uniprot_resnums, coords, resnames = [], [], [], []
+    for i, (member, residue_mapper) in enumerate(zip(members, residue_mappers)):
+        if hasattr(member, "select"):
+            member = member.select("calpha")
+            member_coords, member_resnums = member.getCoords(), member.getResnums()
+            member_icodes, member_resnames = member.getIcodes(), member.getResnames()
+        else:
+            member_coords, member_resnums = member.coords, member.resnums
+            member_icodes, member_resnames = member.icodes, member.resnames
+        member_uniprot = as_residue_map(residue_mapper).pdb_to_uniprot(member_resnums, member_icodes)
+        mapped = member_uniprot >= 0
+        member_indices.append(np.full(mapped.sum(), i))
+        uniprot_resnums.append(member_uniprot[mapped])
+        coords.append(member_coords[mapped])
+        resnames.append(member_resnames[mapped])
+    member_indices = np.concatenate(member_indices) if members else np.zeros(0, dtype=int)
+    uniprot_resnums = np.concatenate(uniprot_resnums) if members else np.zeros(0, dtype=int)
+    coords = np.concatenate(coords) if members else np.zeros((0, 3))
+    resnames = np.concatenate(resnames) if members else np.zeros(0, dtype=str)
+    if positions is None:
+        positions = np.unique(uniprot_resnums)
+    positions = np.asarray(positions)
+
+    ensemble = UniProtEnsemble(uniprot_id, positions, np.zeros((len(members), len(positions), 3), dtype=np.float32),
+                               np.zeros((len(members), len(positions)), dtype=bool), list(labels),
+                               np.full(len(positions), "UNK", dtype="U3"))
+    columns = ensemble.columns_of(uniprot_resnums)
+    inside = columns >= 0
+    member_indices, columns, coords, resnames = member_indices[inside], columns[inside], coords[inside], resnames[inside]
+    ensemble.coords[member_indices, columns] = coords
+    ensemble.mask[member_indices, columns] = True
+    # residue name of the first member covering each column (rows are in member order)
+    first_columns, first_rows = np.unique(columns, return_index=True)
+    ensemble.resnames[first_columns] = resnames[first_rows]
+    return ensemble
+
+
+def member_mappers_from_reverse_index(reverse_index, uniprot_id: str,
+                                      structure_chain_id_pairs: typing.List[typing.Tuple[str, str]]) -> typing.List[ResidueMap]:
+    """
+    Residue mappers of ensemble members recovered from a utils.residue_index.ReverseResidueIndex,
+    so no SIFTS files need to be fetched
+    """
+    return [reverse_index.chain_mapping(pdb_id, chain, uniprot_id) for pdb_id, chain in structure_chain_id_pairs]
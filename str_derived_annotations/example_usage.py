@@ -1,9 +1,13 @@
+import gzip
 from pathlib import Path
 
 import numpy as np
 
 from str_derived_annotations import annotate
 from utils import parse_pdbe
+from utils.sm_annotations import Annotation, UploadError
+
+URL_PREFIX = "# URL: "
 
 
 def create_csv_file(annotations, csv_dir):
@@ -26,7 +30,7 @@ def create_csv_file(annotations, csv_dir):
 
     data_dict = vars(annotations)
     data = {'residue_numbers': list(data_dict['residue_mapper'].keys()),
-            'uniprot_annotation': list(data_dict['residue_mapper'].values())}
+            'uniprot_annotation': data_dict['residue_mapper'].uniprot_resnums}
     for key in keys:
         data[key] = data_dict[key]
 
@@ -45,9 +49,56 @@ def create_csv_file(annotations, csv_dir):
             f.write(','.join([str(x) for x in data_row]) + '\n')
 
 
-def create_annotation_file(annotators, titles, urls, annotation_dir):
+def annotation_file_path(title, annotation_dir, compress=False):
+    """
+    Path of the annotation file written for a track title
+    """
+    nice_title = '_'.join(title.split())
+    return annotation_dir / (f"{nice_title}.txt.gz" if compress else f"{nice_title}.txt")
+
+
+def read_annotation_file(path):
+    """
+    Read an annotation file written by create_annotation_file
+
+    Parameters
+    ----------
+    path
+        Path of the (optionally gzip compressed) annotation file
+
+    Returns
+    -------
+    Annotation object and the URL noted in the first line (None if there is none)
+    """
+    opener = gzip.open if path.suffix == '.gz' else open
+    with opener(path, 'rt') as f:
+        text = f.read()
+    url = None
+    if text.startswith(URL_PREFIX):
+        url = text.split('\n', 1)[0][len(URL_PREFIX):]
+    return Annotation.from_string(text), url
+
+
+def read_previous_annotations(titles, annotation_dir, compress=False):
+    """
+    Read the annotation files of an earlier run for the given track titles
+
+    Returns
+    -------
+    Dictionary of {title: (Annotation, URL or None)} for all titles with an existing file
+    """
+    previous = dict()
+    for title in titles:
+        path = annotation_file_path(title, annotation_dir, compress)
+        if path.exists():
+            previous[title] = read_annotation_file(path)
+    return previous
+
+
+def create_annotation_file(annotators, titles, urls, annotation_dir, compress=False):
     """
     Create annotation files that can be uploaded to SWISS-MODEL
+    Files whose annotations and URL header did not change are not rewritten.
     
     Parameters
     ----------
@@ -56,19 +107,32 @@ def create_annotation_file(annotators, titles, urls, annotation_dir):
     titles
         List of string titles for the annotations, used for filenames
     urls
-        List of URL strings containing information (PDB ID, notes)
+        List of URL strings containing information (PDB ID, notes), None (or an empty list)
+        for tracks without URL, whose files are written without URL header
     annotation_dir
         Directory that SWISS-MODEL files will be written to
+    compress
+        Boolean to write gzip compressed files (.txt.gz)
+        Default is False
     """
 
     for i, (title, annotator) in enumerate(zip(titles, annotators)):
-        nice_title = '_'.join(title.split())
-        with open(annotation_dir / f"{nice_title}.txt", "w") as f:
-            if len(urls):
+        path = annotation_file_path(title, annotation_dir, compress)
+        url = urls[i] if len(urls) else None
+        if path.exists():
+            previous, previous_url = read_annotation_file(path)
+            if previous.digest() == annotator.digest() and url == previous_url:
+                continue
+        if compress:
+            f = gzip.open(path, "wt")
+        else:
+            f = open(path, "w")
+        with f:
+            if url is not None:
                 # This writes the URL to the first line of the file.
                 # TODO: check if # can be used as a comment in the SWISS-MODEL annotation file
-                f.write(f"# URL: {urls[i]}\n")
-            f.write(str(annotator))
+                f.write(f"{URL_PREFIX}{url}\n")
+            annotator.write(f)
 
 
 def example_ensemble(uniprot_id, pdb_search_str, output_path, post=False, email=None):
@@ -102,10 +166,21 @@ def example_ensemble(uniprot_id, pdb_search_str, output_path, post=False, email=
     reference_mapper = parse_pdbe.UniProtBasedMapping(uniprot_id)
     pdb_info_list = reference_mapper.search_pdbs_by_protein_name(pdb_search_str)
     pdb_chain_pairs = [(p["pdb_id"], p["chain_id"]) for p in pdb_info_list]
-    residue_mapping = parse_pdbe.get_pdb_to_uniprot_mapping(pdb_info_list[0]["pdb_id"])[pdb_info_list[0]["chain_id"]]
+    residue_mapping = parse_pdbe.get_pdb_to_uniprot_mapping(pdb_info_list[0]["pdb_id"],
+                                                            reference_mapper.uniprot_sequence)[pdb_info_list[0]["chain_id"]]
     annotations = annotate.get_annotations_ensemble(uniprot_id, pdb_chain_pairs, residue_mapping)
     # Make post=True and change email to post to beta SWISS MODEL website
-    annotators, titles, urls = annotate.make_swiss_model_annotators(annotations, post=post, email=email)
+    annotators, titles, _ = annotate.make_swiss_model_annotators(annotations)
+    urls = []
+    if post:
+        # Tracks that did not change since the last run keep their URL instead of being uploaded again
+        previous = read_previous_annotations(titles, annotation_dir)
+        try:
+            urls = annotate.post_annotators(annotations, annotators, titles, email=email, previous=previous)
+        except UploadError as e:
+            # keep the URLs of the tracks that were uploaded
+            create_annotation_file(annotators, titles, e.urls, annotation_dir)
+            raise
     create_annotation_file(annotators, titles, urls, annotation_dir)
     annotations.write_rmsds_to_reference(annotation_dir / f"RMSD_to_{annotations.pdb_id}_{annotations.chain}.txt")
 
@@ -144,7 +219,8 @@ def example_single(pdb_id, uniprot_id, output_path, full_pdb_solvent_accessibili
 
     reference_mapper = parse_pdbe.UniProtBasedMapping(uniprot_id)
     pdb_info = reference_mapper.search_pdb_by_id(pdb_id)
-    residue_mapping = parse_pdbe.get_pdb_to_uniprot_mapping(pdb_info["pdb_id"])[pdb_info["chain_id"]]
+    residue_mapping = parse_pdbe.get_pdb_to_uniprot_mapping(pdb_info["pdb_id"],
+                                                            reference_mapper.uniprot_sequence)[pdb_info["chain_id"]]
     annotations = annotate.get_annotations_single(uniprot_id, pdb_id, residue_mapping, pdb_info["chain_id"],
                                                   n_modes=6, full_pdb_solvent_accessibility=full_pdb_solvent_accessibility)
 
@@ -163,7 +239,17 @@ def example_single(pdb_id, uniprot_id, output_path, full_pdb_solvent_accessibili
         fh.write(solvent_accessibility_text)
 
     # Make post=True and change email to post to beta SWISS MODEL website
-    annotators, titles, urls = annotate.make_swiss_model_annotators(annotations, post=post, email=email)
+    annotators, titles, _ = annotate.make_swiss_model_annotators(annotations)
+    urls = []
+    if post:
+        # Tracks that did not change since the last run keep their URL instead of being uploaded again
+        previous = read_previous_annotations(titles, annotation_dir)
+        try:
+            urls = annotate.post_annotators(annotations, annotators, titles, email=email, previous=previous)
+        except UploadError as e:
+            # keep the URLs of the tracks that were uploaded
+            create_annotation_file(annotators, titles, e.urls, annotation_dir)
+            raise
     create_annotation_file(annotators, titles, urls, annotation_dir)
     # print(list(zip(titles, urls)))
 
@@ -0,0 +1,194 @@
+"""
+Solvent accessible surface area by the Shrake-Rupley algorithm, in process and on NumPy arrays.
+
+Each atom is represented by points on a sphere of its van der Waals radius plus
+the probe radius. A point is accessible if it lies outside the expanded spheres
+of all other atoms, and the accessible area of the atom is its sphere area times
+the fraction of accessible points. Neighbors are found with a cell list of cell
+size equal to the largest possible contact distance, so only atoms in the 27
+surrounding cells are tested, and all points of the atoms of one cell are tested
+against all candidates at once.
+
+Shrake A, Rupley JA. Environment and exposure to solvent of protein atoms.
+Lysozyme and insulin. J Mol Biol. 1973;79(2):351-371.
+
+usage example:
+
+from str_derived_annotations import sasa
+
+residues = sasa.residue_sasa(atoms.select("protein and not hydrogen"))  # ProDy atoms
+print(residues.resnums[:5], residues.sasa[:5])
+"""
+import itertools
+import typing
+from dataclasses import dataclass
+
+import numpy as np
+
+# Bondi van der Waals radii in Angstrom, by element
+VDW_RADII = {"H": 1.2, "C": 1.7, "N": 1.55, "O": 1.52, "S": 1.8, "P": 1.8, "SE": 1.9}
+DEFAULT_RADIUS = 1.8
+PROBE_RADIUS = 1.4
+
+_NEIGHBOR_OFFSETS = np.array(list(itertools.product((-1, 0, 1), repeat=3)))
+
+
+def sphere_points(n_points: int = 100) -> np.ndarray:
+    """
+    Approximately evenly spaced points on the unit sphere (golden section spiral)
+
+    Returns
+    -------
+    (n_points, 3) array
+    """
+    i = np.arange(n_points) + 0.5
+    z = 1 - 2 * i / n_points
+    r = np.sqrt(1 - z * z)
+    phi = np.pi * (3 - np.sqrt(5)) * i
+    return np.column_stack((r * np.cos(phi), r * np.sin(phi), z))
+
+
+def element_radii(elements: typing.Iterable[str]) -> np.ndarray:
+    """
+    Van der Waals radii for element symbols, DEFAULT_RADIUS for unknown ones
+    """
+    return np.array([VDW_RADII.get(e.strip().upper(), DEFAULT_RADIUS) for e in elements], dtype=float)
+
+
+def shrake_rupley(coords: np.ndarray, radii: np.ndarray, probe: float = PROBE_RADIUS,
+                  n_points: int = 100) -> np.ndarray:
+    """
+    Solvent accessible surface area of each atom
+
+    Parameters
+    ----------
+    coords
+        (n, 3) atom coordinates
+    radii
+        (n,) van der Waals radii
+    probe
+        probe (solvent) radius
+    n_points
+        number of points per atom sphere, more points are more accurate and slower
+
+    Returns
+    -------
+    (n,) array of accessible areas in square Angstrom
+    """
+    coords = np.asarray(coords, dtype=float)
+    radii = np.asarray(radii, dtype=float) + probe
+    n = len(coords)
+    if not n:
+        return np.zeros(0)
+    points = sphere_points(n_points)
+    # cell list: atoms closer than the largest contact distance are in the same or adjacent cells
+    cells = np.floor((coords - coords.min(axis=0)) / (2 * radii.max())).astype(np.int64)
+    dims = cells.max(axis=0) + 1
+    cell_ids = np.ravel_multi_index(cells.T, dims)
+    order = np.argsort(cell_ids, kind="stable")
+    unique_ids, starts = np.unique(cell_ids[order], return_index=True)
+    ends = np.append(starts[1:], n)
+    cell_ranges = dict(zip(unique_ids.tolist(), zip(starts.tolist(), ends.tolist())))
+
+    accessible = np.zeros(n)
+    for start, end in zip(starts, ends):
+        members = order[start:end]
+        neighbor_cells = cells[members[0]] + _NEIGHBOR_OFFSETS
+        neighbor_cells = neighbor_cells[np.all((neighbor_cells >= 0) & (neighbor_cells < dims), axis=1)]
+        candidates = np.concatenate([order[slice(*cell_ranges[c])]
+                                     for c in np.ravel_multi_index(neighbor_cells.T, dims).tolist()
+                                     if c in cell_ranges])
+        # keep candidates in contact with at least one member
+        pair_distances = np.linalg.norm(coords[members, None, :] - coords[candidates], axis=2)
+        candidates = candidates[np.any(pair_distances < radii[members, None] + radii[candidates], axis=0)]
+        candidate_coords = coords[candidates]
+        # (members, points, 3) surface points, (members, points, candidates) squared distances
+        surface = coords[members, None, :] + radii[members, None, None] * points
+        distances = (np.einsum("mpk,mpk->mp", surface, surface)[:, :, None]
+                     - 2 * surface @ candidate_coords.T
+                     + np.einsum("ck,ck->c", candidate_coords, candidate_coords))
+        buried = distances < radii[candidates] ** 2
+        buried &= (candidates[None, :] != members[:, None])[:, None, :]
+        accessible_fraction = 1 - buried.any(axis=2).mean(axis=1)
+        accessible[members] = accessible_fraction * 4 * np.pi * radii[members] ** 2
+    return accessible
+
+
+@dataclass
+class ResidueSASA:
+    """
+    Accessible surface area per residue, in order of the first atom of each residue
+    """
+    chids: np.ndarray
+    resnums: np.ndarray
+    icodes: np.ndarray
+    resnames: np.ndarray
+    sasa: np.ndarray
+
+    def save(self, path):
+        """
+        Writes the arrays as uncompressed .npz file
+        """
+        with open(path, "wb") as f:
+            np.savez(f, chids=self.chids, resnums=self.resnums, icodes=self.icodes, resnames=self.resnames,
+                     sasa=self.sasa)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["chids"], data["resnums"], data["icodes"], data["resnames"], data["sasa"])
+
+    @classmethod
+    def from_atoms(cls, atoms, atom_values: np.ndarray, per_residue: bool = False):
+        """
+        Residue table of ProDy atoms, residues start wherever chain, residue number or insertion code change
+
+        Parameters
+        ----------
+        atoms
+            ProDy AtomGroup or selection
+        atom_values
+            value of each atom
+        per_residue
+            if True, atom_values hold one value per residue repeated for its atoms (e.g. DSSP
+            accessibilities) and the value of the first atom is used, otherwise values are summed
+        """
+        chids, resnums, icodes = atoms.getChids(), atoms.getResnums(), atoms.getIcodes()
+        new_residue = np.ones(len(resnums), dtype=bool)
+        new_residue[1:] = (chids[1:] != chids[:-1]) | (resnums[1:] != resnums[:-1]) | (icodes[1:] != icodes[:-1])
+        starts = np.nonzero(new_residue)[0]
+        if per_residue:
+            values = np.asarray(atom_values, dtype=float)[starts]
+        else:
+            values = np.bincount(np.cumsum(new_residue) - 1, weights=atom_values, minlength=len(starts))
+        return cls(chids[starts], resnums[starts], icodes[starts], atoms.getResnames()[starts], values)
+
+    def relative(self, max_areas: typing.Mapping[str, float]) -> np.ndarray:
+        """
+        SASA relative to the maximal area of each residue type, NaN for residue types not in max_areas
+        """
+        return self.sasa / np.array([max_areas.get(r, np.nan) for r in self.resnames])
+
+
+def residue_sasa(atoms, probe: float = PROBE_RADIUS, n_points: int = 100) -> ResidueSASA:
+    """
+    Solvent accessible surface area per residue of ProDy atoms
+    Only the given atoms are considered, e.g. select "protein and not hydrogen" first
+    to leave out waters and ligands as DSSP does.
+
+    Parameters
+    ----------
+    atoms
+        ProDy AtomGroup or selection
+    probe
+        probe (solvent) radius
+    n_points
+        number of points per atom sphere
+
+    Returns
+    -------
+    ResidueSASA
+    """
+    atom_sasa = shrake_rupley(atoms.getCoords(), element_radii(atoms.getElements()), probe=probe,
+                              n_points=n_points)
+    return ResidueSASA.from_atoms(atoms, atom_sasa)
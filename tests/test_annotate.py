@@ -0,0 +1,204 @@
+import numpy as np
+import pytest
+
+from str_derived_annotations import annotate
+
+matplotlib = pytest.importorskip("matplotlib")
+
+
+def test_numbers_to_colors_matches_matplotlib():
+    from matplotlib import cm, colors
+    numbers = np.random.default_rng(0).random(200) * 5
+    norm = colors.Normalize(vmin=numbers.min(), vmax=numbers.max())
+    colormap = cm.get_cmap("jet")
+    assert annotate.numbers_to_colors(numbers) == [colors.to_hex(colormap(norm(n))) for n in numbers]
+
+
+def test_numbers_to_colors_nan_gets_bad_color():
+    from matplotlib import cm, colors
+    bad = colors.to_hex(cm.get_cmap("jet").get_bad()[:3])
+    result = annotate.numbers_to_colors([0., np.nan, 1.])
+    assert result[1] == bad
+    assert result[0] != result[2] and bad not in (result[0], result[2])
+    assert annotate.numbers_to_colors([np.nan]) == [bad]
+
+
+class SyntheticContext(annotate.StructureContext):
+    """
+    StructureContext serving a synthetic chain and its residue SASA instead of downloading a file
+    """
+
+    def __init__(self, calphas, residues):
+        super().__init__(calphas.title)
+        self._synthetic_calphas, self._synthetic_residues = calphas, residues
+
+    def calphas(self, chain=None):
+        return self._synthetic_calphas
+
+    def sasa(self, chain=None):
+        return self._synthetic_residues
+
+
+def synthetic_chain(n=40, seed=0):
+    from str_derived_annotations.calpha_reader import CalphaAtoms
+    from str_derived_annotations.sasa import ResidueSASA
+    rng = np.random.default_rng(seed)
+    steps = rng.normal(size=(n, 3))
+    coords = np.cumsum(3.8 * steps / np.linalg.norm(steps, axis=1)[:, None], axis=0)
+    resnums = np.arange(1, n + 1, dtype=np.int32)
+    resnames = np.array(["ALA", "GLY", "SER", "LYS"] * (n // 4))
+    calphas = CalphaAtoms("1xyzA", coords.astype(np.float32), np.full(n, "A"), resnums,
+                          np.full(n, "", dtype="U1"), resnames)
+    residues = ResidueSASA(np.full(n, "A"), resnums, np.full(n, ""), resnames, np.linspace(10., 100., n))
+    return calphas, residues
+
+
+def test_single_annotation_with_partially_mapped_chain(monkeypatch):
+    pd = pytest.importorskip("prody")
+    if not hasattr(pd.GNM, "getHinges"):
+        # GNM.getHinges was removed in newer ProDy versions
+        monkeypatch.setattr(annotate, "get_hinge_indices", lambda enm, mode: pd.calcHinges(enm[mode]))
+    from utils.residue_map import ResidueMap
+    calphas, residues = synthetic_chain()
+    # N-terminal tag (residues 1-5) is not mapped to UniProt
+    residue_mapper = ResidueMap.from_dict({r: r + 100 for r in range(6, 41)})
+    result = annotate.get_annotations_single("P0DTD1", "1xyz", residue_mapper, chain="A", n_modes=3,
+                                             context=SyntheticContext(calphas, residues))
+    assert len(result.relative_solvent_accessibility) == len(calphas)
+    assert np.isnan(result.relative_solvent_accessibility[:5]).all()
+    rows = list(result.get_output_mapping()["Relative Solvent Accessibility"])
+    assert [r[0] for r in rows] == list(range(106, 141))
+    expected = residues.sasa[5:] / np.array([annotate.AA_SA_VOL[r] for r in residues.resnames[5:]])
+    np.testing.assert_allclose([r[1] for r in rows], np.round(expected, 2))
+    assert len(list(result.get_output_mapping()["ENM fluctuations"])) == 35
+
+
+def test_relative_solvent_accessibility_insertion_codes_chains_and_unknown_residues():
+    from str_derived_annotations.sasa import ResidueSASA
+    from utils.residue_map import ResidueMap
+    calphas, _ = synthetic_chain(8)
+    residues = ResidueSASA(np.array(["A", "A", "A", "A", "B", "B"]), np.array([9, 10, 10, 11, 10, 12]),
+                           np.array(["", "", "A", "", "", ""]), np.array(["ALA", "GLY", "MSE", "SER", "LYS", "ALA"]),
+                           np.array([23., 15., 50., 46., 100., 11.5]))
+    residue_mapper = ResidueMap([10, 10, 11, 12], [110, 111, 112, 113], icodes=["", "A", "", ""])
+    context = SyntheticContext(calphas, residues)
+    result = annotate.get_relative_solvent_accessibility("1xyz", residue_mapper, "A", context=context)
+    # 10A is kept, MSE has no reference area
+    np.testing.assert_allclose(result, [0.2, np.nan, 0.4])
+    result = annotate.get_relative_solvent_accessibility("1xyz", residue_mapper, None, context=context)
+    np.testing.assert_allclose(result, [0.2, np.nan, 0.4, 0.5, 0.1])
+
+
+class AtomsContext(annotate.StructureContext):
+    """
+    StructureContext serving a given all-atom structure instead of downloading a file
+    """
+
+    def __init__(self, pdb_id, atoms):
+        super().__init__(pdb_id)
+        self._atoms = atoms
+
+
+def ubiquitin_atoms(pd):
+    from pathlib import Path
+    path = Path(pd.__file__).parent / "tests" / "datafiles" / "pdb1ubi.pdb"
+    if not path.exists():
+        pytest.skip("pdb1ubi.pdb not shipped with ProDy")
+    return pd.parsePDB(str(path))
+
+
+@pytest.mark.parametrize("chain", [None, "A"])
+def test_dssp_gets_a_pdb_file(monkeypatch, tmp_path, chain):
+    pd = pytest.importorskip("prody")
+    pd.confProDy(verbosity="none")
+    inputs = []
+
+    def exec_dssp(pdb, outputname=None, outputdir=None):
+        inputs.append(pd.parsePDB(pdb))
+        return pdb
+
+    monkeypatch.setattr(pd, "execDSSP", exec_dssp)
+    monkeypatch.setattr(pd, "parseDSSP", lambda dssp_file, structure: structure)
+    atoms = ubiquitin_atoms(pd)
+    structure = AtomsContext("1ubi", atoms).dssp(chain)
+    assert len(inputs) == 1
+    assert inputs[0].numAtoms() == structure.numAtoms() == atoms.numAtoms()
+    np.testing.assert_allclose(inputs[0].getCoords(), atoms.getCoords())
+
+
+def test_dssp_accessibilities():
+    import shutil
+    pd = pytest.importorskip("prody")
+    if shutil.which("mkdssp") is None and shutil.which("dssp") is None:
+        pytest.skip("DSSP is not installed")
+    pd.confProDy(verbosity="none")
+    residues = AtomsContext("1ubi", ubiquitin_atoms(pd)).dssp_residues("A")
+    protein = ubiquitin_atoms(pd).select("protein and name CA")
+    assert residues.resnums.tolist() == protein.getResnums().tolist()
+    assert np.all(residues.sasa >= 0) and np.any(residues.sasa > 0)
+
+
+def structure_files(monkeypatch, tmp_path, pdb_ids):
+    """
+    Writes a small mmCIF file per PDB ID and serves them instead of downloading, without the default C-alpha cache
+    """
+    from test_calpha_reader import write_cif
+    paths = dict()
+    for i, pdb_id in enumerate(pdb_ids):
+        paths[pdb_id] = tmp_path / f"{pdb_id}.cif.gz"
+        write_cif(paths[pdb_id], [("ATOM", "C", "CA", "ALA", chain, r, "")
+                                  for chain in "AB" for r in range(1, 6 + i)])
+    monkeypatch.setattr(annotate.fetch, "get_structure_file", lambda pdb_id: paths[pdb_id])
+    monkeypatch.setattr(annotate, "get_calpha_cache", lambda: None)
+    return paths
+
+
+@pytest.mark.parametrize("parse_workers", [1, 2])
+def test_get_structures_parses_and_caches(monkeypatch, tmp_path, parse_workers):
+    pytest.importorskip("prody")
+    from str_derived_annotations.calpha_reader import CalphaCache
+    structure_files(monkeypatch, tmp_path, ["1abc", "2abc", "3abc"])
+    cache = CalphaCache(tmp_path / "calphas")
+    pairs = [("1abc", "A"), ("2abc", "B"), ("3abc", "A")]
+    structures = annotate.get_structures(pairs, parse_workers=parse_workers, cache=cache)
+    assert [s.numAtoms() for s in structures] == [5, 6, 7]
+    assert [set(s.getChids()) for s in structures] == [{"A"}, {"B"}, {"A"}]
+    assert len(list(cache.directory.glob("*.npz"))) == 3
+    cached = annotate.get_structures(pairs, parse_workers=parse_workers, cache=cache)
+    assert [s.getTitle() for s in cached] == [s.getTitle() for s in structures]
+
+
+@pytest.mark.parametrize("parse_workers", [1, 2])
+def test_get_structures_reports_failing_parses(monkeypatch, tmp_path, parse_workers):
+    pytest.importorskip("prody")
+    structure_files(monkeypatch, tmp_path, ["1abc", "2abc"])
+    # chain C is not in the files, so the workers raise
+    pairs = [("1abc", "A"), ("2abc", "C")]
+    errors = dict()
+    structures = annotate.get_structures(pairs, parse_workers=parse_workers, errors=errors, cache=None)
+    assert len(structures) == 1 and structures[0].getTitle() == "1abcA"
+    assert list(errors) == ["2abc"] and "chain C" in str(errors["2abc"])
+    with pytest.raises(ValueError, match="chain C"):
+        annotate.get_structures(pairs, parse_workers=parse_workers)
+
+
+def test_post_annotators_keeps_urls_of_successful_uploads(monkeypatch):
+    from types import SimpleNamespace
+    from utils.sm_annotations import Annotation, UploadError
+    error = ValueError("upload failed")
+
+    def post_many(items, email=None, compress=False):
+        assert [title for title, _ in items] == ["B PDB ID 1xyz Chain A", "C PDB ID 1xyz Chain A"]
+        raise UploadError(["https://b", None], {1: error})
+
+    monkeypatch.setattr(annotate, "post_many", post_many)
+    annotators = []
+    for value in ["1", "2", "3"]:
+        annotators.append(Annotation())
+        annotators[-1].add("P0DTD1", 1, "#ff0000", value)
+    previous = {"A": (annotators[0], "https://a")}
+    with pytest.raises(UploadError) as info:
+        annotate.post_annotators(SimpleNamespace(pdb_id="1xyz", chain="A"), annotators, ["A", "B", "C"],
+                                 previous=previous)
+    assert info.value.urls == ["https://a", "https://b", None]
+    assert info.value.errors == {2: error}
@@ -0,0 +1,56 @@
+import gzip
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from str_derived_annotations import calpha_reader
+
+HEADER = ["group_PDB", "id", "type_symbol", "label_atom_id", "label_alt_id", "label_comp_id", "label_asym_id",
+          "label_seq_id", "pdbx_PDB_ins_code", "Cartn_x", "Cartn_y", "Cartn_z", "auth_seq_id", "auth_comp_id",
+          "auth_asym_id", "auth_atom_id", "pdbx_PDB_model_num"]
+
+
+def write_cif(path, atoms):
+    """
+    Writes a minimal mmCIF file, atoms are (group, element, name, resname, chain, resnum, icode) tuples
+    """
+    lines = ["data_test", "#", "loop_"] + [f"_atom_site.{name}" for name in HEADER]
+    for i, (group, element, name, resname, chain, resnum, icode) in enumerate(atoms):
+        lines.append(f"{group} {i + 1} {element} {name} . {resname} {chain} {resnum} {icode or '?'} "
+                     f"{i:.3f} {2 * i:.3f} {3 * i:.3f} {resnum} {resname} {chain} {name} 1")
+    lines.append("#")
+    with gzip.open(path, "wt") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def test_ligand_and_ion_calphas_are_skipped(tmp_path):
+    path = tmp_path / "test.cif.gz"
+    write_cif(path, [
+        ("ATOM", "N", "N", "ALA", "A", 1, ""),
+        ("ATOM", "C", "CA", "ALA", "A", 1, ""),
+        ("ATOM", "C", "CA", "GLY", "A", 2, "A"),
+        ("HETATM", "C", "CA", "MSE", "A", 3, ""),
+        ("HETATM", "C", "CA", "ACT", "A", 101, ""),  # ligand carbon named CA
+        ("HETATM", "CA", "CA", "CA", "A", 102, ""),  # calcium ion
+    ])
+    calphas = calpha_reader.read_calphas(path)
+    assert calphas.resnums.tolist() == [1, 2, 3]
+    assert calphas.resnames.tolist() == ["ALA", "GLY", "MSE"]
+    assert calphas.icodes.tolist() == ["", "A", ""]
+
+
+@pytest.mark.parametrize("name, chain", [("mmcif_3o21.cif", None), ("mmcif_3o21.cif", "B")])
+def test_read_calphas_matches_prody_calpha_selection(name, chain):
+    pd = pytest.importorskip("prody")
+    path = Path(pd.__file__).parent / "tests" / "datafiles" / name
+    if not path.exists():
+        pytest.skip(f"{name} not shipped with ProDy")
+    pd.confProDy(verbosity="none")
+    expected = pd.parseMMCIF(str(path), chain=chain, model=1).select("calpha")
+    calphas = calpha_reader.read_calphas(path, chain=chain)
+    assert calphas.chids.tolist() == expected.getChids().tolist()
+    assert calphas.resnums.tolist() == expected.getResnums().tolist()
+    assert calphas.icodes.tolist() == expected.getIcodes().tolist()
+    assert calphas.resnames.tolist() == expected.getResnames().tolist()
+    np.testing.assert_allclose(calphas.coords, expected.getCoords(), atol=1e-3)
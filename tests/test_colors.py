@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from utils import colors
+
+matplotlib = pytest.importorskip("matplotlib")
+
+
+@pytest.mark.parametrize("dtype", [np.float16, np.float32, np.float64])
+def test_rgb_grid_matches_matplotlib(dtype):
+    from matplotlib.colors import to_hex
+    # includes every value halfway between two 8 bit levels
+    values = np.linspace(0, 1, 511).astype(dtype)
+    for rgb in zip(values, values[::-1], np.roll(values, 100)):
+        assert colors.to_hex(rgb) == to_hex(rgb)
+        assert colors.to_hex(rgb + (0.5,)) == to_hex(rgb + (0.5,), keep_alpha=False)
+    grid = np.stack(np.meshgrid(values[::50], values[::50], values[::50]), axis=-1).reshape(-1, 3)
+    assert [colors.to_hex(rgb) for rgb in grid] == [to_hex(rgb) for rgb in grid]
+    assert [colors.to_hex(rgb.tolist()) for rgb in grid] == [to_hex(rgb.tolist()) for rgb in grid]
+
+
+def test_named_and_hex_colors_match_matplotlib():
+    from matplotlib.colors import BASE_COLORS, CSS4_COLORS, to_hex
+    names = list(BASE_COLORS) + list(CSS4_COLORS) + ["Red", "#FFaa00", "#ffaa0080", "tab:blue", "C1", "0.25",
+                                                     "xkcd:sky blue"]
+    assert [colors.to_hex(name) for name in names] == [to_hex(name) for name in names]
+
+
+@pytest.mark.parametrize("color", [[[1, 0, 0]], [1, 0], (1, 0, 0, 0, 0), (2, 0, 0), "notacolor", 5, None,
+                                   ("a", "b", "c")])
+def test_invalid_colors_raise_value_error(color):
+    with pytest.raises(ValueError):
+        colors.to_hex(color)
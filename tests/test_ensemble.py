@@ -0,0 +1,200 @@
+import numpy as np
+import pytest
+
+from str_derived_annotations import ensemble
+
+pd = pytest.importorskip("prody")
+pd.confProDy(verbosity="none")
+
+
+def random_rotation(rng):
+    q, r = np.linalg.qr(rng.normal(size=(3, 3)))
+    q *= np.sign(np.diag(r))
+    if np.linalg.det(q) < 0:
+        q[:, 0] *= -1
+    return q
+
+
+def synthetic_coordsets(n=6, length=120, seed=0):
+    """
+    Noisy copies of one random structure, each rotated and translated, with some positions missing
+    """
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=(length, 3)) * 10
+    coords = np.stack([(base + rng.normal(size=base.shape)) @ random_rotation(rng).T + rng.normal(size=3) * 20
+                       for _ in range(n)])
+    mask = rng.random((n, length)) > 0.1
+    mask[0] = True
+    return coords * mask[..., None], mask
+
+
+def pdb_ensemble(coords, mask):
+    atoms = pd.AtomGroup("synthetic")
+    atoms.setCoords(coords[0])
+    atoms.setNames(np.full(coords.shape[1], "CA"))
+    atoms.setResnames(np.full(coords.shape[1], "ALA"))
+    atoms.setResnums(np.arange(1, coords.shape[1] + 1))
+    result = pd.PDBEnsemble("synthetic")
+    result.setAtoms(atoms)
+    result.setCoords(coords[0])
+    result.addCoordset(coords.copy(), weights=mask[..., None].astype(float))
+    return result
+
+
+def test_kabsch_matches_prody_transformation():
+    coords, mask = synthetic_coordsets()
+    rotations, translations = ensemble.kabsch(coords, coords[0], mask)
+    for i in range(1, len(coords)):
+        transformation = pd.calcTransformation(coords[i], coords[0], mask[i].astype(float)).getMatrix()
+        np.testing.assert_allclose(rotations[i], transformation[:3, :3], atol=1e-6)
+        np.testing.assert_allclose(translations[i], transformation[:3, 3], atol=1e-5)
+    np.testing.assert_allclose(np.linalg.det(rotations), 1.)
+
+
+def test_iterpose_pdb_ensemble_matches_prody_iterpose():
+    coords, mask = synthetic_coordsets()
+    expected, result = pdb_ensemble(coords, mask), pdb_ensemble(coords, mask)
+    expected.iterpose()
+    before = result.getCoordsets()
+    result = ensemble.iterpose_pdb_ensemble(result)
+    assert pd.calcRMSD(expected).max() < 2.
+    np.testing.assert_allclose(pd.calcRMSD(result), pd.calcRMSD(expected), atol=1e-4)
+    np.testing.assert_allclose(result.getMSFs(), expected.getMSFs(), atol=1e-4)
+    np.testing.assert_allclose(result.getCoords(), expected.getCoords(), atol=1e-4)
+    np.testing.assert_array_equal(before, pdb_ensemble(coords, mask).getCoordsets())
+
+
+def test_iterpose_pdb_ensemble_keeps_labels_msa_and_selection():
+    rng = np.random.default_rng(3)
+    # helical C-alpha traces, so that ProDy maps the chains without gaps
+    t = np.arange(30)
+    helix = np.c_[2.3 * np.cos(t * 1.75), 2.3 * np.sin(t * 1.75), 1.5 * t]
+    coords = [(helix + rng.normal(scale=0.3, size=helix.shape)) @ random_rotation(rng).T for _ in range(4)]
+    resnames = np.array(["ALA", "GLY", "SER", "LYS", "TRP", "LEU"] * 5)
+    structures = []
+    for i, xyz in enumerate(coords):
+        # members miss a terminal residue or two, within ProDy's 90% overlap for matching chains
+        keep = (t >= i % 2) & (t < 30 - i // 2)
+        atoms = pd.AtomGroup(f"{i + 1}abc")
+        atoms.setCoords(xyz[keep])
+        atoms.setNames(np.full(keep.sum(), "CA"))
+        atoms.setElements(np.full(keep.sum(), "C"))
+        atoms.setResnames(resnames[keep])
+        atoms.setResnums(np.arange(1, 31)[keep])
+        atoms.setChids(np.full(keep.sum(), "A"))
+        structures.append(atoms)
+    built = pd.buildPDBEnsemble(structures, subset="calpha", superpose=False)
+    built.select("resnum 3 to 25")
+    result = ensemble.iterpose_pdb_ensemble(built)
+    assert result.getLabels() == built.getLabels()
+    assert result.numSelected() == built.numSelected() == 23
+    np.testing.assert_array_equal(result.getMSA().getArray(), built.getMSA().getArray())
+    np.testing.assert_array_equal(result.getWeights(), built.getWeights())
+    assert pd.calcRMSD(built).max() > 10 > 1 > pd.calcRMSD(result).max()
+
+
+def calpha_atoms(title, resnums, resnames, coords):
+    from str_derived_annotations.calpha_reader import CalphaAtoms
+    n = len(resnums)
+    return CalphaAtoms(title, np.asarray(coords, dtype=np.float32), np.full(n, "A"), np.asarray(resnums, dtype=np.int32),
+                       np.full(n, "", dtype="U1"), np.asarray(resnames))
+
+
+def test_build_uniprot_ensemble_columns_and_first_resnames():
+    rng = np.random.default_rng(1)
+    first = calpha_atoms("1abcA", [1, 2, 3], ["ALA", "GLY", "SER"], rng.normal(size=(3, 3)))
+    second = calpha_atoms("2abcA", [12, 13, 14], ["CYS", "CYS", "TRP"], rng.normal(size=(3, 3)))
+    result = ensemble.build_uniprot_ensemble("P0DTD1", [first, second],
+                                             [{1: 101, 2: 102, 3: 103}, {12: 102, 13: 103, 14: 104}])
+    assert result.labels == ["1abcA", "2abcA"]
+    np.testing.assert_array_equal(result.positions, [101, 102, 103, 104])
+    np.testing.assert_array_equal(result.mask, [[True, True, True, False], [False, True, True, True]])
+    assert result.resnames.tolist() == ["ALA", "GLY", "SER", "TRP"]
+    np.testing.assert_allclose(result.coords[1, 1:], second.coords)
+    np.testing.assert_array_equal(result.columns_of([100, 102, 104]), [-1, 1, 3])
+
+
+def synthetic_members(n=6, length=80, seed=2):
+    """
+    Noisy, rotated copies of one random chain as CalphaAtoms with residue mappers (UniProt = PDB + 100),
+    every member but the first misses a few residues
+    """
+    rng = np.random.default_rng(seed)
+    base = rng.normal(size=(length, 3)) * 8
+    members, mappers = [], []
+    for i in range(n):
+        keep = np.ones(length, dtype=bool) if i == 0 else rng.random(length) > 0.1
+        coords = (base + rng.normal(size=base.shape) * 0.5) @ random_rotation(rng).T + rng.normal(size=3) * 15
+        resnums = np.arange(1, length + 1)[keep]
+        members.append(calpha_atoms(f"{i + 1}xyzA", resnums, np.full(len(resnums), "ALA"), coords[keep]))
+        mappers.append({int(r): int(r) + 100 for r in resnums})
+    return members, mappers
+
+
+def tracks(uniprot_ensemble):
+    from str_derived_annotations import annotate
+    pdb_ensemble = uniprot_ensemble.to_pdb_ensemble()
+    return (annotate.get_rmsds_to_reference(pdb_ensemble), annotate.get_rmsd_per_residue(pdb_ensemble),
+            annotate.get_pca_fluctuations(pdb_ensemble))
+
+
+def test_saved_ensemble_round_trip_and_extend(tmp_path):
+    members, mappers = synthetic_members()
+    full = ensemble.build_uniprot_ensemble("P0DTD1", members, mappers)
+    full.superpose()
+
+    partial = ensemble.build_uniprot_ensemble("P0DTD1", members[:4], mappers[:4])
+    partial.superpose()
+    partial.save(tmp_path / "ensemble.npz")
+    loaded = ensemble.UniProtEnsemble.load(tmp_path / "ensemble.npz")
+    for name in ("positions", "coords", "mask", "resnames", "mean"):
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(partial, name))
+    assert loaded.labels == partial.labels and loaded.uniprot_id == "P0DTD1"
+
+    assert loaded.extend(members[3:], mappers[3:]) == ["5xyzA", "6xyzA"]
+    assert loaded.labels == full.labels
+    np.testing.assert_array_equal(loaded.mask, full.mask)
+    # only the newcomers were fitted, the existing members keep their coordinates
+    np.testing.assert_array_equal(loaded.coords[:4], partial.coords)
+    for extended, expected in zip(tracks(loaded), tracks(full)):
+        np.testing.assert_allclose(extended, expected, atol=0.05)
+    loaded.refine()
+    for refined, expected in zip(tracks(loaded), tracks(full)):
+        np.testing.assert_allclose(refined, expected, atol=1e-3)
+
+
+def test_get_annotations_ensemble_extends_saved_ensemble(tmp_path, monkeypatch):
+    from str_derived_annotations import annotate
+    members, mappers = synthetic_members()
+    pairs = [(m.title[:-1], "A") for m in members]
+    by_pdb_id = dict(zip((p for p, _ in pairs), members))
+    mapper_of = {p: m for (p, _), m in zip(pairs, mappers)}
+    loaded = []
+
+    def get_structures(structure_chain_id_pairs, errors=None, **kwargs):
+        loaded.append([p for p, _ in structure_chain_id_pairs])
+        return [by_pdb_id[p].to_atomgroup() for p, _ in structure_chain_id_pairs]
+
+    monkeypatch.setattr(annotate, "get_structures", get_structures)
+    ensemble_file = str(tmp_path / "P0DTD1_1xyzA.npz")
+    full = annotate.get_annotations_ensemble("P0DTD1", pairs, mapper_of["1xyz"], member_residue_mappers=mapper_of)
+    annotate.get_annotations_ensemble("P0DTD1", pairs[:4], mapper_of["1xyz"], member_residue_mappers=mapper_of,
+                                      ensemble_file=ensemble_file)
+    extended = annotate.get_annotations_ensemble("P0DTD1", pairs, mapper_of["1xyz"],
+                                                 member_residue_mappers=mapper_of, ensemble_file=ensemble_file)
+    assert loaded[-1] == ["1xyz", "5xyz", "6xyz"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["P0DTD1_1xyzA.npz"]
+    assert ensemble.UniProtEnsemble.load(ensemble_file).labels == extended.uniprot_ensemble.labels
+    assert extended.ensemble.getLabels() == full.ensemble.getLabels() == [f"{p}_A" for p, _ in pairs]
+    np.testing.assert_allclose(extended.rmsds_to_reference, full.rmsds_to_reference, atol=0.05)
+    np.testing.assert_allclose(extended.rmsds_per_residue, full.rmsds_per_residue, atol=0.05)
+    np.testing.assert_allclose(extended.pca_fluctuations, full.pca_fluctuations, atol=0.05)
+
+
+def test_make_ensemble_labels_members():
+    from str_derived_annotations import annotate
+    members, _ = synthetic_members()
+    structures = [m.to_atomgroup() for m in members[:3]]
+    assert annotate.make_ensemble(structures).getLabels() == [m.title for m in members[:3]]
+    labels = ["1xyz_A", "2xyz_A", "3xyz_A"]
+    assert annotate.make_ensemble(structures, labels=labels).getLabels() == labels
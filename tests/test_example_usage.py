@@ -0,0 +1,46 @@
+import gzip
+
+import pytest
+
+from str_derived_annotations import example_usage
+from utils.sm_annotations import Annotation
+
+
+def track(values=("0.1", "0.2", "0.3")):
+    annotation = Annotation()
+    annotation.add_many("P0DTD1", range(1, len(values) + 1), None, ["#ff0000", (0., 0., 1.), "green"], list(values))
+    annotation.add("P0DTC2", (5, 9), "#00ff00", "range, with comma", reference="https://example.org")
+    return annotation
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_annotation_files_round_trip(tmp_path, compress):
+    annotation = track()
+    path = tmp_path / ("track.txt.gz" if compress else "track.txt")
+    opener = gzip.open if compress else open
+    with opener(path, "wt") as f:
+        f.write(f"{example_usage.URL_PREFIX}https://annotations.test/1\n")
+        annotation.write(f)
+    for read in (Annotation.from_file(path), Annotation.from_string(str(annotation)),
+                 example_usage.read_annotation_file(path)[0]):
+        assert read.digest() == annotation.digest()
+        assert str(read) == str(annotation)
+    assert example_usage.read_annotation_file(path)[1] == "https://annotations.test/1"
+
+
+def test_annotation_files_are_rewritten_only_on_changes(tmp_path):
+    path = example_usage.annotation_file_path("Track 1", tmp_path)
+    example_usage.create_annotation_file([track()], ["Track 1"], ["https://annotations.test/1"], tmp_path)
+    assert example_usage.read_annotation_file(path)[1] == "https://annotations.test/1"
+    mtime = path.stat().st_mtime_ns
+    example_usage.create_annotation_file([track()], ["Track 1"], ["https://annotations.test/1"], tmp_path)
+    assert path.stat().st_mtime_ns == mtime
+    # same content, but the URL header differs
+    example_usage.create_annotation_file([track()], ["Track 1"], [], tmp_path)
+    assert example_usage.read_annotation_file(path)[1] is None
+    example_usage.create_annotation_file([track()], ["Track 1"], ["https://annotations.test/2"], tmp_path)
+    assert example_usage.read_annotation_file(path)[1] == "https://annotations.test/2"
+    # changed content
+    changed = track(("0.1", "0.2", "0.4"))
+    example_usage.create_annotation_file([changed], ["Track 1"], ["https://annotations.test/2"], tmp_path)
+    assert example_usage.read_annotation_file(path)[0].digest() == changed.digest()
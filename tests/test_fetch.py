@@ -0,0 +1,124 @@
+import ftplib
+
+import pytest
+import requests
+
+from utils import fetch, fixtures
+
+URL = "https://api.test/entry/1"
+
+
+class CountingReplayAdapter(fixtures.ReplayAdapter):
+    """
+    Replays the bundle, answering conditional requests matching the recorded ETag with 304
+    """
+
+    def __init__(self, bundle):
+        super().__init__(bundle)
+        self.requests = []
+
+    def send(self, request, **kwargs):
+        self.requests.append(request)
+        etag = self.bundle.index[request.url]["headers"].get("ETag")
+        if etag is not None and request.headers.get("If-None-Match") == etag:
+            response = requests.Response()
+            response.url = request.url
+            response.request = request
+            response.status_code = 304
+            response._content = b""
+            return response
+        return super().send(request, **kwargs)
+
+
+def replay_fetcher(tmp_path, headers=None, content=b'{"value": 1}', **kwargs):
+    bundle = fixtures.FixtureBundle(tmp_path / "bundle")
+    bundle.add(URL, 200, headers or dict(), content)
+    adapter = CountingReplayAdapter(bundle)
+    fetcher = fetch.Fetcher(cache_dir=tmp_path / "cache", ttls={"https://api.test/": 3600}, **kwargs)
+    fetcher.session.mount("https://", adapter)
+    return fetcher, bundle, adapter
+
+
+def test_cached_response_is_served_within_ttl(tmp_path, monkeypatch):
+    fetcher, bundle, adapter = replay_fetcher(tmp_path)
+    now = 1000.
+    monkeypatch.setattr(fetch.time, "time", lambda: now)
+    assert fetcher.get_json(URL) == {"value": 1}
+    now += 3599
+    assert fetcher.get_json(URL) == {"value": 1}
+    assert len(adapter.requests) == 1
+    # expired, fetched again without validators
+    bundle.add(URL, 200, dict(), b'{"value": 2}')
+    now += 2
+    assert fetcher.get_json(URL) == {"value": 2}
+    assert len(adapter.requests) == 2
+    assert "If-None-Match" not in adapter.requests[-1].headers
+
+
+def test_expired_response_is_revalidated(tmp_path, monkeypatch):
+    headers = {"ETag": '"v1"', "Last-Modified": "Mon, 19 Oct 2026 10:00:00 GMT"}
+    fetcher, bundle, adapter = replay_fetcher(tmp_path, headers)
+    now = 1000.
+    monkeypatch.setattr(fetch.time, "time", lambda: now)
+    fetcher.get(URL)
+    now += 3601
+    assert fetcher.get_json(URL) == {"value": 1}
+    assert len(adapter.requests) == 2
+    assert adapter.requests[-1].headers["If-None-Match"] == '"v1"'
+    assert adapter.requests[-1].headers["If-Modified-Since"] == headers["Last-Modified"]
+    # the 304 renews the time-to-live
+    now += 3599
+    fetcher.get(URL)
+    assert len(adapter.requests) == 2
+    # changed on the server
+    bundle.add(URL, 200, {"ETag": '"v2"'}, b'{"value": 2}')
+    now += 3601
+    assert fetcher.get_json(URL) == {"value": 2}
+    assert len(adapter.requests) == 3
+
+
+def test_offline_serves_only_cached_responses(tmp_path, monkeypatch):
+    fetcher, bundle, adapter = replay_fetcher(tmp_path)
+    fetcher.get(URL)
+    offline = fetch.Fetcher(cache_dir=tmp_path / "cache", offline=True)
+    offline.session.mount("https://", adapter)
+    # served even though the time-to-live is over
+    monkeypatch.setattr(fetch.time, "time", lambda: 1e12)
+    assert offline.get_json(URL) == {"value": 1}
+    with pytest.raises(fetch.OfflineError):
+        offline.get("https://api.test/entry/2")
+    with pytest.raises(fetch.OfflineError):
+        offline.get_file("https://files.test/1abc.cif.gz", "1abc.cif.gz")
+    assert len(adapter.requests) == 1
+
+
+def test_temporary_mirror_is_removed_on_close():
+    with fetch.Fetcher(cache_dir=None) as fetcher:
+        mirror_dir = fetcher.mirror_dir
+        assert mirror_dir.is_dir()
+    assert not mirror_dir.exists()
+
+
+def test_ftp_connection_is_closed_when_login_fails(monkeypatch):
+    connections = []
+
+    class FailingFTP:
+        def __init__(self, timeout=None):
+            self.closed = False
+            connections.append(self)
+
+        def connect(self, host, port):
+            pass
+
+        def login(self):
+            raise ftplib.error_perm("530 Login incorrect.")
+
+        def close(self):
+            self.closed = True
+
+    monkeypatch.setattr(fetch.ftplib, "FTP", FailingFTP)
+    session = requests.Session()
+    session.mount("ftp://", fetch.FTPAdapter())
+    with pytest.raises(requests.ConnectionError):
+        session.get("ftp://ftp.test/pub/file.xml.gz")
+    assert len(connections) == 1 and connections[0].closed
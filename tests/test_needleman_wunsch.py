@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from seq_diff_annotations.needleman_wunsch import Align, AlignVectorized, SubstitutionMatrix
+
+AMINO_ACIDS = "ARNDCQEGHILKMFPSTWYV"
+GAP = -8
+
+
+@pytest.fixture(scope="module")
+def subst_matrix():
+    return SubstitutionMatrix()
+
+
+def random_pair(seed):
+    rng = np.random.default_rng(seed)
+    s1 = "".join(rng.choice(list(AMINO_ACIDS), rng.integers(20, 60)))
+    # a mutated, trimmed copy of s1 with some unrelated residues at the ends
+    s2 = [c if rng.random() > 0.2 else rng.choice(list(AMINO_ACIDS)) for c in s1 if rng.random() > 0.1]
+    s2 = "".join(rng.choice(list(AMINO_ACIDS), 5)) + "".join(s2[3:-3]) + "".join(rng.choice(list(AMINO_ACIDS), 4))
+    return s1, s2
+
+
+def alignment_score(aln_s1, aln_s2, subst_matrix, free_ends=False):
+    """
+    Score of an alignment, with free_ends only the columns from the first to the last aligned pair count
+    """
+    pairs = [i for i, (a, b) in enumerate(zip(aln_s1, aln_s2)) if a != "-" and b != "-"]
+    start, end = (pairs[0], pairs[-1] + 1) if free_ends else (0, len(aln_s1))
+    return sum(GAP if "-" in (a, b) else subst_matrix.GetScore(a, b)
+               for a, b in zip(aln_s1[start:end], aln_s2[start:end]))
+
+
+def best_score(s1, s2, subst_matrix, mode):
+    """
+    Optimal alignment score by plain dynamic programming
+    """
+    score = np.zeros((len(s1) + 1, len(s2) + 1))
+    if mode == "global":
+        score[:, 0] = np.arange(len(s1) + 1) * GAP
+        score[0, :] = np.arange(len(s2) + 1) * GAP
+    for i in range(1, len(s1) + 1):
+        for j in range(1, len(s2) + 1):
+            score[i, j] = max(score[i - 1, j - 1] + subst_matrix.GetScore(s1[i - 1], s2[j - 1]),
+                              score[i - 1, j] + GAP, score[i, j - 1] + GAP, 0 if mode == "local" else -np.inf)
+    if mode == "global":
+        return score[-1, -1]
+    if mode == "semiglobal":
+        return max(score[-1, :].max(), score[:, -1].max())
+    return score.max()
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_global_matches_align(seed, subst_matrix):
+    s1, s2 = random_pair(seed)
+    expected = Align(s1, s2, GAP, subst_matrix)
+    result = AlignVectorized(s1, s2, GAP, subst_matrix)
+    assert alignment_score(*result, subst_matrix) == alignment_score(*expected, subst_matrix)
+    assert alignment_score(*result, subst_matrix) == best_score(s1, s2, subst_matrix, "global")
+
+
+@pytest.mark.parametrize("mode", ["semiglobal", "local"])
+@pytest.mark.parametrize("seed", range(5))
+def test_semiglobal_and_local_are_optimal(seed, mode, subst_matrix):
+    s1, s2 = random_pair(seed)
+    aln_s1, aln_s2 = AlignVectorized(s1, s2, GAP, subst_matrix, mode=mode)
+    assert aln_s1.replace("-", "") == s1 and aln_s2.replace("-", "") == s2
+    assert alignment_score(aln_s1, aln_s2, subst_matrix, free_ends=True) == best_score(s1, s2, subst_matrix, mode)
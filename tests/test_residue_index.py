@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from utils.residue_index import ReverseResidueIndex, ReverseResidueIndexBuilder
+from utils.residue_map import ResidueMap
+
+CHAINS = {
+    ("P0DTD1", "6m71", "A"): {1: 1, 2: 2, "2A": 3, 3: 4},
+    ("P0DTD1", "7bv2", "A"): {10: 2, 11: 3, 12: 5, 13: 9},  # 13 is outside the entry
+    ("P0DTC2", "6vxx", "B"): {100: 1, 101: 2},
+}
+LENGTHS = {"P0DTD1": 6, "P0DTC2": 3}
+
+
+def build(chains, index=None):
+    builder = ReverseResidueIndexBuilder(index)
+    for uniprot_ac, length in LENGTHS.items():
+        builder.add_uniprot_entry(uniprot_ac, length)
+    for (uniprot_ac, pdb_id, chain), mapping in chains.items():
+        builder.add_chain(uniprot_ac, pdb_id, chain, mapping)
+    return builder.build()
+
+
+def lookups(index):
+    return {(ac, position): index.lookup(ac, position)
+            for ac, length in LENGTHS.items() for position in range(1, length + 1)}
+
+
+def test_lookup_and_chain_mapping():
+    index = build(CHAINS)
+    assert index.lookup("P0DTD1", 2) == [("6m71", "A", 2), ("7bv2", "A", 10)]
+    assert index.lookup("P0DTD1", 3) == [("6m71", "A", "2A"), ("7bv2", "A", 11)]
+    assert index.lookup("P0DTD1", 6) == []
+    assert index.lookup("P0DTC2", 1) == [("6vxx", "B", 100)]
+    assert len(index) == 9
+    assert index.chain_mapping("6m71", "A", "P0DTD1") == CHAINS[("P0DTD1", "6m71", "A")]
+    assert index.chain_mapping("7bv2", "A", "P0DTD1") == {10: 2, 11: 3, 12: 5}
+    with pytest.raises(IndexError):
+        index.lookup("P0DTD1", 7)
+    with pytest.raises(KeyError):
+        index.lookup("P0DTC9", 1)
+    with pytest.raises(KeyError):
+        index.chain_mapping("6m71", "B", "P0DTD1")
+
+
+def test_save_and_memory_mapped_load(tmp_path):
+    index = build(CHAINS)
+    index.save(tmp_path / "index")
+    loaded = ReverseResidueIndex.load(tmp_path / "index")
+    assert isinstance(loaded.pdb_resnums, np.memmap)
+    assert loaded.structures == index.structures
+    assert lookups(loaded) == lookups(index)
+    assert loaded.chain_mapping("6m71", "A", "P0DTD1") == index.chain_mapping("6m71", "A", "P0DTD1")
+    in_memory = ReverseResidueIndex.load(tmp_path / "index", mmap=False)
+    assert not isinstance(in_memory.pdb_resnums, np.memmap)
+    assert lookups(in_memory) == lookups(index)
+
+
+def test_incremental_builder_matches_full_build(tmp_path):
+    chains = list(CHAINS.items())
+    first = build(dict(chains[:1]))
+    first.save(tmp_path / "index")
+    builder = ReverseResidueIndexBuilder(ReverseResidueIndex.load(tmp_path / "index"))
+    assert builder.has_chain("P0DTD1", "6m71", "A") and not builder.has_chain("P0DTD1", "7bv2", "A")
+    extended = build(dict(chains[1:]), ReverseResidueIndex.load(tmp_path / "index"))
+    full = build(CHAINS)
+    assert extended.structures == full.structures
+    assert lookups(extended) == lookups(full)
+    # chains already indexed are not added twice
+    again = build(CHAINS, extended)
+    assert lookups(again) == lookups(full)
+    with pytest.raises(ValueError):
+        ReverseResidueIndexBuilder(full).add_uniprot_entry("P0DTD1", 7)
+
+
+def test_builder_accepts_residue_maps():
+    mapping = CHAINS[("P0DTD1", "6m71", "A")]
+    from_map = build({("P0DTD1", "6m71", "A"): ResidueMap.from_dict(mapping)})
+    assert lookups(from_map) == lookups(build({("P0DTD1", "6m71", "A"): mapping}))
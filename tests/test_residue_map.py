@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from utils.residue_map import ResidueMap, as_residue_map, parse_pdb_resnum
+
+MAPPING = {-3: 5, 1: 10, 2: 11, "2A": 12, "2B": 13, 3: 14, "10C": 30}
+
+
+def test_round_trip_behaves_like_the_dict():
+    residue_map = ResidueMap.from_dict(MAPPING)
+    assert residue_map == MAPPING
+    assert dict(residue_map) == MAPPING
+    assert list(residue_map) == list(MAPPING)
+    assert list(residue_map.values()) == list(MAPPING.values())
+    assert len(residue_map) == len(MAPPING)
+    assert 2 in residue_map and "2A" in residue_map and 4 not in residue_map and "3A" not in residue_map
+    assert residue_map.get(4) is None and residue_map.get(4, -1) == -1
+    with pytest.raises(KeyError):
+        residue_map[4]
+    with pytest.raises(KeyError):
+        residue_map["not a residue"]
+    assert ResidueMap.from_dict(dict(residue_map)) == residue_map
+    assert as_residue_map(MAPPING) == residue_map
+    assert as_residue_map(residue_map) is residue_map
+
+
+def test_insertion_code_lookup():
+    residue_map = ResidueMap.from_dict(MAPPING)
+    assert residue_map[2] == residue_map["2"] == 11
+    assert residue_map["2A"] == residue_map[(2, "A")] == residue_map[" 2 A "] == 12
+    assert residue_map[(2, " ")] == residue_map[(2, None)] == 11
+    assert residue_map[np.int32(-3)] == 5
+    np.testing.assert_array_equal(
+        residue_map.pdb_to_uniprot([2, 2, 2, 10, 10, 4], ["", "A", " ", "C", "", ""]), [11, 12, 11, 30, -1, -1])
+    np.testing.assert_array_equal(residue_map.pdb_to_uniprot([1, 2]), [10, 11])
+    np.testing.assert_array_equal(residue_map.mask([2, 2, 2], ["B", "C", ""]), [True, False, True])
+    resnums, icodes = residue_map.uniprot_to_pdb([12, 13, 14, 29], return_icodes=True)
+    np.testing.assert_array_equal(resnums, [2, 2, 3, -1])
+    assert icodes.tolist() == ["A", "B", "", ""]
+
+
+def test_subset_and_empty_maps():
+    residue_map = ResidueMap.from_dict(MAPPING)
+    subset = residue_map.subset(residue_map.icodes != "")
+    assert subset == {"2A": 12, "2B": 13, "10C": 30}
+    empty = ResidueMap([], [])
+    assert len(empty) == 0 and empty == {}
+    np.testing.assert_array_equal(empty.pdb_to_uniprot([1, 2]), [-1, -1])
+    np.testing.assert_array_equal(empty.uniprot_to_pdb([1], default=0), [0])
+
+
+def test_invalid_maps_raise():
+    with pytest.raises(ValueError):
+        ResidueMap([1, 2, 2], [10, 11, 12])
+    with pytest.raises(ValueError):
+        ResidueMap([1, 2], [10])
+    assert parse_pdb_resnum("-12B") == (-12, "B")
+    with pytest.raises(KeyError):
+        parse_pdb_resnum(1.5)
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from str_derived_annotations import sasa
+
+
+def test_isolated_atom_is_fully_accessible():
+    result = sasa.shrake_rupley(np.zeros((1, 3)), np.array([1.7]))
+    np.testing.assert_allclose(result, [4 * np.pi * (1.7 + sasa.PROBE_RADIUS) ** 2])
+
+
+def test_distant_atoms_do_not_bury_each_other():
+    coords = np.array([[0., 0., 0.], [20., 0., 0.], [0., 0., 20.]])
+    radii = sasa.element_radii(["C", "N", "O"])
+    np.testing.assert_allclose(sasa.shrake_rupley(coords, radii), 4 * np.pi * (radii + sasa.PROBE_RADIUS) ** 2)
+
+
+def test_overlapping_atoms_lose_a_spherical_cap():
+    distance, radius = 3., 1.7
+    expanded = radius + sasa.PROBE_RADIUS
+    result = sasa.shrake_rupley(np.array([[0., 0., 0.], [distance, 0., 0.]]), np.array([radius, radius]),
+                                n_points=2000)
+    expected = 4 * np.pi * expanded ** 2 - 2 * np.pi * expanded * (expanded - distance / 2)
+    np.testing.assert_allclose(result, [expected, expected], rtol=0.01)
+
+
+def test_buried_atom_has_no_accessible_area():
+    shell = sasa.sphere_points(50) * 2.
+    coords = np.vstack(([0., 0., 0.], shell))
+    result = sasa.shrake_rupley(coords, np.full(len(coords), 1.7))
+    assert result[0] == 0
+    assert np.all(result[1:] > 0)
+
+
+def test_residue_sasa_sums_atoms():
+    pd = pytest.importorskip("prody")
+    atoms = pd.AtomGroup("test")
+    atoms.setCoords(np.array([[0., 0., 0.], [1.5, 0., 0.], [3.8, 0., 0.], [5.3, 0., 0.]]))
+    atoms.setElements(["C", "O", "C", "N"])
+    atoms.setResnums([1, 1, 2, 2])
+    atoms.setIcodes(["", "", "", ""])
+    atoms.setChids(["A"] * 4)
+    atoms.setResnames(["GLY", "GLY", "ALA", "ALA"])
+    residues = sasa.residue_sasa(atoms)
+    atom_sasa = sasa.shrake_rupley(atoms.getCoords(), sasa.element_radii(atoms.getElements()))
+    np.testing.assert_array_equal(residues.resnums, [1, 2])
+    np.testing.assert_allclose(residues.sasa, [atom_sasa[:2].sum(), atom_sasa[2:].sum()])
@@ -0,0 +1,252 @@
+import pytest
+import requests
+
+from utils import fixtures, sm_annotations
+
+
+def test_quantize_non_power_of_ten_step():
+    annotations, colors = sm_annotations._quantize(["0.25", "0.3", "0.76", "1.12", "helix"],
+                                                   ["#000001", "#000002", "#000003", "#000004", "#000005"], 0.25)
+    assert annotations == ["0.25", "0.25", "0.75", "1.0", "helix"]
+    assert colors == ["#000001", "#000001", "#000003", "#000004", "#000005"]
+
+
+def test_compact_with_quarter_step():
+    annotation = sm_annotations.Annotation()
+    for rnum, value in zip(range(1, 5), ["0.25", "0.3", "0.76", "0.74"]):
+        annotation.add("P0DTD1", rnum, "#ff0000", value)
+    compacted = annotation.compact(quantize=0.25)
+    assert list(compacted.annotations) == ["0.25", "0.75"]
+    assert list(compacted.starts) == [1, 3]
+    assert list(compacted.ends) == [2, 4]
+
+
+UPLOAD_URL = "https://annotations.test/upload"
+
+
+class FlakyReplayAdapter(fixtures.ReplayAdapter):
+    """
+    Replays the bundle, raising the given errors for the first sends
+    """
+
+    def __init__(self, bundle, errors=()):
+        super().__init__(bundle)
+        self.errors = list(errors)
+        self.timeouts = []
+
+    def send(self, request, **kwargs):
+        self.timeouts.append(kwargs.get("timeout"))
+        if self.errors:
+            raise self.errors.pop(0)
+        return super().send(request, **kwargs)
+
+
+def upload_session(tmp_path, status, errors=(), headers=None):
+    bundle = fixtures.FixtureBundle(tmp_path / "bundle")
+    bundle.add(UPLOAD_URL, status, headers or dict(), b"")
+    adapter = FlakyReplayAdapter(bundle, errors)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session, adapter
+
+
+def small_annotation():
+    annotation = sm_annotations.Annotation()
+    annotation.add("P0DTD1", 1, "#ff0000", "1.0")
+    return annotation
+
+
+def test_post_many_retries_connect_errors(tmp_path):
+    session, adapter = upload_session(tmp_path, 302, [requests.ConnectTimeout()],
+                                      {"Location": "https://annotations.test/result/1"})
+    urls = sm_annotations.post_many([("Track", small_annotation())], url=UPLOAD_URL, session=session,
+                                    backoff=0, timeout=(1, 2))
+    assert urls == ["https://annotations.test/result/1"]
+    assert adapter.timeouts == [(1, 2), (1, 2)]
+
+
+def test_post_many_retries_unavailable_server(tmp_path):
+    session, adapter = upload_session(tmp_path, 503)
+    with pytest.raises(sm_annotations.UploadError) as info:
+        sm_annotations.post_many([("Track", small_annotation())], url=UPLOAD_URL, session=session,
+                                 retries=2, backoff=0)
+    assert isinstance(info.value.errors[0], requests.HTTPError)
+    assert len(adapter.timeouts) == 3
+
+
+@pytest.mark.parametrize("error", [requests.ReadTimeout(), requests.ConnectionError("connection reset")])
+def test_post_many_does_not_resubmit_after_sending(tmp_path, error):
+    session, adapter = upload_session(tmp_path, 302, [error], {"Location": "https://annotations.test/result/1"})
+    with pytest.raises(sm_annotations.UploadError) as info:
+        sm_annotations.post_many([("Track", small_annotation())], url=UPLOAD_URL, session=session, backoff=0)
+    assert info.value.errors[0] is error
+    assert len(adapter.timeouts) == 1
+
+
+def test_post_many_does_not_retry_server_errors(tmp_path):
+    session, adapter = upload_session(tmp_path, 500)
+    with pytest.raises(sm_annotations.UploadError) as info:
+        sm_annotations.post_many([("Track", small_annotation())], url=UPLOAD_URL, session=session, backoff=0)
+    assert isinstance(info.value.errors[0], requests.HTTPError)
+    assert len(adapter.timeouts) == 1
+
+
+def test_post_many_keeps_successful_urls(tmp_path):
+    error = requests.ReadTimeout()
+    session, adapter = upload_session(tmp_path, 302, [error], {"Location": "https://annotations.test/result/1"})
+    with pytest.raises(sm_annotations.UploadError) as info:
+        sm_annotations.post_many([("Track 1", small_annotation()), ("Track 2", small_annotation())],
+                                 url=UPLOAD_URL, session=session, max_workers=1, backoff=0)
+    assert info.value.urls == [None, "https://annotations.test/result/1"]
+    assert info.value.errors == {0: error}
+
+
+def test_post_many_keeps_successful_chunk_urls(tmp_path):
+    error = requests.ReadTimeout()
+    session, adapter = upload_session(tmp_path, 302, [error], {"Location": "https://annotations.test/result/1"})
+    annotation = small_annotation()
+    annotation.add("P0DTD1", 2, "#00ff00", "2.0")
+    line_size = max(len(line.encode()) for line in annotation.iter_lines())
+    with pytest.raises(sm_annotations.UploadError) as info:
+        sm_annotations.post_many([("Track 1", annotation), ("Track 2", small_annotation())], url=UPLOAD_URL,
+                                 session=session, max_workers=1, backoff=0, max_size=line_size)
+    assert info.value.urls == [[None, "https://annotations.test/result/1"], ["https://annotations.test/result/1"]]
+    assert info.value.errors == {0: [error, None]}
+
+
+class GzipRejectingAdapter(FlakyReplayAdapter):
+    """
+    Upload form answering gzip compressed files with the given status
+    """
+
+    def __init__(self, bundle, status):
+        super().__init__(bundle)
+        self.status = status
+        self.compressed = []
+
+    def send(self, request, **kwargs):
+        self.compressed.append(b"annotation.csv.gz" in request.body)
+        if self.compressed[-1]:
+            response = requests.Response()
+            response.url = request.url
+            response.request = request
+            response.status_code = self.status
+            response._content = b"<html><div class='alert alert-danger'>Invalid file</div></html>"
+            return response
+        return super().send(request, **kwargs)
+
+
+@pytest.mark.parametrize("status", [415, 200])
+def test_post_many_falls_back_to_uncompressed_uploads(tmp_path, monkeypatch, status):
+    monkeypatch.setattr(sm_annotations, "_UNCOMPRESSED_URLS", set())
+    session, _ = upload_session(tmp_path, 302, headers={"Location": "https://annotations.test/result/1"})
+    adapter = GzipRejectingAdapter(session.adapters["https://"].bundle, status)
+    session.mount("https://", adapter)
+    items = [("Track", small_annotation())]
+    assert sm_annotations.post_many(items, url=UPLOAD_URL, session=session, compress="auto") == \
+        ["https://annotations.test/result/1"]
+    assert adapter.compressed == [True, False]
+    # remembered for the next uploads to the same form
+    sm_annotations.post_many(items, url=UPLOAD_URL, session=session, compress="auto")
+    assert adapter.compressed == [True, False, False]
+
+
+def test_post_many_keeps_compressing_accepted_uploads(tmp_path, monkeypatch):
+    monkeypatch.setattr(sm_annotations, "_UNCOMPRESSED_URLS", set())
+    session, adapter = upload_session(tmp_path, 302, headers={"Location": "https://annotations.test/result/1"})
+    sm_annotations.post_many([("Track", small_annotation())] * 2, url=UPLOAD_URL, session=session,
+                             max_workers=1, compress="auto")
+    assert len(adapter.timeouts) == 2
+    assert sm_annotations._UNCOMPRESSED_URLS == set()
+
+
+def test_post_returns_one_url(tmp_path, monkeypatch):
+    session, adapter = upload_session(tmp_path, 302, headers={"Location": "https://annotations.test/result/1"})
+    monkeypatch.setattr(requests, "post", session.post)
+    assert small_annotation().post(url=UPLOAD_URL, title="Track") == "https://annotations.test/result/1"
+
+
+def test_empty_annotation_has_no_chunks(tmp_path):
+    session, adapter = upload_session(tmp_path, 302, headers={"Location": "https://annotations.test/result/1"})
+    empty = sm_annotations.Annotation()
+    assert empty.split(100) == []
+    assert empty.post_chunks(100, url=UPLOAD_URL) == []
+    assert sm_annotations.post_many([("Empty", empty), ("Track", small_annotation())], url=UPLOAD_URL,
+                                    session=session, max_size=100) == [[], ["https://annotations.test/result/1"]]
+    assert len(adapter.timeouts) == 1
+
+
+def test_split_keeps_lines_within_max_size():
+    annotation = sm_annotations.Annotation()
+    for rnum in range(1, 21):
+        annotation.add("P0DTD1" if rnum <= 10 else "P0DTC2", rnum, "#ff0000", str(rnum))
+    lines = list(annotation.iter_lines())
+    max_size = max(sum(len(line.encode()) + 1 for line in lines[:10]),
+                   sum(len(line.encode()) + 1 for line in lines[10:])) - 1
+    chunks = annotation.split(max_size)
+    assert [len(chunk) for chunk in chunks] == [10, 10]
+    assert all(len(str(chunk).encode()) <= max_size + 1 for chunk in chunks)
+    assert [line for chunk in chunks for line in chunk.iter_lines()] == lines
+    with pytest.raises(ValueError):
+        annotation.split(5)
+
+
+def test_add_many_matches_add():
+    expected = sm_annotations.Annotation()
+    expected.add("P0DTD1", 1, "red", "a")
+    expected.add("P0DTD1", (2, 4), (0., 0., 1.), "b", reference="https://example.org")
+    expected.add("P0DTC2", 5, "#00FF00", "c")
+    annotation = sm_annotations.Annotation()
+    annotation.add_many(["P0DTD1", "P0DTD1", "P0DTC2"], [1, 2, 5], [1, 4, 5], ["red", (0., 0., 1.), "#00FF00"],
+                        ["a", "b", "c"], [None, "https://example.org", None])
+    assert str(annotation) == str(expected)
+
+
+def test_add_many_broadcasts_single_values():
+    annotation = sm_annotations.Annotation()
+    annotation.add_many("P0DTD1", [1, 2, 3], None, (1., 0., 0.), "helix", "https://example.org")
+    assert annotation.annotations == ["helix"] * 3
+    assert annotation.colors == ["#ff0000"] * 3
+    assert annotation.references == ["https://example.org"] * 3
+    assert list(annotation.ends) == [1, 2, 3]
+
+
+@pytest.mark.parametrize("kwargs", [
+    dict(annotations=["a", "b"]),
+    dict(annotations=["a", "b", 3]),
+    dict(uniprot_ac="not an accession"),
+    dict(starts=[0, 1, 2]),
+    dict(colors="notacolor"),
+    dict(references=["a", 1, None]),
+])
+def test_add_many_rejects_invalid_columns(kwargs):
+    arguments = dict(uniprot_ac="P0DTD1", starts=[1, 2, 3], ends=None, colors="red", annotations="a")
+    arguments.update(kwargs)
+    annotation = sm_annotations.Annotation()
+    with pytest.raises(ValueError):
+        annotation.add_many(**arguments)
+    assert len(annotation) == 0
+
+
+def test_compact_merges_adjacent_runs_only():
+    annotation = sm_annotations.Annotation()
+    annotation.add_many("P0DTD1", [1, 2, 3, 5, 6, 7], None, ["red", "red", "red", "red", "blue", "blue"],
+                        ["x", "x", "x", "x", "x", "x"])
+    annotation.add("P0DTC2", 8, "blue", "x")
+    compacted = annotation.compact()
+    assert list(zip(compacted.starts, compacted.ends)) == [(1, 3), (5, 5), (6, 7), (8, 8)]
+    assert compacted.uniprot_acs == ["P0DTD1"] * 3 + ["P0DTC2"]
+    assert len(sm_annotations.Annotation().compact()) == 0
+
+
+def test_getitem_slices_all_columns():
+    annotation = sm_annotations.Annotation()
+    annotation.add_many("P0DTD1", [1, 2, 3, 4], None, "red", ["a", "b", "c", "d"], [None, "r", None, None])
+    selected = annotation[1:3]
+    assert len(selected) == 2
+    assert list(selected.starts) == [2, 3] and selected.annotations == ["b", "c"]
+    assert selected.references == ["r", None]
+    assert list(selected.iter_lines()) == list(annotation.iter_lines())[1:3]
+    assert list(annotation[::-1].starts) == [4, 3, 2, 1]
+    with pytest.raises(TypeError):
+        annotation[0]
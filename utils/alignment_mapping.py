@@ -0,0 +1,92 @@
+"""
+PDB to UniProt residue mapping by sequence alignment, for structures without (up to date) SIFTS mappings.
+
+The observed sequence of each chain (residues with a C-alpha atom, in the order
+they appear in the structure) is aligned semi-globally against the UniProt
+sequence, so expression tags and missing termini do not need to be known.
+"""
+import typing
+
+import numpy as np
+
+from seq_diff_annotations.needleman_wunsch import AlignVectorized, SubstitutionMatrix
+from utils import lazy
+from utils.residue_map import ResidueMap
+
+fetch = lazy.lazy_import("utils.fetch")
+
+
+def map_chain_by_alignment(calphas, uniprot_sequence: str, subst_matrix: SubstitutionMatrix = None,
+                           min_identity: float = 0.9) -> typing.Union[ResidueMap, None]:
+    """
+    Maps the residues of one chain onto a UniProt sequence
+
+    Parameters
+    ----------
+    calphas
+        ProDy selection of the C-alpha atoms of one chain
+    uniprot_sequence
+        UniProt sequence as string
+    subst_matrix
+        SubstitutionMatrix used for the alignment, defaults to BLOSUM62
+    min_identity
+        minimal fraction of identical residues among the aligned pairs,
+        chains below this are considered to be a different protein
+
+    Returns
+    -------
+    ResidueMap of {pdb_resnum: uniprot_resnum} or None if the chain does not match the sequence
+    """
+    chain_sequence = calphas.getSequence()
+    if not len(chain_sequence):
+        return None
+    aln_chain, aln_uniprot = AlignVectorized(chain_sequence, uniprot_sequence,
+                                             subst_matrix=subst_matrix, mode="semiglobal")
+    aln_chain = np.frombuffer(aln_chain.encode(), dtype="S1")
+    aln_uniprot = np.frombuffer(aln_uniprot.encode(), dtype="S1")
+    chain_gap, uniprot_gap = aln_chain == b"-", aln_uniprot == b"-"
+    # position of each alignment column in the chain and UniProt sequence
+    chain_positions = np.cumsum(~chain_gap) - 1
+    uniprot_positions = np.cumsum(~uniprot_gap)
+    aligned = ~chain_gap & ~uniprot_gap
+    if not aligned.any() or np.mean(aln_chain[aligned] == aln_uniprot[aligned]) < min_identity:
+        return None
+    chain_positions = chain_positions[aligned]
+    return ResidueMap(calphas.getResnums()[chain_positions], uniprot_positions[aligned],
+                      calphas.getIcodes()[chain_positions])
+
+
+def get_pdb_to_uniprot_mapping_by_alignment(pdb_id: str, uniprot_sequence: str, structure=None,
+                                            min_identity: float = 0.9) -> dict:
+    """
+    Maps from PDB residue number to UniProt residue number for each chain that matches the UniProt sequence
+    Same output as parse_pdbe.get_pdb_to_uniprot_mapping but without SIFTS.
+
+    Parameters
+    ----------
+    pdb_id
+    uniprot_sequence
+        UniProt sequence as string
+    structure
+        ProDy AtomGroup of the entry, parsed from the RCSB mmCIF file if not given
+    min_identity
+        see map_chain_by_alignment
+
+    Returns
+    -------
+    dict of {chain: ResidueMap of {pdb_resnum: uniprot_resnum}}
+    """
+    if structure is None:
+        import prody as pd
+        structure = pd.parseCIF(str(fetch.get_structure_file(pdb_id)))
+    subst_matrix = SubstitutionMatrix()
+    chains = dict()
+    calphas = structure.select("calpha")
+    if calphas is None:
+        return chains
+    for chain in np.unique(calphas.getChids()).tolist():
+        residue_map = map_chain_by_alignment(calphas.select(f"chain {chain}"), uniprot_sequence,
+                                             subst_matrix=subst_matrix, min_identity=min_identity)
+        if residue_map is not None:
+            chains[chain] = residue_map
+    return chains
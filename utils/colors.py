@@ -0,0 +1,128 @@
+"""
+Color parsing without importing matplotlib.
+
+Covers the color formats used throughout the annotation scripts, i.e. hex
+strings, RGB(A) tuples of floats between 0 and 1, the single letter colors
+and the CSS4 color names. Everything else matplotlib understands ("tab:blue",
+"xkcd:sky blue", "C0", grayscale strings such as "0.5", ...) is handed to
+matplotlib, which is only imported in that case. Results are the same as
+matplotlib.colors.to_hex.
+"""
+import functools
+import numbers
+import re
+
+HEX_PATTERN = re.compile(r"#([0-9a-fA-F]{6})([0-9a-fA-F]{2})?$")
+
+# matplotlib.colors.BASE_COLORS
+BASE_COLORS = {
+    "b": (0, 0, 1), "g": (0, 0.5, 0), "r": (1, 0, 0), "c": (0, 0.75, 0.75),
+    "m": (0.75, 0, 0.75), "y": (0.75, 0.75, 0), "k": (0, 0, 0), "w": (1, 1, 1),
+}
+
+# matplotlib.colors.CSS4_COLORS
+CSS4_COLORS = {
+    "aliceblue": "#f0f8ff", "antiquewhite": "#faebd7", "aqua": "#00ffff", "aquamarine": "#7fffd4",
+    "azure": "#f0ffff", "beige": "#f5f5dc", "bisque": "#ffe4c4", "black": "#000000",
+    "blanchedalmond": "#ffebcd", "blue": "#0000ff", "blueviolet": "#8a2be2", "brown": "#a52a2a",
+    "burlywood": "#deb887", "cadetblue": "#5f9ea0", "chartreuse": "#7fff00",
+    "chocolate": "#d2691e", "coral": "#ff7f50", "cornflowerblue": "#6495ed", "cornsilk": "#fff8dc",
+    "crimson": "#dc143c", "cyan": "#00ffff", "darkblue": "#00008b", "darkcyan": "#008b8b",
+    "darkgoldenrod": "#b8860b", "darkgray": "#a9a9a9", "darkgreen": "#006400",
+    "darkgrey": "#a9a9a9", "darkkhaki": "#bdb76b", "darkmagenta": "#8b008b",
+    "darkolivegreen": "#556b2f", "darkorange": "#ff8c00", "darkorchid": "#9932cc",
+    "darkred": "#8b0000", "darksalmon": "#e9967a", "darkseagreen": "#8fbc8f",
+    "darkslateblue": "#483d8b", "darkslategray": "#2f4f4f", "darkslategrey": "#2f4f4f",
+    "darkturquoise": "#00ced1", "darkviolet": "#9400d3", "deeppink": "#ff1493",
+    "deepskyblue": "#00bfff", "dimgray": "#696969", "dimgrey": "#696969", "dodgerblue": "#1e90ff",
+    "firebrick": "#b22222", "floralwhite": "#fffaf0", "forestgreen": "#228b22",
+    "fuchsia": "#ff00ff", "gainsboro": "#dcdcdc", "ghostwhite": "#f8f8ff", "gold": "#ffd700",
+    "goldenrod": "#daa520", "gray": "#808080", "green": "#008000", "greenyellow": "#adff2f",
+    "grey": "#808080", "honeydew": "#f0fff0", "hotpink": "#ff69b4", "indianred": "#cd5c5c",
+    "indigo": "#4b0082", "ivory": "#fffff0", "khaki": "#f0e68c", "lavender": "#e6e6fa",
+    "lavenderblush": "#fff0f5", "lawngreen": "#7cfc00", "lemonchiffon": "#fffacd",
+    "lightblue": "#add8e6", "lightcoral": "#f08080", "lightcyan": "#e0ffff",
+    "lightgoldenrodyellow": "#fafad2", "lightgray": "#d3d3d3", "lightgreen": "#90ee90",
+    "lightgrey": "#d3d3d3", "lightpink": "#ffb6c1", "lightsalmon": "#ffa07a",
+    "lightseagreen": "#20b2aa", "lightskyblue": "#87cefa", "lightslategray": "#778899",
+    "lightslategrey": "#778899", "lightsteelblue": "#b0c4de", "lightyellow": "#ffffe0",
+    "lime": "#00ff00", "limegreen": "#32cd32", "linen": "#faf0e6", "magenta": "#ff00ff",
+    "maroon": "#800000", "mediumaquamarine": "#66cdaa", "mediumblue": "#0000cd",
+    "mediumorchid": "#ba55d3", "mediumpurple": "#9370db", "mediumseagreen": "#3cb371",
+    "mediumslateblue": "#7b68ee", "mediumspringgreen": "#00fa9a", "mediumturquoise": "#48d1cc",
+    "mediumvioletred": "#c71585", "midnightblue": "#191970", "mintcream": "#f5fffa",
+    "mistyrose": "#ffe4e1", "moccasin": "#ffe4b5", "navajowhite": "#ffdead", "navy": "#000080",
+    "oldlace": "#fdf5e6", "olive": "#808000", "olivedrab": "#6b8e23", "orange": "#ffa500",
+    "orangered": "#ff4500", "orchid": "#da70d6", "palegoldenrod": "#eee8aa",
+    "palegreen": "#98fb98", "paleturquoise": "#afeeee", "palevioletred": "#db7093",
+    "papayawhip": "#ffefd5", "peachpuff": "#ffdab9", "peru": "#cd853f", "pink": "#ffc0cb",
+    "plum": "#dda0dd", "powderblue": "#b0e0e6", "purple": "#800080", "rebeccapurple": "#663399",
+    "red": "#ff0000", "rosybrown": "#bc8f8f", "royalblue": "#4169e1", "saddlebrown": "#8b4513",
+    "salmon": "#fa8072", "sandybrown": "#f4a460", "seagreen": "#2e8b57", "seashell": "#fff5ee",
+    "sienna": "#a0522d", "silver": "#c0c0c0", "skyblue": "#87ceeb", "slateblue": "#6a5acd",
+    "slategray": "#708090", "slategrey": "#708090", "snow": "#fffafa", "springgreen": "#00ff7f",
+    "steelblue": "#4682b4", "tan": "#d2b48c", "teal": "#008080", "thistle": "#d8bfd8",
+    "tomato": "#ff6347", "turquoise": "#40e0d0", "violet": "#ee82ee", "wheat": "#f5deb3",
+    "white": "#ffffff", "whitesmoke": "#f5f5f5", "yellow": "#ffff00", "yellowgreen": "#9acd32",
+}
+
+
+def rgb_to_hex(rgb):
+    """
+    Converts RGB(A) values between 0 and 1 to a "#rrggbb" string, alpha is dropped
+
+    :param rgb: Sequence of 3 or 4 floats
+    """
+    # converted to Python floats first as matplotlib does, numpy float32 values round differently
+    return "#" + "".join("%02x" % round(float(value) * 255) for value in rgb[:3])
+
+
+def _parse_builtin(color):
+    """Returns the hex string of color or None if it is not one of the built-in formats"""
+    if isinstance(color, str):
+        match = HEX_PATTERN.match(color)
+        if match:
+            return "#" + match.group(1).lower()
+        if len(color) == 1:
+            rgb = BASE_COLORS.get(color)
+            return rgb_to_hex(rgb) if rgb is not None else None
+        return CSS4_COLORS.get(color.lower())
+    if len(color) in (3, 4) and all(
+        isinstance(value, numbers.Real) and not isinstance(value, bool) and 0 <= value <= 1
+        for value in color
+    ):
+        return rgb_to_hex(color)
+    return None
+
+
+@functools.lru_cache(maxsize=1024)
+def _hashable_to_hex(color):
+    hex_color = _parse_builtin(color)
+    if hex_color is not None:
+        return hex_color
+    import matplotlib.colors
+
+    if not matplotlib.colors.is_color_like(color):
+        raise ValueError(
+            "Only accept color formats specified in https://matplotlib.org/3.2.1/api/colors_api.html"
+        )
+    return matplotlib.colors.to_hex(color)
+
+
+def to_hex(color):
+    """
+    Validates color and returns it as "#rrggbb" string. Results are
+    memoized, as tracks typically reuse a few colors for many annotations.
+
+    :param color:   Any color format accepted by matplotlib
+    :raises ValueError: if color is not a valid color
+    """
+    try:
+        if not isinstance(color, str):
+            color = tuple(color)
+        return _hashable_to_hex(color)
+    except TypeError:
+        # not iterable, or with unhashable values such as nested lists
+        raise ValueError(
+            "Only accept color formats specified in https://matplotlib.org/3.2.1/api/colors_api.html"
+        )
@@ -0,0 +1,287 @@
+"""
+Shared access to the remote resources used by the annotation scripts
+(PDBe and UniProt REST APIs, SIFTS FTP, RCSB structure files).
+
+All requests go through one pooled keep-alive session and an on-disk cache.
+Response bodies are stored content-addressed (by SHA-256 of the body) so that
+identical responses from different URLs are kept once. Cached responses are
+served without contacting the server for a per-endpoint time-to-live and are
+revalidated with ETag / Last-Modified afterwards. In offline mode only cached
+responses are served. Structure files are downloaded into a mirror directory
+instead so that they can be handed to parsers by path.
+
+usage example:
+
+from utils import fetch
+
+# defaults: cache in ~/.cache/sm_annotations, online
+data = fetch.get_json("https://www.ebi.ac.uk/pdbe/api/mappings/best_structures/P0DTC2")
+
+# serve everything from the cache, e.g. in a sandbox
+fetch.set_fetcher(fetch.Fetcher(offline=True))
+
+The cache directory and offline mode of the default fetcher can also be set with
+the SM_ANNOTATIONS_CACHE and SM_ANNOTATIONS_OFFLINE environment variables.
+"""
+import ftplib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+from pathlib import Path
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+
+DEFAULT_CACHE_DIR = Path.home() / ".cache" / "sm_annotations"
+
+# Seconds a cached response is used without revalidation, by URL prefix.
+# The longest matching prefix wins, other URLs are always revalidated.
+DEFAULT_TTLS = {
+    "https://www.ebi.ac.uk/pdbe/api/": 24 * 3600,
+    "https://www.ebi.ac.uk/uniprot/api/": 24 * 3600,
+    "https://www.uniprot.org/uniprot/": 7 * 24 * 3600,
+    "ftp://ftp.ebi.ac.uk/pub/databases/msd/sifts/": 7 * 24 * 3600,
+}
+
+STRUCTURE_URL = "https://files.rcsb.org/download/{pdb_id}.{fmt}.gz"
+
+
+class OfflineError(RuntimeError):
+    """Raised when a response is needed in offline mode but is not cached"""
+
+
+class FTPAdapter(BaseAdapter):
+    """
+    Transport adapter for anonymous FTP downloads so that ftp:// URLs can go through a requests session
+    """
+
+    def send(self, request, timeout=None, **kwargs):
+        url = urlparse(request.url)
+        if isinstance(timeout, tuple):
+            timeout = timeout[-1]
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        content = list()
+        try:
+            ftp = ftplib.FTP(timeout=timeout)
+            try:
+                ftp.connect(url.hostname, url.port or ftplib.FTP_PORT)
+                ftp.login()
+                try:
+                    ftp.retrbinary(f"RETR {url.path}", content.append)
+                    response.status_code = 200
+                except ftplib.error_perm as e:
+                    response.status_code = 404
+                    response.reason = str(e)
+            finally:
+                ftp.close()
+        except (OSError, EOFError, ftplib.Error) as e:
+            raise requests.ConnectionError(e, request=request)
+        response._content = b"".join(content)
+        response._content_consumed = True
+        return response
+
+    def close(self):
+        pass
+
+
+class Fetcher:
+    """
+    Pooled HTTP session with a revalidating, content-addressed response cache
+
+    :param cache_dir:   Directory for cached responses, None disables caching
+    :param ttls:        Dict of URL prefix to time-to-live in seconds,
+                        defaults to DEFAULT_TTLS
+    :param default_ttl: Time-to-live for URLs not matching any prefix
+    :param offline:     Only serve responses from the cache
+    :param pool_size:   Number of keep-alive connections kept per host
+    :param timeout:     Timeout of each request in seconds
+    :param mirror_dir:  Directory for downloaded files (see get_file), defaults
+                        to a "files" folder in cache_dir or a temporary directory
+                        that is removed by close (or when the fetcher is
+                        garbage collected)
+    """
+
+    def __init__(self, cache_dir: typing.Union[str, Path, None] = DEFAULT_CACHE_DIR, ttls: dict = None,
+                 default_ttl: float = 0, offline: bool = False, pool_size: int = 10, timeout: float = 60,
+                 mirror_dir: typing.Union[str, Path, None] = None):
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
+        self.ttls = dict(DEFAULT_TTLS if ttls is None else ttls)
+        self.default_ttl = default_ttl
+        self.offline = offline
+        self.timeout = timeout
+        self._temporary_mirror = None
+        if mirror_dir is not None:
+            self.mirror_dir = Path(mirror_dir)
+        elif self.cache_dir is not None:
+            self.mirror_dir = self.cache_dir / "files"
+        else:
+            self._temporary_mirror = tempfile.TemporaryDirectory(prefix="sm_annotations_")
+            self.mirror_dir = Path(self._temporary_mirror.name)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.mount("ftp://", FTPAdapter())
+
+    def close(self) -> None:
+        """
+        Closes the session and removes the temporary mirror directory, if one was created
+        """
+        self.session.close()
+        if self._temporary_mirror is not None:
+            self._temporary_mirror.cleanup()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ttl_for(self, url: str) -> float:
+        prefixes = [p for p in self.ttls if url.startswith(p)]
+        if not prefixes:
+            return self.default_ttl
+        return self.ttls[max(prefixes, key=len)]
+
+    def _entry_path(self, url: str) -> Path:
+        return self.cache_dir / "entries" / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _blob_path(self, digest: str) -> Path:
+        return self.cache_dir / "blobs" / digest[:2] / digest
+
+    def _load_entry(self, url: str) -> typing.Union[dict, None]:
+        if self.cache_dir is None:
+            return None
+        try:
+            with open(self._entry_path(url)) as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not self._blob_path(entry["digest"]).exists():
+            return None
+        return entry
+
+    def _store(self, url: str, content: bytes, headers: typing.Mapping) -> None:
+        if self.cache_dir is None:
+            return
+        digest = hashlib.sha256(content).hexdigest()
+        blob_path = self._blob_path(digest)
+        if not blob_path.exists():
+            _atomic_write(blob_path, content)
+        self._store_entry(url, {"url": url, "digest": digest,
+                                "etag": headers.get("ETag"), "last_modified": headers.get("Last-Modified"),
+                                "fetched": time.time()})
+
+    def _store_entry(self, url: str, entry: dict) -> None:
+        _atomic_write(self._entry_path(url), json.dumps(entry).encode())
+
+    def get(self, url: str) -> bytes:
+        """
+        Returns the body of a GET request to url, from the cache if possible
+
+        :param url: URL to fetch
+        """
+        entry = self._load_entry(url)
+        if entry is not None and (self.offline or time.time() - entry["fetched"] < self.ttl_for(url)):
+            return self._blob_path(entry["digest"]).read_bytes()
+        if self.offline:
+            raise OfflineError(f"{url} is not cached and fetcher is offline")
+
+        headers = dict()
+        if entry is not None:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        response = self.session.get(url, headers=headers, timeout=self.timeout)
+        if response.status_code == 304 and entry is not None:
+            entry["fetched"] = time.time()
+            self._store_entry(url, entry)
+            return self._blob_path(entry["digest"]).read_bytes()
+        response.raise_for_status()
+        self._store(url, response.content, response.headers)
+        return response.content
+
+    def get_text(self, url: str, encoding: str = "utf-8") -> str:
+        return self.get(url).decode(encoding)
+
+    def get_json(self, url: str):
+        return json.loads(self.get_text(url))
+
+    def get_file(self, url: str, filename: str) -> Path:
+        """
+        Downloads url once into the mirror directory and returns the local path.
+        Mirrored files are not revalidated, delete them to force a new download.
+
+        :param url:      URL to fetch
+        :param filename: Name of the file in the mirror directory
+        """
+        path = self.mirror_dir / filename
+        if path.exists():
+            return path
+        if self.offline:
+            raise OfflineError(f"{url} is not mirrored and fetcher is offline")
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        _atomic_write(path, response.content)
+        return path
+
+
+def _atomic_write(path: Path, content: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+_fetcher = None
+
+
+def get_fetcher() -> Fetcher:
+    """
+    Returns the shared Fetcher, creating it from the environment on first use
+    """
+    global _fetcher
+    if _fetcher is None:
+        _fetcher = Fetcher(cache_dir=os.environ.get("SM_ANNOTATIONS_CACHE", DEFAULT_CACHE_DIR),
+                           offline=os.environ.get("SM_ANNOTATIONS_OFFLINE", "") not in ("", "0"))
+    return _fetcher
+
+
+def set_fetcher(fetcher: Fetcher) -> None:
+    """
+    Replaces the shared Fetcher used by get, get_text and get_json
+    """
+    global _fetcher
+    _fetcher = fetcher
+
+
+def get(url: str) -> bytes:
+    return get_fetcher().get(url)
+
+
+def get_text(url: str, encoding: str = "utf-8") -> str:
+    return get_fetcher().get_text(url, encoding)
+
+
+def get_json(url: str):
+    return get_fetcher().get_json(url)
+
+
+def get_structure_file(pdb_id: str, fmt: str = "cif") -> Path:
+    """
+    Local path of a gzipped structure file from RCSB, downloaded into the mirror directory if needed
+
+    :param pdb_id:  PDB ID
+    :param fmt:     "cif" or "pdb"
+    """
+    pdb_id = pdb_id.lower()
+    return get_fetcher().get_file(STRUCTURE_URL.format(pdb_id=pdb_id, fmt=fmt), f"{pdb_id}.{fmt}.gz")
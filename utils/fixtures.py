@@ -0,0 +1,162 @@
+"""
+Record and replay of all remote responses used by a pipeline run.
+
+While recording, every response fetched through utils.fetch (PDBe, UniProt,
+SIFTS FTP, RCSB structure files) is written to a fixture bundle. Replaying
+serves those responses from a stand-in transport adapter mounted for http,
+https and ftp, so a recorded run can be repeated offline and without network
+jitter, e.g. for benchmarking.
+
+usage example:
+
+from utils import fixtures
+
+with fixtures.record("fixtures/6m71"):
+    example_usage.example_single("6m71", "P0DTD1", "out")
+
+with fixtures.replay("fixtures/6m71"):
+    example_usage.example_single("6m71", "P0DTD1", "out")
+
+A bundle is a directory with an index.json, mapping each URL to its status
+code, headers and the SHA-256 of its body, and a bodies folder with one file
+per distinct body.
+"""
+import contextlib
+import hashlib
+import json
+import tempfile
+import typing
+from pathlib import Path
+
+import requests
+from requests.adapters import BaseAdapter
+
+from utils import fetch
+
+INDEX_FILE = "index.json"
+BODIES_DIR = "bodies"
+# Headers worth replaying, everything else is dropped
+RECORDED_HEADERS = ("Content-Type", "ETag", "Last-Modified", "Location")
+
+
+class FixtureBundle:
+    """
+    Directory of recorded responses
+
+    :param path: Directory of the bundle, created on save if needed
+    """
+
+    def __init__(self, path: typing.Union[str, Path]):
+        self.path = Path(path)
+        self.index = dict()
+        if (self.path / INDEX_FILE).exists():
+            with open(self.path / INDEX_FILE) as f:
+                self.index = json.load(f)
+
+    def __contains__(self, url):
+        return url in self.index
+
+    def __len__(self):
+        return len(self.index)
+
+    def add(self, url: str, status: int, headers: typing.Mapping, content: bytes):
+        digest = hashlib.sha256(content).hexdigest()
+        body_path = self.path / BODIES_DIR / digest
+        if not body_path.exists():
+            body_path.parent.mkdir(parents=True, exist_ok=True)
+            body_path.write_bytes(content)
+        self.index[url] = {"status": status, "digest": digest,
+                           "headers": {k: headers[k] for k in RECORDED_HEADERS if k in headers}}
+
+    def add_response(self, response: requests.Response, *args, **kwargs):
+        """
+        requests response hook recording every response passing through a session
+        """
+        self.add(response.url, response.status_code, response.headers, response.content)
+        return response
+
+    def response_for(self, request: requests.PreparedRequest) -> requests.Response:
+        try:
+            entry = self.index[request.url]
+        except KeyError:
+            raise requests.ConnectionError(f"{request.url} was not recorded in fixture bundle {self.path}",
+                                           request=request)
+        response = requests.Response()
+        response.url = request.url
+        response.request = request
+        response.status_code = entry["status"]
+        response.headers.update(entry["headers"])
+        response._content = (self.path / BODIES_DIR / entry["digest"]).read_bytes()
+        response._content_consumed = True
+        return response
+
+    def save(self):
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.path / INDEX_FILE, "w") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+
+
+class ReplayAdapter(BaseAdapter):
+    """
+    Transport adapter standing in for the remote HTTP(S) and FTP servers, answering from a FixtureBundle
+    """
+
+    def __init__(self, bundle: FixtureBundle):
+        super().__init__()
+        self.bundle = bundle
+
+    def send(self, request, **kwargs):
+        return self.bundle.response_for(request)
+
+    def close(self):
+        pass
+
+
+@contextlib.contextmanager
+def _use_fetcher(fetcher: fetch.Fetcher):
+    previous = fetch.get_fetcher()
+    fetch.set_fetcher(fetcher)
+    try:
+        yield fetcher
+    finally:
+        fetch.set_fetcher(previous)
+
+
+@contextlib.contextmanager
+def record(bundle_path: typing.Union[str, Path]):
+    """
+    Records all responses fetched inside the with-block into a fixture bundle.
+    The response cache is bypassed so that every remote access is captured;
+    responses are added to an existing bundle.
+
+    :param bundle_path: Directory of the bundle
+    """
+    bundle = FixtureBundle(bundle_path)
+    with tempfile.TemporaryDirectory() as mirror_dir:
+        fetcher = fetch.Fetcher(cache_dir=None, mirror_dir=mirror_dir)
+        fetcher.session.hooks["response"].append(bundle.add_response)
+        try:
+            with _use_fetcher(fetcher):
+                yield bundle
+        finally:
+            bundle.save()
+
+
+@contextlib.contextmanager
+def replay(bundle_path: typing.Union[str, Path]):
+    """
+    Serves all responses fetched inside the with-block from a fixture bundle.
+    Requests that were not recorded raise a requests.ConnectionError.
+
+    :param bundle_path: Directory of the bundle
+    """
+    bundle = FixtureBundle(bundle_path)
+    if not len(bundle):
+        raise ValueError(f"No recorded responses in {bundle_path}")
+    adapter = ReplayAdapter(bundle)
+    with tempfile.TemporaryDirectory() as mirror_dir:
+        fetcher = fetch.Fetcher(cache_dir=None, mirror_dir=mirror_dir)
+        for prefix in ("http://", "https://", "ftp://"):
+            fetcher.session.mount(prefix, adapter)
+        with _use_fetcher(fetcher):
+            yield bundle
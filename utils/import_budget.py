@@ -0,0 +1,94 @@
+"""
+Checks that importing the annotation modules and entry points stays fast.
+
+Each module is imported in a fresh interpreter with `python -X importtime`,
+the cumulative import time of the module is compared to its budget and the
+modules it must not pull in at import time are checked. The exit code is
+non-zero if any budget is exceeded, so it can be run in CI:
+
+python -m utils.import_budget
+python -m utils.import_budget utils.sm_annotations --budget-ms 50 --repeat 5
+
+Run from the root directory of the repository.
+"""
+import argparse
+import subprocess
+import sys
+
+# module: (budget in milliseconds, modules that must not be imported)
+DEFAULT_BUDGETS = {
+    "utils.colors": (20, ("matplotlib",)),
+    "utils.uniprot": (20, ("requests",)),
+    "utils.sm_annotations": (50, ("matplotlib", "requests", "numpy")),
+    "utils.parse_pdbe": (250, ("requests",)),
+    "str_derived_annotations.annotate": (250, ("prody", "matplotlib", "requests")),
+    "str_derived_annotations.example_usage": (250, ("prody", "matplotlib", "requests")),
+}
+
+
+def measure_import(module: str, python: str = sys.executable) -> tuple:
+    """
+    Imports module in a fresh interpreter
+
+    Returns
+    -------
+    (cumulative import time of module in milliseconds, set of names of all imported modules)
+    """
+    result = subprocess.run(
+        [python, "-X", "importtime", "-c", f"import sys, {module}; print('\\n'.join(sys.modules))"],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True, check=True)
+    cumulative_us = None
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) == 3 and fields[2].strip() == module:
+            cumulative_us = int(fields[1])
+    if cumulative_us is None:
+        raise RuntimeError(f"No import time reported for {module}")
+    return cumulative_us / 1000, set(result.stdout.split())
+
+
+def check_budget(module: str, budget_ms: float, forbidden: tuple = (), repeat: int = 3) -> list:
+    """
+    Returns a list of violations (empty if module is within budget).
+    The fastest of `repeat` imports is compared to the budget to reduce noise.
+    """
+    timings = list()
+    for _ in range(repeat):
+        milliseconds, imported = measure_import(module)
+        timings.append(milliseconds)
+    violations = list()
+    if min(timings) > budget_ms:
+        violations.append(f"{module}: import takes {min(timings):.1f} ms, budget is {budget_ms:.1f} ms")
+    for name in forbidden:
+        if name in imported:
+            violations.append(f"{module}: imports {name}")
+    return violations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("modules", nargs="*", help="modules to check, defaults to all modules with a budget")
+    parser.add_argument("--budget-ms", type=float, help="budget for all given modules")
+    parser.add_argument("--repeat", type=int, default=3, help="number of imports per module")
+    args = parser.parse_args()
+
+    violations = list()
+    for module in args.modules or DEFAULT_BUDGETS:
+        budget_ms, forbidden = DEFAULT_BUDGETS.get(module, (None, ()))
+        if args.budget_ms is not None:
+            budget_ms = args.budget_ms
+        if budget_ms is None:
+            parser.error(f"No budget for {module}, give one with --budget-ms")
+        module_violations = check_budget(module, budget_ms, forbidden, repeat=args.repeat)
+        print(f"{module}\t{'FAIL' if module_violations else 'ok'}")
+        violations.extend(module_violations)
+    for violation in violations:
+        print(violation, file=sys.stderr)
+    sys.exit(1 if violations else 0)
+
+
+if __name__ == "__main__":
+    main()
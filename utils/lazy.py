@@ -0,0 +1,50 @@
+"""
+Deferred imports for heavy dependencies (matplotlib, requests, prody, ...).
+
+Short-lived annotation workers and command line calls often never touch the
+code paths needing them, so the import cost is only paid on first use:
+
+from utils import lazy
+
+requests = lazy.lazy_import("requests")
+fetch = lazy.lazy_import(".fetch", __package__)
+
+def get(url):
+    return requests.get(url)  # requests is imported here
+"""
+import importlib
+import types
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that is imported on first attribute access
+
+    :param name:    Module name as for importlib.import_module
+    :param package: Anchor package for relative names
+    """
+
+    def __init__(self, name: str, package: str = None):
+        super().__init__(name)
+        self.__dict__["_lazy_target"] = (name, package)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self) -> types.ModuleType:
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            module = importlib.import_module(*self.__dict__["_lazy_target"])
+            self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __dir__(self):
+        return dir(self._load())
+
+
+def lazy_import(name: str, package: str = None) -> LazyModule:
+    """
+    Returns a module object which imports the module `name` on first attribute access
+    """
+    return LazyModule(name, package)
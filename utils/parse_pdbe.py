@@ -1,4 +1,3 @@
-import ftplib
 import gzip
 import typing
 import xml.etree.ElementTree as ET
@@ -6,10 +5,16 @@ from collections import defaultdict
 from pathlib import Path
 
 import intervaltree as it
-import requests as rq
 
+from utils import lazy
+from utils.alignment_mapping import get_pdb_to_uniprot_mapping_by_alignment
+from utils.residue_map import ResidueMap, parse_pdb_resnum
 from utils.uniprot import seq_from_ac
 
+# requests is only needed once something is fetched
+rq = lazy.lazy_import("requests")
+fetch = lazy.lazy_import("utils.fetch")
+
 MAPPING_FILE = "uniprot_segments_observed.tsv"
 
 
@@ -68,20 +73,12 @@ def get_sift_xml(pdb_id: str) -> ET.Element:
     -------
     ElementTree parsed XML Element
     """
-    ftp_address = "ftp.ebi.ac.uk"
-    ftp = ftplib.FTP(ftp_address)
-    ftp.login()
-    filepath = f"/pub/databases/msd/sifts/split_xml/{pdb_id[1:3]}"
-    filename = f"{pdb_id}.xml.gz"
-    ftp.cwd(filepath)
-    content = list()
-    ftp.retrbinary(f"RETR {filename}", content.append)
-    ftp.close()
-    content = b''.join(content)
+    url = f"ftp://ftp.ebi.ac.uk/pub/databases/msd/sifts/split_xml/{pdb_id[1:3]}/{pdb_id}.xml.gz"
+    content = fetch.get(url)
     return ET.fromstring(gzip.decompress(content).decode("utf-8"))
 
 
-def get_pdb_to_uniprot_mapping(pdb_id: str):
+def get_pdb_to_uniprot_mapping(pdb_id: str, uniprot_sequence: str = None):
     """
     Maps from PDB residue number to UniProt residue number for each chain
     Missing residues are ignored
@@ -89,12 +86,20 @@ def get_pdb_to_uniprot_mapping(pdb_id: str):
     Parameters
     ----------
     pdb_id
+    uniprot_sequence
+        if given, chains are mapped by aligning their observed sequence to this UniProt sequence
+        when there is no SIFTS mapping for the entry (yet)
 
     Returns
     -------
-    dict of {chain: dict of {uniprot_resnum: pdb_resnum}}
+    dict of {chain: ResidueMap of {pdb_resnum: uniprot_resnum}}
     """
-    sift_xml = get_sift_xml(pdb_id)
+    try:
+        sift_xml = get_sift_xml(pdb_id)
+    except (rq.RequestException, fetch.OfflineError):
+        if uniprot_sequence is None:
+            raise
+        return get_pdb_to_uniprot_mapping_by_alignment(pdb_id, uniprot_sequence)
     entities = [x for x in sift_xml.iter() if "entity" in x.tag]
     chains = defaultdict(dict)
     for ent in entities:
@@ -105,10 +110,12 @@ def get_pdb_to_uniprot_mapping(pdb_id: str):
                 pdb_chain_id = pdb_entry.attrib["dbChainId"]
                 uniprot_resnum = [x for x in residue.iter() if "dbSource" in x.attrib and x.attrib["dbSource"] == "UniProt"][0].attrib["dbResNum"]
                 if pdb_resnum != "null":
-                    chains[pdb_chain_id][int(pdb_resnum)] = int(uniprot_resnum)
+                    chains[pdb_chain_id][parse_pdb_resnum(pdb_resnum)] = int(uniprot_resnum)
             except IndexError:
                 continue
-    return chains
+    if not chains and uniprot_sequence is not None:
+        return get_pdb_to_uniprot_mapping_by_alignment(pdb_id, uniprot_sequence)
+    return {chain: ResidueMap.from_dict(mapping) for chain, mapping in chains.items()}
 
 
 class UniProtBasedMapping:
@@ -119,7 +126,8 @@ class UniProtBasedMapping:
         self.uniprot_sequence = seq_from_ac(uniprot_id)
         self.protein_annotation_intervals = dict()
         self._get_intervals_from_uniprot()
-        self.data = {x["pdb_id"]: x for x in rq.get(self.PDBe_api_request_url).json()[uniprot_id]}
+        self.structures = fetch.get_json(self.PDBe_api_request_url)[uniprot_id]
+        self.data = {x["pdb_id"]: x for x in self.structures}
         self.tree = it.IntervalTree()
         self._build_tree()
 
@@ -131,7 +139,7 @@ class UniProtBasedMapping:
             self.tree[data["unp_start"]: data["unp_end"]] = pdb_id
 
     def _get_intervals_from_uniprot(self):
-        gff_lines = [x for x in rq.get(self.uniprot_api_request_url).text.split("\n") if not x.startswith("#") and len(x)]
+        gff_lines = [x for x in fetch.get_text(self.uniprot_api_request_url).split("\n") if not x.startswith("#") and len(x)]
         for line in gff_lines:
             line = line.split("\t")
             _range = (int(line[3]), int(line[4]))
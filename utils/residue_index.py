@@ -0,0 +1,264 @@
+"""
+Reverse residue index from UniProt positions to the structure residues covering them.
+
+All (pdb_id, chain, pdb_resnum) triples covering a UniProt position are stored
+as flat arrays sorted by position, with an offsets array marking where each
+position starts. A lookup is then a single array slice. Indices are saved as
+plain .npy files so that they can be memory-mapped on load.
+"""
+import json
+import typing
+from pathlib import Path
+
+import numpy as np
+
+from utils import parse_pdbe
+from utils.residue_map import ResidueMap, as_residue_map
+
+# UniProt entries of the SARS-CoV-2 proteome
+# https://covid-19.uniprot.org
+SARS_COV_2_UNIPROT_ACS = ("P0DTC1", "P0DTD1", "P0DTC2", "P0DTC3", "P0DTC4", "P0DTC5", "P0DTC6",
+                          "P0DTC7", "P0DTD8", "P0DTC8", "P0DTC9", "P0DTD2", "P0DTD3", "A0A663DJA2")
+
+META_FILE = "meta.json"
+ARRAY_NAMES = ("position_base", "offsets", "structure_indices", "pdb_resnums", "pdb_icodes")
+
+
+class ReverseResidueIndex:
+    """
+    Maps each UniProt position to every structure residue covering it
+
+    Positions of all UniProt entries are laid out one after the other: the
+    residues covering position `pos` of entry `ac` are found at
+    `offsets[position_base[ac] + pos]:offsets[position_base[ac] + pos + 1]`
+    in `structure_indices` (rows of `structures`), `pdb_resnums` and `pdb_icodes`.
+    """
+
+    def __init__(self, uniprot_acs: typing.List[str], sequence_lengths: typing.List[int],
+                 structures: typing.List[typing.Tuple[str, str, str]],
+                 position_base: np.ndarray, offsets: np.ndarray,
+                 structure_indices: np.ndarray, pdb_resnums: np.ndarray, pdb_icodes: np.ndarray):
+        self.uniprot_acs = list(uniprot_acs)
+        self.sequence_lengths = list(sequence_lengths)
+        self.structures = [tuple(s) for s in structures]
+        self.position_base = position_base
+        self.offsets = offsets
+        self.structure_indices = structure_indices
+        self.pdb_resnums = pdb_resnums
+        self.pdb_icodes = pdb_icodes
+        self._ac_to_index = {ac: i for i, ac in enumerate(self.uniprot_acs)}
+
+    def __len__(self):
+        return len(self.pdb_resnums)
+
+    def _position_slice(self, uniprot_ac: str, position: int) -> slice:
+        try:
+            ac_index = self._ac_to_index[uniprot_ac]
+        except KeyError:
+            raise KeyError(f"UniProt AC {uniprot_ac} not in index. "
+                           f"Available ones are {', '.join(self.uniprot_acs)}")
+        if not 1 <= position <= self.sequence_lengths[ac_index]:
+            raise IndexError(f"Position {position} outside of {uniprot_ac} "
+                             f"(length {self.sequence_lengths[ac_index]})")
+        i = self.position_base[ac_index] + position
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def lookup_arrays(self, uniprot_ac: str, position: int) -> typing.Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Structure residues covering a UniProt position, as array views
+
+        Parameters
+        ----------
+        uniprot_ac
+        position
+            1-based UniProt residue number
+
+        Returns
+        -------
+        (structure indices into `structures`, PDB residue numbers, insertion codes)
+        """
+        s = self._position_slice(uniprot_ac, position)
+        return self.structure_indices[s], self.pdb_resnums[s], self.pdb_icodes[s]
+
+    def lookup(self, uniprot_ac: str, position: int) -> typing.List[tuple]:
+        """
+        Structure residues covering a UniProt position
+
+        Parameters
+        ----------
+        uniprot_ac
+        position
+            1-based UniProt residue number
+
+        Returns
+        -------
+        list of (pdb_id, chain, pdb_resnum), pdb_resnum being a string such as "100A" for insertion codes
+        """
+        structure_indices, pdb_resnums, pdb_icodes = self.lookup_arrays(uniprot_ac, position)
+        return [(*self.structures[s][1:], int(r) if not i else f"{r}{i}")
+                for s, r, i in zip(structure_indices, pdb_resnums, pdb_icodes)]
+
+    def chain_mapping(self, pdb_id: str, chain: str, uniprot_ac: str) -> ResidueMap:
+        """
+        Recovers the PDB to UniProt residue mapping of one chain from the index
+
+        Returns
+        -------
+        ResidueMap of {pdb_resnum: uniprot_resnum}
+        """
+        try:
+            structure_index = self.structures.index((uniprot_ac, pdb_id, chain))
+        except ValueError:
+            raise KeyError(f"Chain {chain} of PDB ID {pdb_id} not indexed for {uniprot_ac}")
+        ac_index = self._ac_to_index[uniprot_ac]
+        base = self.position_base[ac_index]
+        start, end = self.offsets[base], self.offsets[base + self.sequence_lengths[ac_index] + 1]
+        hits = np.nonzero(self.structure_indices[start:end] == structure_index)[0] + start
+        positions = np.searchsorted(self.offsets, hits, side="right") - 1 - base
+        return ResidueMap(self.pdb_resnums[hits], positions, self.pdb_icodes[hits])
+
+    def save(self, directory: typing.Union[str, Path]):
+        """
+        Writes the index as one .npy file per array plus a JSON file with the metadata
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        for name in ARRAY_NAMES:
+            np.save(directory / f"{name}.npy", np.ascontiguousarray(getattr(self, name)))
+        with open(directory / META_FILE, "w") as f:
+            json.dump({"uniprot_acs": self.uniprot_acs,
+                       "sequence_lengths": self.sequence_lengths,
+                       "structures": self.structures}, f)
+
+    @classmethod
+    def load(cls, directory: typing.Union[str, Path], mmap: bool = True):
+        """
+        Loads an index written by `save`, memory-mapping the arrays unless `mmap` is False
+        """
+        directory = Path(directory)
+        with open(directory / META_FILE) as f:
+            meta = json.load(f)
+        arrays = {name: np.load(directory / f"{name}.npy", mmap_mode="r" if mmap else None)
+                  for name in ARRAY_NAMES}
+        return cls(meta["uniprot_acs"], meta["sequence_lengths"], meta["structures"], **arrays)
+
+
+class ReverseResidueIndexBuilder:
+    """
+    Collects chain mappings and turns them into a ReverseResidueIndex
+
+    Starting from an existing index only the newly added chains need to be fetched,
+    so an index can be grown as new structures are released.
+    """
+
+    def __init__(self, index: ReverseResidueIndex = None):
+        self.uniprot_acs = list()
+        self.sequence_lengths = list()
+        self.structures = list()
+        self._structure_set = set()
+        self._positions = list()
+        self._structure_indices = list()
+        self._pdb_resnums = list()
+        self._pdb_icodes = list()
+        if index is not None:
+            self._add_index(index)
+
+    def _add_index(self, index: ReverseResidueIndex):
+        self.uniprot_acs = list(index.uniprot_acs)
+        self.sequence_lengths = list(index.sequence_lengths)
+        self.structures = list(index.structures)
+        self._structure_set = set(self.structures)
+        total = len(index.offsets) - 1
+        global_positions = np.repeat(np.arange(total), np.diff(index.offsets))
+        ac_indices = np.searchsorted(index.position_base, global_positions, side="right") - 1
+        self._positions.append((ac_indices, global_positions - np.asarray(index.position_base)[ac_indices]))
+        self._structure_indices.append(np.asarray(index.structure_indices))
+        self._pdb_resnums.append(np.asarray(index.pdb_resnums))
+        self._pdb_icodes.append(np.asarray(index.pdb_icodes))
+
+    def add_uniprot_entry(self, uniprot_ac: str, sequence_length: int):
+        if uniprot_ac in self.uniprot_acs:
+            ac_index = self.uniprot_acs.index(uniprot_ac)
+            if self.sequence_lengths[ac_index] != sequence_length:
+                raise ValueError(f"Sequence length of {uniprot_ac} changed from "
+                                 f"{self.sequence_lengths[ac_index]} to {sequence_length}")
+            return
+        self.uniprot_acs.append(uniprot_ac)
+        self.sequence_lengths.append(sequence_length)
+
+    def has_chain(self, uniprot_ac: str, pdb_id: str, chain: str) -> bool:
+        return (uniprot_ac, pdb_id, chain) in self._structure_set
+
+    def add_chain(self, uniprot_ac: str, pdb_id: str, chain: str,
+                  residue_mapper: typing.Union[ResidueMap, dict]):
+        """
+        Adds one chain given its {pdb_resnum: uniprot_resnum} mapping.
+        UniProt positions outside of the entry are ignored.
+        """
+        if uniprot_ac not in self.uniprot_acs:
+            raise KeyError(f"Add UniProt entry {uniprot_ac} before adding its chains")
+        if self.has_chain(uniprot_ac, pdb_id, chain):
+            return
+        ac_index = self.uniprot_acs.index(uniprot_ac)
+        residue_mapper = as_residue_map(residue_mapper)
+        positions = residue_mapper.uniprot_resnums
+        inside = (positions >= 1) & (positions <= self.sequence_lengths[ac_index])
+        self.structures.append((uniprot_ac, pdb_id, chain))
+        self._structure_set.add((uniprot_ac, pdb_id, chain))
+        self._positions.append((np.full(inside.sum(), ac_index), positions[inside]))
+        self._structure_indices.append(np.full(inside.sum(), len(self.structures) - 1, dtype=np.int32))
+        self._pdb_resnums.append(residue_mapper.pdb_resnums[inside])
+        self._pdb_icodes.append(residue_mapper.icodes[inside])
+
+    def build(self) -> ReverseResidueIndex:
+        position_base = np.zeros(len(self.uniprot_acs), dtype=np.int64)
+        position_base[1:] = np.cumsum(np.asarray(self.sequence_lengths[:-1], dtype=np.int64) + 1)
+        total = int(position_base[-1] + self.sequence_lengths[-1] + 1) if self.uniprot_acs else 0
+        if self._positions:
+            global_positions = np.concatenate([position_base[a] + p for a, p in self._positions])
+            structure_indices = np.concatenate(self._structure_indices).astype(np.int32)
+            pdb_resnums = np.concatenate(self._pdb_resnums).astype(np.int32)
+            pdb_icodes = np.concatenate(self._pdb_icodes).astype("U1")
+        else:
+            global_positions = np.zeros(0, dtype=np.int64)
+            structure_indices = pdb_resnums = np.zeros(0, dtype=np.int32)
+            pdb_icodes = np.zeros(0, dtype="U1")
+        order = np.argsort(global_positions, kind="stable")
+        offsets = np.zeros(total + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(global_positions, minlength=total))
+        return ReverseResidueIndex(self.uniprot_acs, self.sequence_lengths, self.structures,
+                                   position_base, offsets, structure_indices[order], pdb_resnums[order],
+                                   pdb_icodes[order])
+
+
+def build_reverse_index(uniprot_acs: typing.Iterable[str] = SARS_COV_2_UNIPROT_ACS,
+                        index: ReverseResidueIndex = None) -> ReverseResidueIndex:
+    """
+    Builds (or extends) a reverse residue index over all PDBe best structures of the given UniProt entries
+    SIFTS mappings are only fetched for chains not already present in `index`.
+
+    Parameters
+    ----------
+    uniprot_acs
+        UniProt accessions to cover, defaults to the SARS-CoV-2 proteome
+    index
+        existing index to extend
+
+    Returns
+    -------
+    ReverseResidueIndex
+    """
+    builder = ReverseResidueIndexBuilder(index)
+    sifts_mappings = dict()
+    for uniprot_ac in uniprot_acs:
+        mapping = parse_pdbe.UniProtBasedMapping(uniprot_ac)
+        builder.add_uniprot_entry(uniprot_ac, len(mapping.uniprot_sequence))
+        for entry in mapping.structures:
+            pdb_id, chain = entry["pdb_id"], entry["chain_id"]
+            if builder.has_chain(uniprot_ac, pdb_id, chain):
+                continue
+            if pdb_id not in sifts_mappings:
+                sifts_mappings[pdb_id] = parse_pdbe.get_pdb_to_uniprot_mapping(pdb_id)
+            if chain in sifts_mappings[pdb_id]:
+                builder.add_chain(uniprot_ac, pdb_id, chain, sifts_mappings[pdb_id][chain])
+    return builder.build()
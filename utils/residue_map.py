@@ -0,0 +1,186 @@
+"""
+Array-backed mapping between PDB residue numbers (with insertion codes) and UniProt residue numbers.
+"""
+import re
+import typing
+from collections.abc import Mapping
+
+import numpy as np
+
+PDB_RESNUM_PATTERN = re.compile(r"^\s*(-?\d+)\s*([A-Za-z]?)\s*$")
+
+
+def parse_pdb_resnum(key) -> typing.Tuple[int, str]:
+    """
+    Splits a PDB residue key into (residue number, insertion code)
+
+    Accepts integers, strings such as "100" or "100A" (as used in SIFTS)
+    and (resnum, icode) tuples.
+    """
+    if isinstance(key, (int, np.integer)):
+        return int(key), ""
+    if isinstance(key, tuple):
+        resnum, icode = key
+        return int(resnum), (icode or "").strip()
+    if isinstance(key, str):
+        match = PDB_RESNUM_PATTERN.match(key)
+        if match:
+            return int(match.group(1)), match.group(2)
+    raise KeyError(f"Can not interpret {key!r} as a PDB residue number")
+
+
+def _encode(resnums, icodes=None) -> np.ndarray:
+    """
+    Combines residue numbers and insertion codes into sortable integer keys
+    """
+    keys = np.asarray(resnums, dtype=np.int64) * 256
+    if icodes is not None:
+        # a U1 array holds one code point per element, 0 for the empty string
+        codes = np.ascontiguousarray(icodes, dtype="U1").view(np.uint32).astype(np.int64)
+        keys = keys + np.where(codes == ord(" "), 0, codes % 256).reshape(keys.shape)
+    return keys
+
+
+class ResidueMap(Mapping):
+    """
+    Mapping from PDB residue number to UniProt residue number backed by NumPy arrays
+
+    Behaves like the {pdb_resnum: uniprot_resnum} dictionaries it replaces: keys are
+    integers for residues without insertion code and strings like "100A" otherwise.
+    For bulk work use the vectorized `pdb_to_uniprot`, `uniprot_to_pdb` and `mask`.
+
+    usage example:
+
+    residue_map = ResidueMap([1, 2, 2], [10, 11, 12], icodes=["", "", "A"])
+    residue_map[2]                            # 11
+    residue_map["2A"]                         # 12
+    residue_map.pdb_to_uniprot([1, 5])        # array([10, -1])
+    """
+
+    def __init__(self, pdb_resnums, uniprot_resnums, icodes=None):
+        self.pdb_resnums = np.asarray(pdb_resnums, dtype=np.int64).ravel()
+        self.uniprot_resnums = np.asarray(uniprot_resnums, dtype=np.int64).ravel()
+        if icodes is None:
+            self.icodes = np.full(len(self.pdb_resnums), "", dtype="U1")
+        else:
+            self.icodes = np.char.strip(np.asarray(icodes, dtype="U1")).ravel()
+        if not len(self.pdb_resnums) == len(self.uniprot_resnums) == len(self.icodes):
+            raise ValueError("Expect residue numbers, UniProt residue numbers and insertion codes of equal length")
+        keys = _encode(self.pdb_resnums, self.icodes)
+        self._pdb_order = np.argsort(keys, kind="stable")
+        self._pdb_keys = keys[self._pdb_order]
+        if len(keys) and np.any(self._pdb_keys[1:] == self._pdb_keys[:-1]):
+            raise ValueError("Duplicate PDB residue numbers in residue mapping")
+        self._uniprot_order = np.argsort(self.uniprot_resnums, kind="stable")
+        self._uniprot_keys = self.uniprot_resnums[self._uniprot_order]
+
+    @classmethod
+    def from_dict(cls, mapping: dict):
+        """
+        Builds a ResidueMap from a {pdb_resnum: uniprot_resnum} dictionary
+        """
+        keys = [parse_pdb_resnum(k) for k in mapping.keys()]
+        return cls([k[0] for k in keys], list(mapping.values()), [k[1] for k in keys])
+
+    def _find(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Positions (in insertion order) of the encoded PDB keys, -1 where missing
+        """
+        if not len(self._pdb_keys):
+            return np.full(keys.shape, -1, dtype=np.int64)
+        pos = np.clip(np.searchsorted(self._pdb_keys, keys), 0, len(self._pdb_keys) - 1)
+        found = self._pdb_keys[pos] == keys
+        return np.where(found, self._pdb_order[pos], -1)
+
+    def mask(self, resnums, icodes=None) -> np.ndarray:
+        """
+        Boolean array marking which of the given PDB residues are mapped
+        """
+        return self._find(_encode(resnums, icodes)) >= 0
+
+    def pdb_to_uniprot(self, resnums, icodes=None, default: int = -1) -> np.ndarray:
+        """
+        Vectorized lookup of UniProt residue numbers for PDB residue numbers
+
+        Parameters
+        ----------
+        resnums
+            array of PDB residue numbers
+        icodes
+            optional array of insertion codes ("" or " " for none)
+        default
+            value used for unmapped residues
+
+        Returns
+        -------
+        array of UniProt residue numbers
+        """
+        positions = self._find(_encode(resnums, icodes))
+        if not len(self):
+            return np.full(positions.shape, default, dtype=np.int64)
+        return np.where(positions >= 0, self.uniprot_resnums[positions], default)
+
+    def uniprot_to_pdb(self, uniprot_resnums, default: int = -1,
+                       return_icodes: bool = False):
+        """
+        Vectorized lookup of PDB residue numbers for UniProt residue numbers
+
+        Parameters
+        ----------
+        uniprot_resnums
+            array of UniProt residue numbers
+        default
+            value used for UniProt residues not covered by the structure
+        return_icodes
+            also return the insertion codes of the PDB residues
+
+        Returns
+        -------
+        array of PDB residue numbers (and array of insertion codes if return_icodes)
+        """
+        uniprot_resnums = np.asarray(uniprot_resnums, dtype=np.int64)
+        if not len(self):
+            resnums = np.full(uniprot_resnums.shape, default, dtype=np.int64)
+            return (resnums, np.full(uniprot_resnums.shape, "", dtype="U1")) if return_icodes else resnums
+        pos = np.clip(np.searchsorted(self._uniprot_keys, uniprot_resnums), 0, len(self) - 1)
+        found = self._uniprot_keys[pos] == uniprot_resnums
+        indices = self._uniprot_order[pos]
+        resnums = np.where(found, self.pdb_resnums[indices], default)
+        if return_icodes:
+            return resnums, np.where(found, self.icodes[indices], "")
+        return resnums
+
+    def subset(self, mask) -> "ResidueMap":
+        """
+        New ResidueMap restricted to the entries selected by a boolean mask (or index array)
+        """
+        return ResidueMap(self.pdb_resnums[mask], self.uniprot_resnums[mask], self.icodes[mask])
+
+    def _key(self, i: int):
+        resnum = int(self.pdb_resnums[i])
+        return resnum if not self.icodes[i] else f"{resnum}{self.icodes[i]}"
+
+    def __getitem__(self, key) -> int:
+        resnum, icode = parse_pdb_resnum(key)
+        position = self._find(_encode([resnum], [icode]))[0]
+        if position < 0:
+            raise KeyError(key)
+        return int(self.uniprot_resnums[position])
+
+    def __iter__(self):
+        return (self._key(i) for i in range(len(self)))
+
+    def __len__(self):
+        return len(self.pdb_resnums)
+
+    def __repr__(self):
+        return f"ResidueMap({dict(self.items())})"
+
+
+def as_residue_map(residue_mapper: typing.Union[ResidueMap, dict]) -> ResidueMap:
+    """
+    Returns residue_mapper as ResidueMap, converting {pdb_resnum: uniprot_resnum} dicts
+    """
+    if isinstance(residue_mapper, ResidueMap):
+        return residue_mapper
+    return ResidueMap.from_dict(residue_mapper)
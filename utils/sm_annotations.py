@@ -1,10 +1,49 @@
-import base64
+import array
+import decimal
 import gzip
-import matplotlib as mpl
+import hashlib
+import io
+import itertools
+import numbers
 import re
-import requests
+import time
+from . import colors
+from . import lazy
 from . import uniprot
 
+# requests is only needed for uploads
+requests = lazy.lazy_import("requests")
+
+ANNOTATION_URL = "https://swissmodel.expasy.org/repository/annotation"
+# (connect, read) timeout in seconds of a submission
+UPLOAD_TIMEOUT = (10, 300)
+# responses of overloaded or restarting servers, the submission was not processed
+RETRY_STATUS_CODES = (502, 503, 504)
+# upload form URLs that rejected a gzip compressed file but accepted it
+# uncompressed, see compress="auto"
+_UNCOMPRESSED_URLS = set()
+
+
+class UploadError(Exception):
+    """Raised by post_many if some of the submissions failed. The URLs of
+    the successful ones are kept.
+
+    :param urls:    List of URLs in the order of the items, None for the
+                    failed ones (lists of URLs or None per chunk if the items
+                    were split)
+    :param errors:  Dictionary of {item index: exception}, a list of
+                    exceptions or None per chunk if the items were split
+    """
+
+    def __init__(self, urls, errors):
+        first = next(iter(errors.values()))
+        if isinstance(first, list):
+            first = next(e for e in first if e is not None)
+        super().__init__("%d of %d submissions failed, first error: %s" % (
+            len(errors), len(urls), first))
+        self.urls = urls
+        self.errors = errors
+
 
 def _get_error_message(text):
     """Prints the error message from the SWISS-MODEL annotation upload page
@@ -49,6 +88,249 @@ def _get_error_message(text):
         return "Unknown Error"
 
 
+def _to_hex(color):
+    """Validates color and returns it as "#rrggbb" string, see colors.to_hex"""
+    return colors.to_hex(color)
+
+
+def _quantize(annotations, colors, step):
+    """Rounds annotations that are numbers to multiples of step. All of them
+    with the same rounded value get the color of the first one, so that
+    quantized tracks stay consistently colored.
+    """
+    # decimals of the step itself, e.g. 2 for 0.25, so that rounding stays on the grid
+    decimals = max(0, -decimal.Decimal(str(step)).normalize().as_tuple().exponent)
+    quantized = dict()
+    for annotation in set(annotations):
+        try:
+            value = round(round(float(annotation) / step) * step, decimals)
+        except (ValueError, OverflowError):
+            continue
+        quantized[annotation] = str(value) if decimals else str(int(value))
+    new_annotations = list()
+    new_colors = list()
+    first_colors = dict()
+    for annotation, color in zip(annotations, colors):
+        if annotation in quantized:
+            annotation = quantized[annotation]
+            color = first_colors.setdefault(annotation, color)
+        new_annotations.append(annotation)
+        new_colors.append(color)
+    return new_annotations, new_colors
+
+
+def _as_column(value, n, is_scalar):
+    """Repeats value n times if is_scalar(value), otherwise returns it as list.
+    """
+    if is_scalar(value):
+        return [value] * n
+    return list(value)
+
+
+def _is_single_color(color):
+    """Whether color is one color (a string or an RGB(A) tuple) rather than
+    a sequence of colors.
+    """
+    if isinstance(color, str):
+        return True
+    try:
+        return len(color) in (3, 4) and all(isinstance(c, numbers.Real) for c in color)
+    except TypeError:
+        return False
+
+
+def _all_of_type(values, types):
+    return all(issubclass(t, types) for t in set(map(type, values)))
+
+
+def _submit(session, url, annotation, title=None, email=None, compress=False,
+            timeout=UPLOAD_TIMEOUT):
+    """Submits one annotation to the upload form and returns the URL it was
+    redirected to.
+
+    :param session:     requests.Session or the requests module
+    :param compress:    Upload the annotation file gzip compressed
+    :param timeout:     (connect, read) timeout in seconds
+    """
+    data = {}
+    if compress:
+        payload = io.BytesIO()
+        annotation.write(payload, compress=True)
+        files = {'annotation_file': ('annotation.csv.gz', payload.getvalue(),
+                                     'application/gzip')}
+    else:
+        files = {'annotation_file': ('annotation.csv', str(annotation))}
+    if title:
+        data["title"] = title
+    if email:
+        data["email"] = email
+    res = session.post(url, data=data, files=files, allow_redirects=False,
+                       timeout=timeout)
+    # Ensure we didn't get an error
+    res.raise_for_status()
+    # Ensure we were redirected
+    if not res.is_redirect:
+        error_msg = _get_error_message(res.text)
+        raise ValueError("The submission of annotations failed: "
+                         "%s" % error_msg)
+    return res.next.url
+
+
+def _is_transient(error):
+    """Errors worth a retry: the submission did not reach the server (the
+    connection could not be established) or the server was unavailable
+    (502, 503, 504). Errors after the form was sent, e.g. read timeouts or
+    dropped connections, are not retried as the annotation may have been
+    submitted already."""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    if isinstance(error, requests.HTTPError):
+        return (error.response is not None
+                and error.response.status_code in RETRY_STATUS_CODES)
+    if isinstance(error, requests.ConnectionError) and not isinstance(
+            error, requests.Timeout):
+        from urllib3.exceptions import NewConnectionError
+        # requests wraps urllib3's MaxRetryError, whose reason is the error
+        reason = error.args[0] if error.args else None
+        reason = getattr(reason, "reason", reason)
+        return isinstance(reason, NewConnectionError)
+    return False
+
+
+def _submit_with_retries(session, url, annotation, title, email, compress,
+                         retries, backoff, timeout=UPLOAD_TIMEOUT):
+    for attempt in range(retries + 1):
+        try:
+            return _submit(session, url, annotation, title=title, email=email,
+                           compress=compress, timeout=timeout)
+        except requests.RequestException as e:
+            if attempt == retries or not _is_transient(e):
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def _submit_negotiated(session, url, annotation, title, email, compress,
+                       retries, backoff, timeout=UPLOAD_TIMEOUT):
+    """Submits with _submit_with_retries. With compress="auto" the file is
+    sent gzip compressed first. If the form rejects it (415 Unsupported Media
+    Type or an error page) it is sent again uncompressed, and if that is
+    accepted, later submissions to url are not compressed anymore."""
+    if compress != "auto":
+        return _submit_with_retries(session, url, annotation, title, email,
+                                    compress, retries, backoff, timeout)
+    if url not in _UNCOMPRESSED_URLS:
+        try:
+            return _submit_with_retries(session, url, annotation, title,
+                                        email, True, retries, backoff,
+                                        timeout)
+        except requests.HTTPError as e:
+            if e.response is None or e.response.status_code != 415:
+                raise
+        except ValueError:
+            pass
+        result_url = _submit_with_retries(session, url, annotation, title,
+                                          email, False, retries, backoff,
+                                          timeout)
+        _UNCOMPRESSED_URLS.add(url)
+        return result_url
+    return _submit_with_retries(session, url, annotation, title, email,
+                                False, retries, backoff, timeout)
+
+
+def _chunk_title(title, i, n):
+    if n == 1:
+        return title
+    return "%s (part %d of %d)" % (title or "Annotation", i + 1, n)
+
+
+def post_many(items, url=ANNOTATION_URL, email=None, max_workers=4,
+              retries=3, backoff=1.0, session=None, compress=False,
+              max_size=None, timeout=UPLOAD_TIMEOUT):
+    """
+    Uploads many annotations over one pooled keep-alive session with at most
+    max_workers submissions in flight. Submissions are retried with
+    exponential backoff if they could not be sent (connection errors) or the
+    server was unavailable (502, 503, 504), but not after errors that may
+    follow an accepted submission, to avoid duplicate uploads.
+    Usage example:
+
+    urls = post_many([("Track 1", annotation_1), ("Track 2", annotation_2)])
+
+    :param items:       Iterable of (title, Annotation) pairs
+    :param url:         URL of annotation upload form, defaults to SWISS-MODEL.
+    :param email:       Filled in email field of every submission if given
+    :param max_workers: Maximal number of concurrent submissions
+    :param retries:     Number of retries per submission
+    :param backoff:     Seconds to wait before the first retry, doubled for
+                        each further one
+    :param session:     requests.Session to use, a pooled one is created if
+                        not given
+    :param compress:    Upload gzip compressed annotation files if True,
+                        or "auto" to try gzip first and fall back to
+                        uncompressed files for forms that reject it
+    :param max_size:    If given, annotations larger than max_size bytes are
+                        split with Annotation.split and uploaded as separate
+                        submissions titled "<title> (part i of n)"; empty
+                        annotations are not uploaded
+    :param timeout:     (connect, read) timeout in seconds of each submission
+    :returns:           List of URLs in the order of items, or of lists of
+                        URLs (one per chunk) if max_size is given
+    :raises UploadError: if any submission failed, after all others were
+                        done. Its urls attribute holds the URLs of the
+                        successful ones.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from requests.adapters import HTTPAdapter
+
+    items = list(items)
+    if not items:
+        return []
+    if max_size is not None:
+        chunked = [annotation.split(max_size) for _, annotation in items]
+        offsets = list(itertools.accumulate([0] + [len(chunks) for chunks in chunked]))
+        try:
+            urls = post_many(
+                [(_chunk_title(title, i, len(chunks)), chunk)
+                 for (title, _), chunks in zip(items, chunked)
+                 for i, chunk in enumerate(chunks)],
+                url=url, email=email, max_workers=max_workers, retries=retries,
+                backoff=backoff, session=session, compress=compress,
+                timeout=timeout)
+        except UploadError as e:
+            # group the chunks again, errors by item
+            errors = {j: [e.errors.get(k) for k in range(start, end)]
+                      for j, (start, end) in enumerate(zip(offsets[:-1], offsets[1:]))
+                      if any(k in e.errors for k in range(start, end))}
+            raise UploadError([e.urls[start:end] for start, end in zip(offsets[:-1], offsets[1:])],
+                              errors) from e
+        return [urls[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+    own_session = session is None
+    if own_session:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    try:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+            futures = [executor.submit(_submit_negotiated, session, url,
+                                       annotation, title, email, compress,
+                                       retries, backoff, timeout)
+                       for title, annotation in items]
+        urls = [None] * len(items)
+        errors = dict()
+        for i, future in enumerate(futures):
+            try:
+                urls[i] = future.result()
+            except Exception as e:
+                errors[i] = e
+        if errors:
+            raise UploadError(urls, errors) from next(iter(errors.values()))
+        return urls
+    finally:
+        if own_session:
+            session.close()
+
+
 class Annotation:
     """
     Helper class to programmatically define annotations and format according
@@ -76,6 +358,10 @@ class Annotation:
     # https://swissmodel.expasy.org/repository/annotation
     print(annotation)
 
+    # Many annotations at once, e.g. one per residue
+    annotation.add_many("P0DTD1", [40, 41, 42], [40, 41, 45], 
+                        ["red", "#00FF00", (0.0, 0.0, 1.0)], ["a", "b", "c"])
+
     # or directly do a post request (defaults to SWISS-MODEL)
     print("Visit the following url to see awesome things:")
     print(annotation.post(title="awesome things"))
@@ -83,11 +369,19 @@ class Annotation:
 
     def __init__(self):
         self.uniprot_acs = list()
-        self.rnum_ranges = list()
+        self.starts = array.array("l")
+        self.ends = array.array("l")
         self.colors = list()
         self.annotations = list()
         self.references = list()
 
+    @property
+    def rnum_ranges(self):
+        """
+        List of (start, end) tuples of all annotations
+        """
+        return list(zip(self.starts, self.ends))
+
     def add(self, uniprot_ac, rnum, color, annotation, reference=None):
         """
         Check for valid data and add new annotation
@@ -111,7 +405,7 @@ class Annotation:
         if not uniprot.valid_uniprot_ac_pattern(uniprot_ac):
             raise ValueError("uniprot_ac is invalid")
 
-        if isinstance(rnum, int):
+        if isinstance(rnum, numbers.Integral):
             if rnum < 1:
                 raise ValueError("Expect rnum >= 1")
         elif isinstance(rnum, tuple) or isinstance(rnum, list):
@@ -121,12 +415,13 @@ class Annotation:
                 )
             if rnum[0] < 1 or rnum[1] < 1:
                 raise ValueError("Expect rnum >= 1 for all rnum")
-
-        if not mpl.colors.is_color_like(color):
+        else:
             raise ValueError(
-                "Only accept color formats specified in https://matplotlib.org/3.2.1/api/colors_api.html"
+                "Expect rnum to be integer or tuple/list with two elements"
             )
 
+        hex_color = _to_hex(color)
+
         if not isinstance(annotation, str):
             raise ValueError("Expect annotation to be str")
 
@@ -136,19 +431,171 @@ class Annotation:
 
         # all input is valid, add annotation
         self.uniprot_acs.append(uniprot_ac)
-        if isinstance(rnum, int):
-            self.rnum_ranges.append((rnum, rnum))
+        if isinstance(rnum, numbers.Integral):
+            self.starts.append(rnum)
+            self.ends.append(rnum)
         else:
-            self.rnum_ranges.append(rnum)
-        self.colors.append(color)
+            self.starts.append(rnum[0])
+            self.ends.append(rnum[1])
+        self.colors.append(hex_color)
         self.annotations.append(annotation)
         self.references.append(reference)
 
+    def add_many(self, uniprot_ac, starts, ends, colors, annotations, references=None):
+        """
+        Check for valid data and add many annotations at once. Every check is
+        done once per column (or once per distinct value) instead of per row.
+
+        :param uniprot_ac:   Valid UniprotAC as string used for all annotations
+                             or a sequence with one UniprotAC per annotation
+        :param starts:       Sequence of start residue numbers (>= 1)
+        :param ends:         Sequence of end residue numbers (>= 1) or None
+                             for single residue annotations
+        :param colors:       Color used for all annotations or a sequence with
+                             one color per annotation, see add
+        :param annotations:  Annotation string used for all annotations or a
+                             sequence with one string per annotation
+        :param references:   Optional reference string used for all annotations
+                             or a sequence with one reference (or None) per
+                             annotation
+        """
+        starts = array.array("l", starts)
+        ends = starts if ends is None else array.array("l", ends)
+        n = len(starts)
+        annotations = _as_column(annotations, n, lambda x: isinstance(x, str))
+        uniprot_acs = _as_column(uniprot_ac, n, lambda x: isinstance(x, str))
+        colors = _as_column(colors, n, _is_single_color)
+        references = _as_column(references, n, lambda x: x is None or isinstance(x, str))
+
+        # check input
+        if not (len(ends) == len(annotations) == len(uniprot_acs) == len(colors) == len(references) == n):
+            raise ValueError("Expect the same number of elements for all columns")
+
+        if not all(uniprot.valid_uniprot_ac_pattern(ac) for ac in set(uniprot_acs)):
+            raise ValueError("uniprot_ac is invalid")
+
+        if n and (min(starts) < 1 or min(ends) < 1):
+            raise ValueError("Expect rnum >= 1 for all rnum")
+
+        colors = [c if isinstance(c, str) else tuple(c) for c in colors]
+        hex_colors = {c: _to_hex(c) for c in set(colors)}
+        colors = [hex_colors[c] for c in colors]
+
+        if not _all_of_type(annotations, str):
+            raise ValueError("Expect annotation to be str")
+
+        if not _all_of_type(references, (str, type(None))):
+            raise ValueError("Expect reference to be None or str")
+
+        # all input is valid, add annotations
+        self.uniprot_acs.extend(uniprot_acs)
+        self.starts.extend(starts)
+        self.ends.extend(ends)
+        self.colors.extend(colors)
+        self.annotations.extend(annotations)
+        self.references.extend(references)
+
+    def compact(self, quantize=None):
+        """
+        Returns a new Annotation in which each run of consecutive annotations
+        covering adjacent residues (end + 1 == next start) with identical
+        UniprotAC, color, annotation and reference is merged into one range.
+        The order of the annotations is kept. Usage example:
+
+        annotation.compact(quantize=0.1)
+
+        :param quantize:    Optional step size. Annotations that are numbers
+                            are rounded to multiples of it before merging and
+                            rows with the same rounded value get the color of
+                            the first of them, which merges longer runs.
+        """
+        import numpy as np
+
+        compacted = Annotation()
+        if not len(self):
+            return compacted
+        annotations, colors = self.annotations, self.colors
+        if quantize:
+            annotations, colors = _quantize(annotations, colors, quantize)
+
+        starts = np.asarray(self.starts)
+        ends = np.asarray(self.ends)
+        same = starts[1:] == ends[:-1] + 1
+        for column in (self.uniprot_acs, colors, annotations, [r or "" for r in self.references]):
+            column = np.asarray(column)
+            same &= column[1:] == column[:-1]
+        run_starts = np.concatenate(([0], np.nonzero(~same)[0] + 1))
+        run_ends = np.concatenate((run_starts[1:] - 1, [len(self) - 1]))
+
+        compacted.uniprot_acs = [self.uniprot_acs[i] for i in run_starts]
+        compacted.starts = array.array(self.starts.typecode, starts[run_starts].tolist())
+        compacted.ends = array.array(self.ends.typecode, ends[run_ends].tolist())
+        compacted.colors = [colors[i] for i in run_starts]
+        compacted.annotations = [annotations[i] for i in run_starts]
+        compacted.references = [self.references[i] for i in run_starts]
+        return compacted
+
+    def split(self, max_size):
+        """
+        Splits the annotations into consecutive Annotation objects whose
+        string representation takes at most max_size bytes. Lines are never
+        split and all annotations of one UniprotAC are kept together whenever
+        they fit into one chunk.
+
+        :param max_size:    Maximal size of each chunk in bytes (UTF-8 text)
+        :returns:           List of Annotation objects, empty if there are no
+                            annotations
+        """
+        if not len(self):
+            return []
+        sizes = [len(line.encode()) + 1 for line in self.iter_lines()]
+        if max(sizes, default=0) - 1 > max_size:
+            raise ValueError("A single annotation line is larger than "
+                             "max_size=%d bytes" % max_size)
+        # sizes of the runs of annotations with the same UniprotAC
+        group_sizes = dict()
+        group_start = 0
+        for i in range(1, len(self) + 1):
+            if i == len(self) or self.uniprot_acs[i] != self.uniprot_acs[group_start]:
+                group_sizes[group_start] = sum(sizes[group_start:i])
+                group_start = i
+        boundaries = [0]
+        chunk_size = 0
+        for i, size in enumerate(sizes):
+            if i in group_sizes and chunk_size and \
+                    chunk_size + group_sizes[i] - 1 > max_size >= group_sizes[i] - 1:
+                # start the next UniprotAC in a new chunk rather than cutting it
+                boundaries.append(i)
+                chunk_size = 0
+            elif chunk_size + size - 1 > max_size:
+                boundaries.append(i)
+                chunk_size = 0
+            chunk_size += size
+        boundaries.append(len(self))
+        return [self[start:end] for start, end in zip(boundaries[:-1], boundaries[1:])]
+
+    def __getitem__(self, index):
+        """
+        Returns a new Annotation with the annotations selected by a slice
+        """
+        if not isinstance(index, slice):
+            raise TypeError("Annotation can only be indexed with a slice")
+        selected = Annotation()
+        selected.uniprot_acs = self.uniprot_acs[index]
+        selected.starts = self.starts[index]
+        selected.ends = self.ends[index]
+        selected.colors = self.colors[index]
+        selected.annotations = self.annotations[index]
+        selected.references = self.references[index]
+        return selected
+
     def post(
         self,
-        url="https://swissmodel.expasy.org/repository/annotation",
+        url=ANNOTATION_URL,
         title=None,
         email=None,
+        compress=False,
+        timeout=UPLOAD_TIMEOUT,
     ):
         """
         Performs post request and returns the url at which the annotations can
@@ -156,47 +603,157 @@ class Annotation:
 
         print("visit", annotation.post(), "to see awesome things")
 
-        :param url:     URL of annotation upload form, defaults to SWISS-MODEL.
-        :param title:   Filled in project title field if given
-        :param email:   Filled in email field if given
-        """
-        data = {}
-        files = {'annotation_file': ('annotation.csv', str(self))}
-        if title:
-            data["title"] = title
-        if email:
-            data["email"] = email
-        res = requests.post(url, data=data, files=files, allow_redirects=False)
-        # Ensure we didn't get an error
-        res.raise_for_status()
-        # Ensure we were redirected
-        if not res.is_redirect:
-            error_msg = _get_error_message(res.text)
-            raise ValueError("The submission of annotations failed: "
-                             "%s" % error_msg)
-        return res.next.url
+        To upload many annotations at once, see post_many, to upload large
+        annotations in several parts, see post_chunks.
+
+        :param url:         URL of annotation upload form, defaults to
+                            SWISS-MODEL.
+        :param title:       Filled in project title field if given
+        :param email:       Filled in email field if given
+        :param compress:    Upload the annotation file gzip compressed if
+                            True, or "auto" to try gzip first and fall back
+                            to an uncompressed file if the form rejects it
+        :param timeout:     (connect, read) timeout in seconds
+        """
+        return _submit_negotiated(requests, url, self, title, email, compress,
+                                  retries=0, backoff=0, timeout=timeout)
+
+    def post_chunks(
+        self,
+        max_size,
+        url=ANNOTATION_URL,
+        title=None,
+        email=None,
+        compress=False,
+        timeout=UPLOAD_TIMEOUT,
+    ):
+        """
+        Splits the annotations into chunks of at most max_size bytes (see
+        split) and submits them one at a time, titled "<title> (part i of n)"
+        if there are several. Returns the list of URLs, one per chunk, which
+        is empty for an empty annotation.
+
+        :param max_size:    Maximal size of each chunk in bytes
+        :param url:         URL of annotation upload form, defaults to
+                            SWISS-MODEL.
+        :param title:       Filled in project title field if given
+        :param email:       Filled in email field if given
+        :param compress:    See post
+        :param timeout:     (connect, read) timeout in seconds
+        :raises UploadError: if a chunk could not be submitted
+        """
+        return post_many([(title, self)], url=url, email=email,
+                         compress=compress, max_size=max_size,
+                         max_workers=1, timeout=timeout)[0]
+
+    @classmethod
+    def from_string(cls, text):
+        """
+        Parses annotations in the format accepted on
+        https://swissmodel.expasy.org/repository/annotation, i.e. lines of 5
+        or 6 tab- or comma-separated values. Empty lines and lines starting
+        with # are skipped. All rows are validated and added at once with
+        add_many.
+
+        :param text: Content of an annotation file as string
+        """
+        lines = [line for line in text.splitlines() if line.strip() and not line.startswith("#")]
+        annotation = cls()
+        if not lines:
+            return annotation
+        separator = "\t" if "\t" in lines[0] else ","
+        rows = [line.split(separator, 5) for line in lines]
+        if not all(len(row) in (5, 6) for row in rows):
+            raise ValueError("Expect 5 or 6 %s separated values per line"
+                             % ("tab" if separator == "\t" else "comma"))
+        uniprot_acs, starts, ends, colors = zip(*[row[:4] for row in rows])
+        annotation.add_many(
+            [ac.strip() for ac in uniprot_acs],
+            [int(start) for start in starts],
+            [int(end) for end in ends],
+            [color.strip() for color in colors],
+            [row[-1] for row in rows],
+            [row[4] or None if len(row) == 6 else None for row in rows],
+        )
+        return annotation
+
+    @classmethod
+    def from_file(cls, filename):
+        """
+        Reads an annotation file, see from_string. Files ending with .gz are
+        decompressed.
+
+        :param filename: Path to the annotation file
+        """
+        opener = gzip.open if str(filename).endswith(".gz") else open
+        with opener(filename, "rt") as f:
+            return cls.from_string(f.read())
+
+    def digest(self):
+        """
+        SHA-256 hex digest of str(self), computed without building the full
+        string. Can be used to detect whether a track changed.
+        """
+        sha = hashlib.sha256()
+        separator = b""
+        for line in self.iter_lines():
+            sha.update(separator + line.encode())
+            separator = b"\n"
+        return sha.hexdigest()
+
+    def iter_lines(self):
+        """
+        Yields the formatted annotations one line (without line break) at a
+        time, see __str__
+        """
+        for uniprot_ac, start, end, color, reference, annotation in zip(
+            self.uniprot_acs, self.starts, self.ends, self.colors, self.references, self.annotations
+        ):
+            if reference:
+                yield "\t".join((uniprot_ac, str(start), str(end), color, reference, annotation))
+            else:
+                yield "\t".join((uniprot_ac, str(start), str(end), color, annotation))
+
+    def write(self, fileobj, compress=False, chunk_size=1000):
+        """
+        Writes the same content as str(self) to a file object, formatting
+        chunk_size lines at a time so that memory use does not grow with the
+        number of annotations. Usage example:
+
+        with open("annotation.txt", "w") as f:
+            annotation.write(f)
+
+        with open("annotation.txt.gz", "wb") as f:
+            annotation.write(f, compress=True)
+
+        :param fileobj:     File object opened in text mode, or in binary mode
+                            if compress is True
+        :param compress:    Write gzip compressed data
+        :param chunk_size:  Number of lines formatted per write call
+        """
+        if compress:
+            with gzip.GzipFile(fileobj=fileobj, mode="wb") as gzip_file:
+                self._write_chunks(gzip_file, chunk_size, encode=True)
+        else:
+            self._write_chunks(fileobj, chunk_size)
+
+    def _write_chunks(self, fileobj, chunk_size, encode=False):
+        lines = self.iter_lines()
+        separator = ""
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                break
+            data = separator + "\n".join(chunk)
+            fileobj.write(data.encode() if encode else data)
+            separator = "\n"
 
     def __str__(self):
         """
         Processes annotation and return string which is accepted on
         https://swissmodel.expasy.org/repository/annotation
         """
-        n = len(self.uniprot_acs)
-        formatted_annos = [self._format_anno(idx) for idx in range(n)]
-        return "\n".join(formatted_annos)
+        return "\n".join(self.iter_lines())
 
     def __len__(self):
         return len(self.annotations)
-
-    def _format_anno(self, idx):
-        if idx < 0 or idx >= len(self.uniprot_acs):
-            raise ValueError("Invalid idx in line formatting")
-        data = list()
-        data.append(self.uniprot_acs[idx])
-        data.append(str(self.rnum_ranges[idx][0]))
-        data.append(str(self.rnum_ranges[idx][1]))
-        data.append(mpl.colors.to_hex(self.colors[idx]))
-        if self.references[idx]:
-            data.append(self.references[idx])
-        data.append(self.annotations[idx])
-        return "\t".join(data)
@@ -1,5 +1,9 @@
 import re
-import urllib.request
+
+from . import lazy
+
+# requests (via fetch) is only needed to download sequences
+fetch = lazy.lazy_import(".fetch", __package__)
 
 """
 Collection of handy functions related to uniprot. Potential reimplementations
@@ -8,6 +12,9 @@ dependencies at a minimum.
 """
 
 
+AC_PATTERN = re.compile("[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9]([A-Z][A-Z0-9]{2}[0-9]){1,2}")
+
+
 def valid_uniprot_ac_pattern(uniprot_ac):
     """
     Checks whether Uniprot AC is formally correct according to
@@ -17,8 +24,7 @@ def valid_uniprot_ac_pattern(uniprot_ac):
     :param uniprot_ac:  Accession code to be checked
 
     """
-    ac_pat = "[OPQ][0-9][A-Z0-9]{3}[0-9]|[A-NR-Z][0-9]([A-Z][A-Z0-9]{2}[0-9]){1,2}"
-    if re.match(ac_pat, uniprot_ac):
+    if AC_PATTERN.match(uniprot_ac):
         return True
     else:
         return False
@@ -37,8 +43,7 @@ def seq_from_ac(uniprot_ac):
     try:
         # that's the default uniprot access
         url = "https://www.uniprot.org/uniprot/%s.fasta" % uniprot_ac
-        with urllib.request.urlopen(url) as response:
-            data = response.readlines()
+        data = fetch.get_text(url).splitlines()
 
     except:
         # this is only temporary, as SARS-CoV2 is not yet in uniprot
@@ -46,7 +51,6 @@ def seq_from_ac(uniprot_ac):
             "https://www.ebi.ac.uk/uniprot/api/covid-19/uniprotkb/accession/%s.fasta"
             % (uniprot_ac)
         )
-        with urllib.request.urlopen(url) as response:
-            data = response.readlines()
+        data = fetch.get_text(url).splitlines()
 
-    return "".join(line.decode().strip() for line in data[1:])
+    return "".join(line.strip() for line in data[1:])